@@ -0,0 +1,165 @@
+"""Scan pool states for arbitrage between the AMM, the vault and the oracle
+
+Routes, each sized to maximize the profit in coin:
+
+    mint_sell:    mint q pairs for q*C coin, sell q long and q short to the pool
+    buy_redeem:   buy q long and q short from the pool, redeem q pairs for q*C coin
+    long_oracle:  buy or sell long tokens in the pool and value them at v*C
+    short_oracle: buy or sell short tokens in the pool and value them at (1-v)*C
+
+Selling both tokens leaves the pool coin balance at
+x_c * a_l**(w_l/w_c) * a_s**(w_s/w_c) with a = x/(x + q*(1-sF)), whatever the
+order, so mint_sell profit is a concave function of q.  Buying is done long
+first then short, as fees paid on the first purchase stay in the pool.  Both
+pair routes are sized with a fixed number of vectorized bisection steps on
+the marginal profit, and the oracle routes use the closed form target price
+solver with the fee-inclusive marginal price as target.
+
+Sizes are limited so that every leg respects the pool MAX_IN_RATIO and
+MAX_OUT_RATIO, for the tokens and for the coin.  Everything is computed for
+all states at once:
+
+    result = scan(states, v, coin_per_pair=100, sF=0.003)
+    result['mint_sell']['profit'], result['best_route']
+"""
+import numpy as np
+
+from .amm_batch import as_states, max_amount_in, N_TOK, MAX_IN_RATIO, MAX_OUT_RATIO
+from .amm_math import calc_out_given_in
+from .amm_target import trade_to_price
+
+N_BISECT = 50
+# Relative margin keeping sizes derived from the coin ratio limits inside them after rounding
+RATIO_MARGIN = 1e-12
+ROUTES = ['mint_sell', 'buy_redeem', 'long_oracle', 'short_oracle']
+
+
+def _bisect_decreasing(marginal, q_max, n_bisect=N_BISECT):
+    """Largest q in [0, q_max] with marginal(q) >= 0 for decreasing marginal, 0 if marginal(0) < 0"""
+    lo = np.zeros_like(q_max)
+    hi = q_max.copy()
+    positive = marginal(hi) >= 0
+    for _ in range(n_bisect):
+        mid = 0.5 * (lo + hi)
+        up = marginal(mid) >= 0
+        lo = np.where(up, mid, lo)
+        hi = np.where(up, hi, mid)
+    return np.where(positive, q_max, lo)
+
+
+def mint_sell(states, coin_per_pair, sF=0, mint_fee=0, n_bisect=N_BISECT):
+    """Optimal mint and sell pairs arbitrage
+
+    :param mint_fee: vault mint fee as a fraction of collateral
+    :return: (pairs, profit) length N arrays
+    """
+    x_c, x_l, x_s, w_c, w_l, w_s = as_states(states).T
+    r_l, r_s = w_l / w_c, w_s / w_c
+    cost = coin_per_pair * (1 + mint_fee)
+
+    def coin_left(q):
+        q_in = q * (1 - sF)
+        return x_c * (x_l / (x_l + q_in))**r_l * (x_s / (x_s + q_in))**r_s
+
+    def marginal(q):
+        q_in = q * (1 - sF)
+        return coin_left(q) * (1 - sF) * (r_l / (x_l + q_in) + r_s / (x_s + q_in)) - cost
+
+    # Each sale takes at most MAX_OUT_RATIO of the coin it sees:
+    # a**r >= 1 - MAX_OUT_RATIO with a = x/(x + q*(1-sF))
+    def coin_out_limit(x, r):
+        return x * ((1 - MAX_OUT_RATIO)**(-1 / r) - 1) / (1 - sF) * (1 - RATIO_MARGIN)
+
+    q_max = np.minimum.reduce([
+        MAX_IN_RATIO * np.minimum(x_l, x_s), coin_out_limit(x_l, r_l), coin_out_limit(x_s, r_s)])
+    q = _bisect_decreasing(marginal, q_max, n_bisect)
+    return q, x_c - coin_left(q) - q * cost
+
+
+def buy_redeem(states, coin_per_pair, sF=0, redeem_fee=0, n_bisect=N_BISECT):
+    """Optimal buy pairs and redeem arbitrage, buying long then short
+
+    :param redeem_fee: vault redeem fee as a fraction of collateral
+    :return: (pairs, profit) length N arrays
+    """
+    x_c, x_l, x_s, w_c, w_l, w_s = as_states(states).T
+    r_l, r_s = w_l / w_c, w_s / w_c
+    value = coin_per_pair * (1 - redeem_fee)
+
+    def coin_in(q):
+        a = (x_l / (x_l - q))**r_l
+        b = (x_s / (x_s - q))**r_s
+        x_c_1 = x_c * (1 + (a - 1) / (1 - sF))
+        return x_c_1 - x_c + x_c_1 * (b - 1) / (1 - sF)
+
+    def marginal(q):
+        a = (x_l / (x_l - q))**r_l
+        b = (x_s / (x_s - q))**r_s
+        da = a * r_l / (x_l - q)
+        db = b * r_s / (x_s - q)
+        x_c_1 = x_c * (1 + (a - 1) / (1 - sF))
+        d_x_c_1 = x_c * da / (1 - sF)
+        return value - (d_x_c_1 * (1 + (b - 1) / (1 - sF)) + x_c_1 * db / (1 - sF))
+
+    # Each purchase pays in at most MAX_IN_RATIO of the coin it sees:
+    # (a - 1)/(1 - sF) <= MAX_IN_RATIO with a = (x/(x - q))**r
+    def coin_in_limit(x, r):
+        return x * (1 - (1 + MAX_IN_RATIO * (1 - sF))**(-1 / r)) * (1 - RATIO_MARGIN)
+
+    q_max = np.minimum.reduce([
+        MAX_OUT_RATIO * np.minimum(x_l, x_s), coin_in_limit(x_l, r_l), coin_in_limit(x_s, r_s)])
+    q = _bisect_decreasing(marginal, q_max, n_bisect)
+    return q, q * value - coin_in(q)
+
+
+def oracle_swap(states, v, coin_per_pair, is_long=True, sF=0):
+    """Optimal swap of long (or short) tokens against the oracle price
+
+    Buys from the pool until the marginal price including fee reaches the
+    oracle price, or sells until the marginal coin out reaches it.
+
+    :return: (from_coin, amount_in, profit) length N arrays, profit valued at the oracle price
+    """
+    states = as_states(states)
+    tok_ind = 1 if is_long else 2
+    x_c, x_t, w_c, w_t = (states[:, i] for i in (0, tok_ind, N_TOK, tok_ind + N_TOK))
+    v = np.asarray(v, dtype=float)
+    oracle_price = np.broadcast_to((v if is_long else 1 - v) * coin_per_pair, x_c.shape)
+    spot = (x_c / w_c) / (x_t / w_t)
+    buy = spot < oracle_price * (1 - sF)
+    sell = spot > oracle_price / (1 - sF)
+    target = np.where(buy, oracle_price * (1 - sF), np.where(sell, oracle_price / (1 - sF), spot))
+    from_coin, amount_in = trade_to_price(states, target, is_long=is_long, sF=sF)
+    amount_in = np.where(buy | sell, amount_in, 0.)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        limit = np.where(
+            from_coin, max_amount_in(x_t, w_t, x_c, w_c, sF), max_amount_in(x_c, w_c, x_t, w_t, sF))
+        amount_in = np.minimum(amount_in, limit)
+        tokens_out = calc_out_given_in(x_t, w_t, x_c, w_c, amount_in, sF)
+        coin_out = calc_out_given_in(x_c, w_c, x_t, w_t, amount_in, sF)
+    profit = np.where(from_coin, tokens_out * oracle_price - amount_in, coin_out - amount_in * oracle_price)
+    return from_coin, amount_in, np.where(buy | sell, profit, 0.)
+
+
+def scan(states, v, coin_per_pair, sF=0, mint_fee=0, redeem_fee=0, n_bisect=N_BISECT):
+    """Optimal size and profit of every route for each state
+
+    :param states: (N, 6) pool states
+    :param v: oracle price fraction (priceSpot - priceFloor)/(priceCap - priceFloor), scalar or length N
+    :param coin_per_pair: coin to mint one long and one short token, scalar or length N
+    :return: dict route -> dict of arrays ('size' and 'profit', and 'from_coin'
+        for oracle routes), plus 'best_route' index into ROUTES and 'best_profit'
+    """
+    states = as_states(states)
+    result = {}
+    for route, fun in [('mint_sell', mint_sell), ('buy_redeem', buy_redeem)]:
+        fee = mint_fee if route == 'mint_sell' else redeem_fee
+        size, profit = fun(states, coin_per_pair, sF, fee, n_bisect)
+        result[route] = {'size': size, 'profit': profit}
+    for route, is_long in [('long_oracle', True), ('short_oracle', False)]:
+        from_coin, size, profit = oracle_swap(states, v, coin_per_pair, is_long, sF)
+        result[route] = {'size': size, 'profit': profit, 'from_coin': from_coin}
+    profits = np.stack([result[route]['profit'] for route in ROUTES])
+    result['best_route'] = profits.argmax(axis=0)
+    result['best_profit'] = profits.max(axis=0)
+    return result
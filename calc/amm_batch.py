@@ -0,0 +1,466 @@
+"""Batch versions of the AMM state functions in amm_math
+
+N pool states are held as an (N, 6) float array using the same column layout
+as the scalar state lists: coin, long and short balances followed by coin,
+long and short weights.  Every function applies one action to all rows in a
+single vectorized call and returns the same values as its scalar counterpart,
+up to floating point rounding.
+Per-row parameters (trade sizes, oracle prices, directions) may be passed as
+arrays of length N or as scalars to apply to every state.
+"""
+import time
+
+import numpy as np
+
+from .amm_math import (
+    calc_out_given_in, calc_in_given_out, set_amm_state, simple_swap_from_coin, mint_redeem,
+    deposit_withdraw
+)
+
+COIN_IND = 0
+LTK_IND = 1
+STK_IND = 2
+N_TOK = 3
+
+# Largest trade as a fraction of the pool balances of the input and output
+# tokens, as MAX_IN_RATIO and MAX_OUT_RATIO in the Balancer pool
+MAX_IN_RATIO = 0.5
+MAX_OUT_RATIO = 1/3
+
+# Rows processed per block: large batches are split so that the temporaries
+# for one block stay in cache, which is roughly twice as fast as operating on
+# whole columns of 1e5+ rows at once.
+BLOCK_SIZE = 8192
+
+
+def as_states(states):
+    """Return states as an (N, 6) float array, promoting a single state to N=1
+
+    Arrays are kept in Fortran order so that each balance and weight column is
+    contiguous in memory, which is what all the column-wise arithmetic below
+    operates on.
+    """
+    states = np.asarray(states, dtype=float, order='F')
+    if states.ndim == 1:
+        states = states.reshape(1, -1, order='F')
+    if states.shape[1] != 2 * N_TOK:
+        raise ValueError('States must have 6 columns', states.shape)
+    return states
+
+
+def _in_blocks(kernel, states, row_args, **kwargs):
+    """Apply kernel to blocks of BLOCK_SIZE rows and collect the results
+
+    kernel(states, out, *row_args, **kwargs) writes the new states for a block
+    into out and returns (tok_out, avg_price).  Entries of row_args may be
+    scalars or length N arrays, the latter are sliced with the states.
+
+    :return: (new_states, tok_out, avg_price)
+    """
+    n = states.shape[0]
+    new_states = np.empty((n, 2 * N_TOK), order='F')
+    row_args = [
+        np.broadcast_to(arg, (n,)) if np.ndim(arg) else arg for arg in row_args
+    ]
+    tok_out = np.empty(n)
+    avg_price = np.empty(n)
+    for start in range(0, n, BLOCK_SIZE):
+        block = slice(start, start + BLOCK_SIZE)
+        tok_out[block], avg_price[block] = kernel(
+            states[block], new_states[block],
+            *(arg[block] if np.ndim(arg) else arg for arg in row_args), **kwargs)
+    return new_states, tok_out, avg_price
+
+
+def batch_set_amm_state(x_c, x_l, x_s, v, C, sF=0, out=None):
+    """Vectorized set_amm_state: return (N, 6) states with weights set for each row
+
+    The arithmetic matches set_amm_state up to floating point rounding, and is
+    done with in-place updates of the output columns to avoid temporary arrays.
+
+    :param out: optional (N, 6) array to write the states into
+    """
+    if out is None:
+        shape = np.broadcast(x_c, x_l, x_s, v, C).shape or (1,)
+        out = np.empty(shape + (2 * N_TOK,), order='F').reshape(-1, 2 * N_TOK, order='F')
+    states = out
+    states[:, 0] = x_c
+    states[:, 1] = x_l
+    states[:, 2] = x_s
+    x_c, x_l, x_s = states[:, 0], states[:, 1], states[:, 2]
+    w_c, w_l, w_s = states[:, 3], states[:, 4], states[:, 5]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # denom = C*x_l*x_s - x_c*(v*(x_l - x_s) - x_l)
+        np.multiply(x_l, x_s, out=w_l)
+        w_l *= C
+        np.subtract(x_l, x_s, out=w_c)
+        w_c *= v
+        w_c -= x_l
+        w_c *= x_c
+        denom = w_l - w_c
+        w_c /= denom
+        # w_l = v*C*x_l*x_s/denom, w_s = (1 - v)*C*x_l*x_s/denom
+        w_l /= denom
+        w_s[:] = w_l
+        w_l *= v
+        w_s -= w_l
+
+    if not (x_l.all() and x_s.all()):
+        states[(x_l == 0) | (x_s == 0), 3:] = [1., 0., 0.]
+    return states
+
+
+def _spot_price_columns(states, sF=0):
+    """L and S spot prices of each row as two length N arrays
+    """
+    coin_ratio = states[:, COIN_IND] / states[:, COIN_IND + N_TOK]
+    return tuple(
+        coin_ratio / (states[:, tok_ind] / states[:, tok_ind + N_TOK]) / (1 - sF)
+        for tok_ind in (LTK_IND, STK_IND)
+    )
+
+
+def batch_get_amm_spot_prices(states, sF=0):
+    """Return (N, 2) array of L and S prices in units of coin
+    """
+    return np.column_stack(_spot_price_columns(as_states(states), sF))
+
+
+def max_amount_in(bO, wO, bI, wI, sF=0):
+    """Largest amount in accepted by the pool for the given token balances and weights"""
+    return np.minimum(MAX_IN_RATIO * bI, calc_in_given_out(bO, wO, bI, wI, MAX_OUT_RATIO * bO, sF))
+
+
+def batch_get_amm_balance(states):
+    states = as_states(states)
+    ltk_price, stk_price = _spot_price_columns(states)
+    return states[:, 0] + states[:, 1]*ltk_price + states[:, 2]*stk_price
+
+
+def _rebalance(out, x_c, x_l, x_s, v, coin_per_pair, rebalance_fun):
+    """Write rebalance_fun(x_c, x_l, x_s, v, coin_per_pair) into out
+
+    rebalance_fun may return an (N, 6) array or, like the amm_math state
+    functions, a list of 6 columns or scalars.
+    """
+    if rebalance_fun is batch_set_amm_state:
+        batch_set_amm_state(x_c, x_l, x_s, v, coin_per_pair, out=out)
+        return
+    new_states = rebalance_fun(x_c, x_l, x_s, v, coin_per_pair)
+    if isinstance(new_states, np.ndarray) and new_states.ndim == 2:
+        out[:] = new_states
+    else:
+        out[:] = np.column_stack(np.broadcast_arrays(*new_states))
+
+
+def _rebalance_to_spot_ratio(states, out, x_c, x_l, x_s, coin_per_pair, rebalance_fun):
+    """Rebalance new balances x_c, x_l, x_s (weights from states) to their spot price ratio
+
+    Only the balance columns are passed in so that rebalanced swaps never
+    build the intermediate state array.
+    """
+    # Ratio of long price to sum of long and short prices, coin balance cancels
+    ltk_ratio = states[:, LTK_IND + N_TOK] / x_l
+    stk_ratio = states[:, STK_IND + N_TOK] / x_s
+    stk_ratio += ltk_ratio
+    ltk_ratio /= stk_ratio
+    _rebalance(out, x_c, x_l, x_s, ltk_ratio, coin_per_pair, rebalance_fun)
+
+
+def _set_balances(states, out, x_c, x_l, x_s):
+    """Write balances into out keeping the weights of states
+    """
+    out[:, 0] = x_c
+    out[:, 1] = x_l
+    out[:, 2] = x_s
+    out[:, N_TOK:] = states[:, N_TOK:]
+
+
+def _token_columns(states, long_side):
+    """Balance and weight of the position token traded by each row
+
+    long_side is either a single bool, in which case column views are returned,
+    or a length N bool array selecting long or short per row.
+    """
+    if np.ndim(long_side) == 0:
+        tok_ind = LTK_IND if long_side else STK_IND
+        return states[:, tok_ind], states[:, tok_ind + N_TOK]
+    long_side = np.asarray(long_side, dtype=bool)
+    return (
+        np.where(long_side, states[:, LTK_IND], states[:, STK_IND]),
+        np.where(long_side, states[:, LTK_IND + N_TOK], states[:, STK_IND + N_TOK])
+    )
+
+
+def _new_token_balances(states, long_side, new_balance):
+    """Long and short balance columns after replacing the traded token balance
+    """
+    if np.ndim(long_side) == 0:
+        if long_side:
+            return new_balance, states[:, STK_IND]
+        return states[:, LTK_IND], new_balance
+    long_side = np.asarray(long_side, dtype=bool)
+    return (
+        np.where(long_side, new_balance, states[:, LTK_IND]),
+        np.where(long_side, states[:, STK_IND], new_balance)
+    )
+
+
+def batch_swap_from_coin(states, aI, to_long=True, sF=0, coin_per_pair=1,
+                         rebalance=False, rebalance_fun=batch_set_amm_state):
+    """Swap aI coins in for the specified token in every state
+
+    :param states: (N, 6) states
+    :param aI: coin in, scalar or length N
+    :param to_long: bool or length N bool array, True to buy long tokens
+    :param rebalance_fun: batch_set_amm_state, or f(x_c, x_l, x_s, v, C) returning an
+        (N, 6) array or a list of 6 columns such as set_amm_state_closed_form
+    :return: (new_states, aO, avg_price) with aO and avg_price of length N
+    """
+    return _in_blocks(
+        _swap_from_coin, as_states(states), (aI, to_long),
+        sF=sF, coin_per_pair=coin_per_pair, rebalance=rebalance, rebalance_fun=rebalance_fun)
+
+
+def _swap_from_coin(states, out, aI, to_long, sF, coin_per_pair, rebalance, rebalance_fun):
+    bO, wO = _token_columns(states, to_long)
+    bI = states[:, COIN_IND]
+    wI = states[:, COIN_IND + N_TOK]
+    aO = calc_out_given_in(bO, wO, bI, wI, aI, sF)
+    avg_price = aI / aO
+
+    x_l, x_s = _new_token_balances(states, to_long, bO - aO)
+    if rebalance:
+        _rebalance_to_spot_ratio(states, out, bI + aI, x_l, x_s, coin_per_pair, rebalance_fun)
+    else:
+        _set_balances(states, out, bI + aI, x_l, x_s)
+    return aO, avg_price
+
+
+def batch_swap_to_coin(states, aI, from_long=True, sF=0, coin_per_pair=1,
+                       rebalance=False, rebalance_fun=batch_set_amm_state):
+    """Swap aI position tokens in for coin in every state
+
+    :param states: (N, 6) states
+    :param aI: position tokens in, scalar or length N
+    :param from_long: bool or length N bool array, True to sell long tokens
+    :param rebalance_fun: batch_set_amm_state, or f(x_c, x_l, x_s, v, C) returning an
+        (N, 6) array or a list of 6 columns such as set_amm_state_closed_form
+    :return: (new_states, aO, avg_price) with aO and avg_price of length N
+    """
+    return _in_blocks(
+        _swap_to_coin, as_states(states), (aI, from_long),
+        sF=sF, coin_per_pair=coin_per_pair, rebalance=rebalance, rebalance_fun=rebalance_fun)
+
+
+def _swap_to_coin(states, out, aI, from_long, sF, coin_per_pair, rebalance, rebalance_fun):
+    bO = states[:, COIN_IND]
+    wO = states[:, COIN_IND + N_TOK]
+    bI, wI = _token_columns(states, from_long)
+    aO = calc_out_given_in(bO, wO, bI, wI, aI, sF)
+    avg_price = aO / aI
+
+    x_l, x_s = _new_token_balances(states, from_long, bI + aI)
+    if rebalance:
+        _rebalance_to_spot_ratio(states, out, bO - aO, x_l, x_s, coin_per_pair, rebalance_fun)
+    else:
+        _set_balances(states, out, bO - aO, x_l, x_s)
+    return aO, avg_price
+
+
+def _mint_redeem_balances(n_c_0, n_l_0, n_s_0, a_c, coin_per_pair):
+    """Balances and tokens out after minting (a_c >= 0) or redeeming (a_c < 0)
+
+    Raises ValueError if any row has insufficient coin or tokens, matching
+    the scalar mint_redeem.
+    """
+    mint = a_c >= 0
+    if mint.all():
+        if np.any(n_c_0 < a_c):
+            raise ValueError('Insufficent coin')
+        d_tok = a_c / coin_per_pair
+        return n_c_0 - a_c, n_l_0 + d_tok, n_s_0 + d_tok, d_tok
+
+    r_c = -a_c
+    if not mint.any():
+        if np.any(r_c > np.minimum(n_s_0, n_l_0)):
+            raise ValueError('Insufficent token')
+        return n_c_0 + r_c * coin_per_pair, n_l_0 - r_c, n_s_0 - r_c, a_c * coin_per_pair
+
+    # Mixture of mints and redeems
+    if np.any(mint & (n_c_0 < a_c)):
+        raise ValueError('Insufficent coin')
+    if np.any(~mint & (r_c > np.minimum(n_s_0, n_l_0))):
+        raise ValueError('Insufficent token')
+    d_tok = np.where(mint, a_c / coin_per_pair, -r_c)
+    n_c_1 = np.where(mint, n_c_0 - a_c, n_c_0 + r_c * coin_per_pair)
+    tok_out = np.where(mint, a_c / coin_per_pair, a_c * coin_per_pair)
+    return n_c_1, n_l_0 + d_tok, n_s_0 + d_tok, tok_out
+
+
+def batch_mint_redeem(states, a_c, coin_per_pair=100, rebalance=False, **kwargs):
+    """Mint (a_c >= 0 coin) or redeem (a_c < 0 pairs) in every state
+    """
+    return _in_blocks(
+        _mint_redeem, as_states(states), (a_c,),
+        coin_per_pair=coin_per_pair, rebalance=rebalance)
+
+
+def _mint_redeem(states, out, a_c, coin_per_pair, rebalance):
+    a_c = np.broadcast_to(np.asarray(a_c, dtype=float), states.shape[:1])
+    n_c_1, n_l_1, n_s_1, tok_out = _mint_redeem_balances(
+        states[:, 0], states[:, 1], states[:, 2], a_c, coin_per_pair)
+    avg_price = coin_per_pair / 2
+
+    if rebalance:
+        # Keep same spot price as original
+        v = (states[:, COIN_IND] / states[:, COIN_IND + N_TOK]
+             / (states[:, LTK_IND] / states[:, LTK_IND + N_TOK]) / coin_per_pair)
+        batch_set_amm_state(n_c_1, n_l_1, n_s_1, v, coin_per_pair, out=out)
+    else:
+        _set_balances(states, out, n_c_1, n_l_1, n_s_1)
+    return tok_out, avg_price
+
+
+def batch_deposit_withdraw(
+        states, a_c, coin_per_pair=100, oracle_price=50, deposit=True,
+        rebalance=True, rebalance_type='oracle', token_fraction=0.5,
+        rebalance_fun=batch_set_amm_state, **kwargs
+):
+    """Deposit or withdraw a_c coin of liquidity in every state, see deposit_withdraw
+
+    :param rebalance_fun: as for batch_swap_from_coin
+    """
+    if rebalance:
+        if rebalance_type not in {'oracle', 'amm', 'weighted'}:
+            raise ValueError('Unknown rebalance type: ', rebalance_type)
+        if rebalance_type == 'weighted' and not deposit:
+            raise ValueError('Not implemented')
+    return _in_blocks(
+        _deposit_withdraw, as_states(states), (a_c, oracle_price),
+        coin_per_pair=coin_per_pair, deposit=deposit, rebalance=rebalance,
+        rebalance_type=rebalance_type, token_fraction=token_fraction, rebalance_fun=rebalance_fun)
+
+
+def _deposit_withdraw(
+        states, out, a_c, oracle_price, coin_per_pair, deposit, rebalance,
+        rebalance_type, token_fraction, rebalance_fun):
+    n = states.shape[0]
+    a_c = np.broadcast_to(np.asarray(a_c, dtype=float), (n,))
+    oracle_price = np.broadcast_to(np.asarray(oracle_price, dtype=float), (n,))
+    n_c_0, n_l_0, n_s_0 = states[:, 0], states[:, 1], states[:, 2]
+    amm_price = _spot_price_columns(states)[0]
+
+    if deposit:
+        # Deposit liquidity
+        n_c_1, n_l_1, n_s_1, _ = _mint_redeem_balances(
+            n_c_0 + a_c, n_l_0, n_s_0, a_c*token_fraction, coin_per_pair)
+        n_c_mid = n_c_1
+        tok_out = -a_c
+    else:
+        # Withdraw liquidity
+        # Step 1 convert pairs back to collateral
+        n_c_mid, n_l_1, n_s_1, _ = _mint_redeem_balances(
+            n_c_0, n_l_0, n_s_0, -a_c*token_fraction/coin_per_pair, coin_per_pair)
+        # Step 2 withdraw collateral, this will be from coin in pool
+        # plus redeemed position tokens
+        n_c_1 = n_c_mid - a_c
+        tok_out = a_c
+
+    if rebalance:
+        if rebalance_type == 'oracle':
+            v = oracle_price/coin_per_pair
+            avg_price = oracle_price
+        elif rebalance_type == 'amm':
+            v = amm_price/coin_per_pair
+            avg_price = amm_price
+        else:
+            # Weighted deposit - average oracle and amm prices
+            balance_0 = n_c_0 + np.minimum(n_s_0, n_l_0)*coin_per_pair
+            balance_t = balance_0 + a_c
+            amm_wt = balance_0/balance_t  # Existing liquidity weight
+            oracle_wt = a_c/balance_t   # New liquidity weight
+            v = (amm_price*amm_wt + oracle_price*oracle_wt)/coin_per_pair
+            avg_price = amm_price*amm_wt + oracle_price*oracle_wt
+        _rebalance(out, n_c_1, n_l_1, n_s_1, v, coin_per_pair, rebalance_fun)
+    else:
+        # Weights are unchanged by the mint or redeem step
+        _set_balances(states, out, n_c_mid, n_l_1, n_s_1)
+        avg_price = _spot_price_columns(out)[0]
+
+    return tok_out, avg_price
+
+
+def batch_perform_action(action, states, a_c, coin_per_pair=100, **swap_params):
+    """Uniform interface for performing one action on a batch of AMM states
+    """
+    if action == 'swap_from_coin':
+        return batch_swap_from_coin(states, a_c, coin_per_pair=coin_per_pair, **swap_params)
+    elif action == 'swap_to_coin':
+        return batch_swap_to_coin(states, a_c, coin_per_pair=coin_per_pair, **swap_params)
+    elif action == 'mint_redeem':
+        return batch_mint_redeem(states, a_c, coin_per_pair=coin_per_pair, **swap_params)
+    elif action == 'deposit':
+        return batch_deposit_withdraw(
+            states, a_c, coin_per_pair=coin_per_pair, deposit=True, **swap_params)
+    elif action == 'withdraw':
+        return batch_deposit_withdraw(
+            states, a_c, coin_per_pair=coin_per_pair, deposit=False, **swap_params)
+    else:
+        raise ValueError('Unknown action', action)
+
+
+def _best_time(fun, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t_0 = time.perf_counter()
+        fun()
+        best = min(best, time.perf_counter() - t_0)
+    return best
+
+
+def benchmark(n=100_000, repeat=3, seed=0):
+    """Time scalar loops against the batch functions for n random states
+
+    Reports the best of repeat runs for both the scalar loop and the batch call.
+
+    :return: dict of action name -> (scalar seconds, batch seconds, speedup)
+    """
+    rng = np.random.default_rng(seed)
+    x_c = rng.uniform(5000., 20000., n)
+    x_l = rng.uniform(50., 200., n)
+    x_s = rng.uniform(50., 200., n)
+    v = rng.uniform(0.1, 0.9, n)
+    a_c = rng.uniform(1., 1000., n)
+    scalar_states = [set_amm_state(*row, 100) for row in zip(x_c, x_l, x_s, v)]
+    states = batch_set_amm_state(x_c, x_l, x_s, v, 100)
+
+    cases = {
+        'swap_from_coin': (
+            lambda s, a: simple_swap_from_coin(s, a, coin_per_pair=100, rebalance=True),
+            lambda: batch_swap_from_coin(states, a_c, coin_per_pair=100, rebalance=True)),
+        'mint_redeem': (
+            lambda s, a: mint_redeem(s, a, coin_per_pair=100, rebalance=True),
+            lambda: batch_mint_redeem(states, a_c, coin_per_pair=100, rebalance=True)),
+        'deposit': (
+            lambda s, a: deposit_withdraw(s, a, coin_per_pair=100),
+            lambda: batch_deposit_withdraw(states, a_c, coin_per_pair=100)),
+    }
+    results = {}
+    def scalar_loop(scalar_fun):
+        for s, a in zip(scalar_states, a_c):
+            scalar_fun(s, a)
+
+    for name, (scalar_fun, batch_fun) in cases.items():
+        t_scalar = _best_time(lambda: scalar_loop(scalar_fun), repeat)
+        t_batch = _best_time(batch_fun, repeat)
+        results[name] = (t_scalar, t_batch, t_scalar / t_batch)
+        print(f'{name:15} N={n}: scalar {t_scalar:8.4f}s  batch {t_batch:8.4f}s  '
+              f'speedup {t_scalar / t_batch:8.1f}x')
+    return results
+
+
+if __name__ == '__main__':
+    # python -m calc.amm_batch
+    benchmark()
@@ -0,0 +1,213 @@
+"""Benchmark suite for the amm_math hot functions with a stored baseline
+
+Every case is timed on a single scalar state with the amm_math function and
+on batches of 1e3 and 1e6 states with the vectorized equivalent (the
+amm_math function itself where it accepts arrays, otherwise the amm_batch
+version).  Swap, mint/redeem and action cases are timed with and without
+rebalance=True.
+
+Usage:
+    python -m calc.amm_bench --save          # record baseline
+    python -m calc.amm_bench                 # compare with baseline
+    python -m calc.amm_bench --threshold 0.1 --filter swap
+
+Comparing exits with status 1 if any case is slower than its baseline by more
+than the threshold fraction.  Baselines are only meaningful on the machine
+they were recorded on, so re-record after changing hardware.
+"""
+import argparse
+import json
+import platform
+import sys
+import timeit
+from pathlib import Path
+
+import numpy as np
+
+from .amm_math import (
+    calc_out_given_in, calc_in_given_out, calc_spot_price, get_amm_spot_prices, get_amm_balance,
+    set_amm_state, simple_swap_from_coin, mint_redeem, deposit_withdraw, perform_action
+)
+from .amm_batch import (
+    batch_set_amm_state, batch_get_amm_spot_prices, batch_get_amm_balance, batch_swap_from_coin,
+    batch_mint_redeem, batch_deposit_withdraw, batch_perform_action
+)
+
+DEFAULT_BASELINE_FILE = Path(__file__).parent / 'bench-baseline.json'
+DEFAULT_THRESHOLD = 0.25
+SIZES = [1, 1_000, 1_000_000]
+C = 100
+
+
+def make_inputs(n, seed=0):
+    """Random balances, oracle prices and trade sizes for n pool states
+
+    :return: (columns dict of length n arrays, (n, 6) states array)
+    """
+    rng = np.random.default_rng(seed)
+    cols = {
+        'x_c': rng.uniform(5000., 20000., n),
+        'x_l': rng.uniform(50., 200., n),
+        'x_s': rng.uniform(50., 200., n),
+        'v': rng.uniform(0.1, 0.9, n),
+        'a_c': rng.uniform(1., 1000., n)
+    }
+    return cols, batch_set_amm_state(cols['x_c'], cols['x_l'], cols['x_s'], cols['v'], C)
+
+
+def cases(n, seed=0):
+    """Benchmark callables for n states, scalar amm_math calls when n == 1
+
+    :return: dict of case name -> function of no arguments
+    """
+    cols, states = make_inputs(n, seed)
+    x_c, x_l, x_s, v, a_c = (cols[k] for k in ('x_c', 'x_l', 'x_s', 'v', 'a_c'))
+    w_c, w_l, w_s = states[:, 3], states[:, 4], states[:, 5]
+    if n == 1:
+        x_c, x_l, x_s, v, a_c, w_c, w_l, w_s = (
+            float(x[0]) for x in (x_c, x_l, x_s, v, a_c, w_c, w_l, w_s))
+        state = list(states[0])
+        return {
+            'calc_out_given_in': lambda: calc_out_given_in(x_l, w_l, x_c, w_c, a_c, 0.003),
+            'calc_in_given_out': lambda: calc_in_given_out(x_c, w_c, x_l, w_l, a_c / C, 0.003),
+            'calc_spot_price': lambda: calc_spot_price(x_c, w_c, x_l, w_l, 0.003),
+            'get_amm_spot_prices': lambda: get_amm_spot_prices(state),
+            'get_amm_balance': lambda: get_amm_balance(state),
+            'set_amm_state': lambda: set_amm_state(x_c, x_l, x_s, v, C),
+            'simple_swap_from_coin': lambda: simple_swap_from_coin(state, a_c, coin_per_pair=C),
+            'simple_swap_from_coin[rebalance]': lambda: simple_swap_from_coin(
+                state, a_c, coin_per_pair=C, rebalance=True),
+            'mint_redeem': lambda: mint_redeem(state, a_c, coin_per_pair=C),
+            'mint_redeem[rebalance]': lambda: mint_redeem(state, a_c, coin_per_pair=C, rebalance=True),
+            'deposit_withdraw': lambda: deposit_withdraw(state, a_c, coin_per_pair=C, rebalance=False),
+            'deposit_withdraw[rebalance]': lambda: deposit_withdraw(state, a_c, coin_per_pair=C),
+            'perform_action': lambda: perform_action('swap_to_coin', state, a_c / C, coin_per_pair=C),
+            'perform_action[rebalance]': lambda: perform_action(
+                'swap_to_coin', state, a_c / C, coin_per_pair=C, rebalance=True),
+        }
+    # calc_* functions broadcast over arrays, the others have batch versions
+    return {
+        'calc_out_given_in': lambda: calc_out_given_in(x_l, w_l, x_c, w_c, a_c, 0.003),
+        'calc_in_given_out': lambda: calc_in_given_out(x_c, w_c, x_l, w_l, a_c / C, 0.003),
+        'calc_spot_price': lambda: calc_spot_price(x_c, w_c, x_l, w_l, 0.003),
+        'get_amm_spot_prices': lambda: batch_get_amm_spot_prices(states),
+        'get_amm_balance': lambda: batch_get_amm_balance(states),
+        'set_amm_state': lambda: batch_set_amm_state(x_c, x_l, x_s, v, C),
+        'simple_swap_from_coin': lambda: batch_swap_from_coin(states, a_c, coin_per_pair=C),
+        'simple_swap_from_coin[rebalance]': lambda: batch_swap_from_coin(
+            states, a_c, coin_per_pair=C, rebalance=True),
+        'mint_redeem': lambda: batch_mint_redeem(states, a_c, coin_per_pair=C),
+        'mint_redeem[rebalance]': lambda: batch_mint_redeem(states, a_c, coin_per_pair=C, rebalance=True),
+        'deposit_withdraw': lambda: batch_deposit_withdraw(states, a_c, coin_per_pair=C, rebalance=False),
+        'deposit_withdraw[rebalance]': lambda: batch_deposit_withdraw(states, a_c, coin_per_pair=C),
+        'perform_action': lambda: batch_perform_action('swap_to_coin', states, a_c / C, coin_per_pair=C),
+        'perform_action[rebalance]': lambda: batch_perform_action(
+            'swap_to_coin', states, a_c / C, coin_per_pair=C, rebalance=True),
+    }
+
+
+def time_call(fun, repeat=5, min_time=0.2):
+    """Best time per call over repeat runs of enough calls to take about min_time seconds"""
+    timer = timeit.Timer(fun)
+    number, total = timer.autorange()
+    number = max(1, int(number * min_time / max(total, 1e-9)))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def case_id(name, n):
+    return f'{name}[n={n}]' if n > 1 else f'{name}[scalar]'
+
+
+def run_benchmarks(sizes=SIZES, name_filter=None, repeat=5, seed=0):
+    """Time all cases at all sizes
+
+    :param name_filter: only run cases whose name contains this string
+    :return: dict of case id -> seconds per call
+    """
+    results = {}
+    for n in sizes:
+        for name, fun in cases(n, seed).items():
+            if name_filter and name_filter not in name:
+                continue
+            results[case_id(name, n)] = time_call(fun, repeat=repeat)
+    return results
+
+
+def machine_info():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor()
+    }
+
+
+def save_baseline(results, file_name=DEFAULT_BASELINE_FILE):
+    with open(file_name, 'w') as f:
+        json.dump({'machine': machine_info(), 'results': results}, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def load_baseline(file_name=DEFAULT_BASELINE_FILE):
+    with open(file_name, 'r') as f:
+        return json.load(f)['results']
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Relative change of each case against baseline
+
+    :return: (list of (case id, baseline s, current s, change) rows, list of regressed case ids)
+    """
+    rows = []
+    regressions = []
+    for key, t in results.items():
+        t_0 = baseline.get(key)
+        change = None if t_0 is None else t / t_0 - 1
+        rows.append((key, t_0, t, change))
+        if change is not None and change > threshold:
+            regressions.append(key)
+    return rows, regressions
+
+
+def print_comparison(rows, threshold=DEFAULT_THRESHOLD):
+    print(f'{"case":<48}{"baseline":>14}{"current":>14}{"change":>10}')
+    for key, t_0, t, change in rows:
+        flag = ' SLOWER' if change is not None and change > threshold else ''
+        baseline = '-' if t_0 is None else f'{t_0*1e6:.2f}us'
+        change = '-' if change is None else f'{change:+.1%}'
+        print(f'{key:<48}{baseline:>14}{t*1e6:>12.2f}us{change:>10}{flag}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser('Benchmark amm_math functions against stored baseline')
+    parser.add_argument('--save', action='store_true', help='Record results as the new baseline')
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE_FILE))
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Largest allowed slowdown as a fraction of baseline time')
+    parser.add_argument('--filter', dest='name_filter', default=None)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.name_filter, args.repeat)
+    if args.save:
+        if args.name_filter or args.sizes != SIZES:
+            # Keep cases that were not rerun
+            try:
+                results = dict(load_baseline(args.baseline), **results)
+            except FileNotFoundError:
+                pass
+        save_baseline(results, args.baseline)
+        print(f'Saved {len(results)} results to {args.baseline}')
+        return 0
+
+    rows, regressions = compare(results, load_baseline(args.baseline), args.threshold)
+    print_comparison(rows, args.threshold)
+    if regressions:
+        print(f'{len(regressions)} cases slower than baseline by more than {args.threshold:.0%}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
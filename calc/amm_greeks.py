@@ -0,0 +1,132 @@
+"""Analytic sensitivities of pool value and inventory for batches of states
+
+The expressions are derived once with sympy by evaluating the amm_math
+functions themselves on symbols, differentiated, and compiled to NumPy
+functions, so each call is a single vectorized evaluation over all states.
+
+oracle_greeks: derivatives with respect to the oracle price fraction v
+    rebalance=True   weights reset with rebalance_fun at v, balances unchanged,
+                     value at the pool spot prices (get_amm_balance)
+    rebalance=False  weights unchanged, arbitrageurs trade (without fee) until
+                     the pool prices are v*C and (1-v)*C, value at those
+                     prices; long and short are the inventories after arbitrage
+
+trade_greeks: derivatives with respect to the size of a swap
+    value at the pool spot prices and long and short inventory after
+    simple_swap_from_coin (coin in, to_long=is_long) or simple_swap_to_coin
+    (tokens in, from_long=is_long), with or without rebalance
+
+Results are dicts of arrays: value, value_delta, value_gamma, and for
+inventories long, long_delta, long_gamma, short, short_delta, short_gamma.
+"""
+import functools
+
+import numpy as np
+
+from .amm_batch import as_states
+from .amm_math import (
+    set_amm_state, set_amm_state_orig, set_amm_state_closed_form, amm_state_weight_solution,
+    get_amm_balance, simple_swap_from_coin, simple_swap_to_coin
+)
+
+
+def _symbolic_closed_form(x_c, x_l, x_s, v, C, sF=0):
+    args, weights = amm_state_weight_solution()
+    subs = dict(zip(args, (x_c, x_l, x_s, v, C, sF)))
+    return [x_c, x_l, x_s] + [w.subs(subs) for w in weights]
+
+
+# Rebalance functions that can be evaluated on sympy symbols
+SYMBOLIC_REBALANCE_FUNS = {
+    set_amm_state: set_amm_state,
+    set_amm_state_closed_form: _symbolic_closed_form,
+    set_amm_state_orig: _symbolic_closed_form
+}
+
+
+def _symbols():
+    import sympy as sp
+
+    return sp.symbols('x_c x_l x_s w_c w_l w_s v C a sF', real=True)
+
+
+def _compile(args, outputs, x):
+    """Lambdify outputs with value, first and second derivative with respect to x"""
+    import sympy as sp
+
+    names, exprs = [], []
+    for name, expr in outputs.items():
+        d_expr = sp.diff(expr, x)
+        names += [name, f'{name}_delta', f'{name}_gamma']
+        exprs += [expr, d_expr, sp.diff(d_expr, x)]
+    return names, sp.lambdify(args, exprs, modules='numpy', cse=True)
+
+
+@functools.lru_cache(maxsize=None)
+def _oracle_greeks_fun(rebalance, rebalance_fun):
+    x_c, x_l, x_s, w_c, w_l, w_s, v, C, a, sF = _symbols()
+    args = (x_c, x_l, x_s, w_c, w_l, w_s, v, C)
+    if rebalance:
+        state = SYMBOLIC_REBALANCE_FUNS[rebalance_fun](x_c, x_l, x_s, v, C)
+        outputs = {'value': get_amm_balance(state)}
+    else:
+        # Arbitrage keeps x_c**w_c * x_l**w_l * x_s**w_s and sets x_t = x_c*w_t/(w_c*p_t)
+        p_l, p_s = v*C, (1 - v)*C
+        k = x_c**w_c * x_l**w_l * x_s**w_s
+        w = w_c + w_l + w_s
+        x_c_1 = (k / ((w_l/(w_c*p_l))**w_l * (w_s/(w_c*p_s))**w_s))**(1/w)
+        x_l_1 = x_c_1*w_l/(w_c*p_l)
+        x_s_1 = x_c_1*w_s/(w_c*p_s)
+        outputs = {'value': x_c_1 + x_l_1*p_l + x_s_1*p_s, 'long': x_l_1, 'short': x_s_1}
+    return _compile(args, outputs, v)
+
+
+@functools.lru_cache(maxsize=None)
+def _trade_greeks_fun(from_coin, is_long, rebalance, rebalance_fun):
+    x_c, x_l, x_s, w_c, w_l, w_s, v, C, a, sF = _symbols()
+    args = (x_c, x_l, x_s, w_c, w_l, w_s, a, C, sF)
+    state = [x_c, x_l, x_s, w_c, w_l, w_s]
+    swap_params = {
+        'sF': sF, 'coin_per_pair': C, 'rebalance': rebalance,
+        'rebalance_fun': SYMBOLIC_REBALANCE_FUNS[rebalance_fun]
+    }
+    if from_coin:
+        new_state = simple_swap_from_coin(state, a, to_long=is_long, **swap_params)[0]
+    else:
+        new_state = simple_swap_to_coin(state, a, from_long=is_long, **swap_params)[0]
+    outputs = {'value': get_amm_balance(new_state), 'long': new_state[1], 'short': new_state[2]}
+    return _compile(args, outputs, a)
+
+
+def _evaluate(names, fun, columns):
+    shape = np.broadcast(*columns).shape
+    return {name: np.broadcast_to(np.asarray(x, dtype=float), shape) for name, x in zip(names, fun(*columns))}
+
+
+def oracle_greeks(states, v, coin_per_pair=100, rebalance=True, rebalance_fun=set_amm_state):
+    """Value (and for rebalance=False inventory) sensitivities to the oracle price fraction v
+
+    :param states: (N, 6) states or a single state
+    :param v: oracle price fraction, scalar or length N
+    :param rebalance_fun: set_amm_state, set_amm_state_closed_form or set_amm_state_orig
+    :return: dict of name -> length N array
+    """
+    names, fun = _oracle_greeks_fun(bool(rebalance), rebalance_fun)
+    states = as_states(states)
+    return _evaluate(names, fun, list(states.T) + [np.asarray(v, dtype=float), coin_per_pair])
+
+
+def trade_greeks(states, trade_size, from_coin=True, is_long=True, sF=0, coin_per_pair=100,
+                 rebalance=False, rebalance_fun=set_amm_state):
+    """Value and inventory sensitivities to the size of a swap
+
+    :param trade_size: coin in if from_coin else tokens in, scalar or length N,
+        0 for the marginal sensitivities
+    :param from_coin: True for simple_swap_from_coin, False for simple_swap_to_coin
+    :param is_long: trade the long (True) or short token
+    :return: dict of name -> length N array
+    """
+    names, fun = _trade_greeks_fun(bool(from_coin), bool(is_long), bool(rebalance), rebalance_fun)
+    states = as_states(states)
+    return _evaluate(
+        names, fun, list(states.T) + [np.asarray(trade_size, dtype=float), coin_per_pair, sF])
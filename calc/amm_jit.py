@@ -0,0 +1,280 @@
+"""Compiled replay of action sequences when numba is installed
+
+A sequential replay cannot be vectorized across time, so the whole loop of
+perform_action steps (swaps, mint/redeem, deposit/withdraw and the
+set_amm_state rebalances) is compiled with numba.  Every step evaluates the
+same floating point expressions in the same order as amm_math, so states,
+tokens out and average prices are identical to perform_action_sequence.
+
+    states, tok_outs, avg_prices = replay_actions(initial_state, actions)
+
+takes the same (action, a_c, params) tuples as perform_action_sequence and
+returns arrays instead of lists, without printing.  replay_arrays takes
+action codes and per-step parameter arrays directly, which avoids building
+a million tuples for long replays.
+
+Without numba, or for actions using a rebalance_fun other than
+set_amm_state, the replay runs perform_action in a Python loop.
+"""
+import numpy as np
+
+from .amm_math import perform_action, get_amm_spot_prices, set_amm_state
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+HAVE_NUMBA = numba is not None
+
+# Action codes
+SWAP_FROM_COIN = 0
+SWAP_TO_COIN = 1
+MINT_REDEEM = 2
+DEPOSIT = 3
+WITHDRAW = 4
+ACTION_CODES = {
+    'swap_from_coin': SWAP_FROM_COIN,
+    'swap_to_coin': SWAP_TO_COIN,
+    'mint_redeem': MINT_REDEEM,
+    'deposit': DEPOSIT,
+    'withdraw': WITHDRAW
+}
+
+# Deposit/withdraw rebalance types
+REBALANCE_TYPES = {'oracle': 0, 'amm': 1, 'weighted': 2}
+
+# Errors raised by amm_math, reported by the kernel as codes
+ERRORS = {
+    1: 'Insufficent coin',
+    2: 'Insufficent token',
+    3: 'Not implemented',
+    4: 'Unknown action'
+}
+
+
+def _jit(fun):
+    return numba.njit(cache=True)(fun) if HAVE_NUMBA else fun
+
+
+@_jit
+def _set_amm_state(out, x_c, x_l, x_s, v, C):
+    out[0] = x_c
+    out[1] = x_l
+    out[2] = x_s
+    if x_l == 0 or x_s == 0:
+        out[3] = 1.
+        out[4] = 0.
+        out[5] = 0.
+    else:
+        denom = C*x_l*x_s - x_c*(v*(x_l - x_s) - x_l)
+        out[3] = x_c*(v*(x_l - x_s) - x_l)/denom
+        out[4] = v*C*x_l*x_s/denom
+        out[5] = (1 - v)*C*x_l*x_s/denom
+
+
+@_jit
+def _spot_long(s):
+    return s[0] / s[3] / (s[1] / s[4]) / (1 - 0)
+
+
+@_jit
+def _spot_short(s):
+    return s[0] / s[3] / (s[2] / s[5]) / (1 - 0)
+
+
+@_jit
+def _swap(s, out, aI, tok_ind, from_coin, sF, C, rebalance):
+    """simple_swap_from_coin / simple_swap_to_coin, returns (aO, avg_price)"""
+    out[:] = s
+    if from_coin:
+        bO, wO, bI, wI = s[tok_ind], s[tok_ind + 3], s[0], s[3]
+    else:
+        bO, wO, bI, wI = s[0], s[3], s[tok_ind], s[tok_ind + 3]
+    aO = bO*(1-(bI/(bI + (aI*(1-sF))))**(wI/wO))
+    if from_coin:
+        avg_price = aI / aO
+        out[0] = s[0] + aI
+        out[tok_ind] = s[tok_ind] - aO
+    else:
+        avg_price = aO / aI
+        out[0] = s[0] - aO
+        out[tok_ind] = s[tok_ind] + aI
+    if rebalance:
+        spot_l = _spot_long(out)
+        spot_s = _spot_short(out)
+        _set_amm_state(out, out[0], out[1], out[2], spot_l / (spot_l + spot_s), C)
+    return aO, avg_price
+
+
+@_jit
+def _mint_redeem(s, out, a_c, C):
+    """mint_redeem balances without rebalance, returns (tok_out, error code)"""
+    out[:] = s
+    if a_c >= 0:
+        if s[0] < a_c:
+            return 0., 1
+        out[0] = s[0] - a_c
+        out[1] = s[1] + a_c / C
+        out[2] = s[2] + a_c / C
+        return a_c / C, 0
+    r_c = -a_c
+    if r_c > min(s[2], s[1]):
+        return 0., 2
+    out[0] = s[0] + r_c * C
+    out[1] = s[1] - r_c
+    out[2] = s[2] - r_c
+    return a_c * C, 0
+
+
+@_jit
+def _replay(initial_state, codes, amounts, to_long, sF, C, rebalance, oracle_price,
+            rebalance_type, token_fraction, states, tok_outs, avg_prices):
+    """Apply actions in order writing states[i + 1], tok_outs[i + 1], avg_prices[i + 1]
+
+    :return: (error code, step) with code 0 if all steps succeeded
+    """
+    states[0] = initial_state
+    tok_outs[0] = 0.
+    avg_prices[0] = _spot_long(initial_state)
+    mid = np.empty(6)
+    for i in range(codes.shape[0]):
+        s = states[i]
+        out = states[i + 1]
+        code = codes[i]
+        a_c = amounts[i]
+        if code == 0 or code == 1:
+            tok_out, avg_price = _swap(
+                s, out, a_c, 1 if to_long[i] else 2, code == 0, sF[i], C[i], rebalance[i])
+        elif code == 2:
+            tok_out, error = _mint_redeem(s, out, a_c, C[i])
+            if error:
+                return error, i
+            avg_price = C[i] / 2
+            if rebalance[i]:
+                _set_amm_state(out, out[0], out[1], out[2], _spot_long(s) / C[i], C[i])
+        elif code == 3 or code == 4:
+            amm_price = _spot_long(s)
+            if code == 3:
+                mid[:] = s
+                mid[0] = s[0] + a_c
+                _, error = _mint_redeem(mid, out, a_c*token_fraction[i], C[i])
+                x_c_1 = out[0]
+                tok_out = -a_c
+            else:
+                _, error = _mint_redeem(s, out, -a_c*token_fraction[i]/C[i], C[i])
+                x_c_1 = out[0] - a_c
+                tok_out = a_c
+            if error:
+                return error, i
+            if rebalance[i]:
+                if rebalance_type[i] == 0:
+                    _set_amm_state(out, x_c_1, out[1], out[2], oracle_price[i]/C[i], C[i])
+                    avg_price = oracle_price[i]
+                elif rebalance_type[i] == 1:
+                    _set_amm_state(out, x_c_1, out[1], out[2], amm_price/C[i], C[i])
+                    avg_price = amm_price
+                else:
+                    if code == 4:
+                        return 3, i
+                    balance_0 = s[0] + min(s[2], s[1])*C[i]
+                    balance_t = balance_0 + a_c
+                    amm_wt = balance_0/balance_t
+                    oracle_wt = a_c/balance_t
+                    v = (amm_price*amm_wt + oracle_price[i]*oracle_wt)/C[i]
+                    _set_amm_state(out, x_c_1, out[1], out[2], v, C[i])
+                    avg_price = amm_price*amm_wt + oracle_price[i]*oracle_wt
+            else:
+                # As deposit_withdraw, the state without rebalance is the one
+                # after mint/redeem, also for withdraw
+                avg_price = _spot_long(out)
+        else:
+            return 4, i
+        tok_outs[i + 1] = tok_out
+        avg_prices[i + 1] = avg_price
+    return 0, codes.shape[0]
+
+
+def _per_step(value, n, dtype):
+    return np.ascontiguousarray(np.broadcast_to(np.asarray(value, dtype=dtype), (n,)))
+
+
+def replay_arrays(initial_state, codes, amounts, to_long=True, sF=0., coin_per_pair=100,
+                  rebalance=None, oracle_price=50., rebalance_type='oracle', token_fraction=0.5):
+    """Replay actions given as arrays, parameters are scalars or one value per step
+
+    :param codes: action codes, see ACTION_CODES
+    :param amounts: a_c of each action
+    :param to_long: to_long for swap_from_coin, from_long for swap_to_coin
+    :param rebalance: default False for swaps and mint_redeem, True for deposit
+        and withdraw, as the amm_math defaults
+    :param rebalance_type: name or REBALANCE_TYPES codes for deposit and withdraw
+    :return: (states, tok_outs, avg_prices) arrays of length len(codes) + 1
+        starting with the initial state as perform_action_sequence
+    """
+    codes = np.ascontiguousarray(codes, dtype=np.int64)
+    n = codes.shape[0]
+    if rebalance is None:
+        rebalance = (codes == DEPOSIT) | (codes == WITHDRAW)
+    if isinstance(rebalance_type, str):
+        rebalance_type = REBALANCE_TYPES[rebalance_type]
+    states = np.empty((n + 1, 6))
+    tok_outs = np.empty(n + 1)
+    avg_prices = np.empty(n + 1)
+    error, step = _replay(
+        np.asarray(initial_state, dtype=float), codes, _per_step(amounts, n, float),
+        _per_step(to_long, n, bool), _per_step(sF, n, float), _per_step(coin_per_pair, n, float),
+        _per_step(rebalance, n, bool), _per_step(oracle_price, n, float),
+        _per_step(rebalance_type, n, np.int64), _per_step(token_fraction, n, float),
+        states, tok_outs, avg_prices)
+    if error:
+        raise ValueError(ERRORS[error], step)
+    return states, tok_outs, avg_prices
+
+
+def _replay_python(initial_state, actions):
+    states = [initial_state]
+    tok_outs = [0]
+    avg_prices = [get_amm_spot_prices(initial_state)[0]]
+    for action, a_c, params in actions:
+        new_state, tok_out, avg_price = perform_action(action, states[-1], a_c, **params)
+        states.append(new_state)
+        tok_outs.append(tok_out)
+        avg_prices.append(avg_price)
+    return np.array(states, dtype=float), np.array(tok_outs, dtype=float), np.array(avg_prices, dtype=float)
+
+
+def replay_actions(initial_state, actions):
+    """perform_action_sequence without printing, compiled when numba is installed
+
+    :param actions: list of (action, a_c, params) tuples
+    :return: (states, tok_outs, avg_prices) arrays
+    """
+    actions = list(actions)
+    if not HAVE_NUMBA or any(
+            params.get('rebalance_fun', set_amm_state) is not set_amm_state for _, _, params in actions):
+        return _replay_python(initial_state, actions)
+
+    n = len(actions)
+    codes = np.empty(n, dtype=np.int64)
+    columns = {name: np.empty(n, dtype=dtype) for name, dtype in [
+        ('amounts', float), ('to_long', bool), ('sF', float), ('coin_per_pair', float),
+        ('rebalance', bool), ('oracle_price', float), ('rebalance_type', np.int64),
+        ('token_fraction', float)]}
+    for i, (action, a_c, params) in enumerate(actions):
+        code = ACTION_CODES.get(action)
+        if code is None:
+            raise ValueError('Unknown action', action)
+        codes[i] = code
+        columns['amounts'][i] = a_c
+        columns['to_long'][i] = params.get('to_long', params.get('from_long', True))
+        columns['sF'][i] = params.get('sF', 0.)
+        columns['coin_per_pair'][i] = params.get('coin_per_pair', 100)
+        columns['rebalance'][i] = params.get('rebalance', code in (DEPOSIT, WITHDRAW))
+        columns['oracle_price'][i] = params.get('oracle_price', 50)
+        rebalance_type = params.get('rebalance_type', 'oracle')
+        if rebalance_type not in REBALANCE_TYPES:
+            raise ValueError('Unknown rebalance type: ', rebalance_type)
+        columns['rebalance_type'][i] = REBALANCE_TYPES[rebalance_type]
+        columns['token_fraction'][i] = params.get('token_fraction', 0.5)
+    return replay_arrays(initial_state, codes, **columns)
@@ -1,7 +1,17 @@
-import sympy as sp
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
+"""Balancer pool maths and actions on Mettalex AMM states
+
+Only plain arithmetic is done at import time.  sympy is imported by the
+functions that solve for weights symbolically, and the plotting functions
+live in amm_plot, which imports matplotlib and seaborn when one of them is
+first accessed through this module.
+"""
+import functools
+import importlib
+
+# Plotting functions provided by amm_plot, see __getattr__
+PLOT_FUNCTIONS = {
+    'simulate_swaps_from_coin', 'plot_action', 'plot_orderbook', 'plot_action_orderbook'
+}
 
 
 def calc_balancer_invariant(x_c, x_l, x_s, w_c, w_l, w_s):
@@ -73,6 +83,7 @@ def set_amm_state_orig(x_c, x_l, x_s, v, C, sF=0):
     """For fixed token balances calculate the weights needed to achieve a current token balances
     L price = v*C, S price = (1-v)*C where C is the coin needed to mint 1 L + 1 S
     """
+    import sympy as sp
 
     # Weights
     w_c, w_l, w_s = sp.symbols('w_c w_l w_s', positive=True)
@@ -86,6 +97,50 @@ def set_amm_state_orig(x_c, x_l, x_s, v, C, sF=0):
     return [x_c, x_l, x_s, sol[w_c], sol[w_l], sol[w_s]]
 
 
+@functools.lru_cache(maxsize=None)
+def amm_state_weight_solution():
+    """Solve the set_amm_state_orig equations once with symbolic balances, prices and fee
+
+    :return: (symbols (x_c, x_l, x_s, v, C, sF), simplified expressions for (w_c, w_l, w_s))
+    """
+    import sympy as sp
+
+    x_c, x_l, x_s, v, C, sF = sp.symbols('x_c x_l x_s v C sF')
+    w_c, w_l, w_s = sp.symbols('w_c w_l w_s', positive=True)
+
+    sol = sp.solve(
+        [w_c + w_l + w_s - 1,   # Weights sum to 1
+         calc_spot_price(x_c, w_c, x_l, w_l, sF) - v*C,      # Long token price = v*C
+         calc_spot_price(x_c, w_c, x_s, w_s, sF) - (1-v)*C,  # Short token price = (1-v)*C
+         ],
+        [w_c, w_l, w_s], dict=True)[0]
+    return (x_c, x_l, x_s, v, C, sF), tuple(sp.simplify(sol[w]) for w in (w_c, w_l, w_s))
+
+
+@functools.lru_cache(maxsize=None)
+def _amm_state_weights():
+    """set_amm_state_orig weights as a compiled function
+
+    :return: function (x_c, x_l, x_s, v, C, sF) -> (w_c, w_l, w_s) that works
+        on floats or numpy arrays
+    """
+    import sympy as sp
+
+    args, weights = amm_state_weight_solution()
+    return sp.lambdify(args, list(weights), modules='numpy')
+
+
+def set_amm_state_closed_form(x_c, x_l, x_s, v, C, sF=0):
+    """Same weights as set_amm_state_orig from a solution derived once and cached
+
+    The symbolic solve is done on first use only, after that each call is plain
+    arithmetic so this can be used as rebalance_fun for swaps and evaluated on
+    numpy arrays of balances and prices.
+    """
+    w_c, w_l, w_s = _amm_state_weights()(x_c, x_l, x_s, v, C, sF)
+    return [x_c, x_l, x_s, w_c, w_l, w_s]
+
+
 def set_amm_state(x_c, x_l, x_s, v, C, sF=0):
     """For fixed token balances calculate the weights needed to achieve at zero imbalance
     L price = v*C, S price = (1-v)*C where C is the coin needed to mint 1 L + 1 S
@@ -108,24 +163,157 @@ def set_amm_state(x_c, x_l, x_s, v, C, sF=0):
 def get_amm_spot_prices(state, sF=0):
     """Return L and S prices in units of coin
     """
-    coin_ind = 0
-    ltk_ind = 1
-    stk_ind = 2
-    n_tok = len(state) // 2
-    ltk_price, stk_price = (
-        calc_spot_price(
-            state[coin_ind], state[coin_ind + n_tok],
-            state[tok_ind], state[tok_ind + n_tok],
-            sF) for tok_ind in [ltk_ind, stk_ind]
-    )
-    return [ltk_price, stk_price]
+    if sF == 0 and isinstance(state, AMMState):
+        return state.spot_prices
+    x_c, x_l, x_s, w_c, w_l, w_s = state
+    coin_ratio = x_c / w_c
+    return [coin_ratio/(x_l/w_l)/(1-sF), coin_ratio/(x_s/w_s)/(1-sF)]
 
 
 def get_amm_balance(state):
+    if isinstance(state, AMMState):
+        return state.balance
     spot_prices = get_amm_spot_prices(state)
     return state[0] + state[1]*spot_prices[0] + state[2]*spot_prices[1]
 
 
+def _state_field(ind, doc):
+    def get(self):
+        return self._values[ind]
+
+    def set(self, value):
+        self._values[ind] = value
+        self._spot_prices = self._balance = self._invariant = None
+
+    return property(get, set, doc=doc)
+
+
+class AMMState(object):
+    """Pool state with named fields and cached spot prices, balance and invariant
+
+    Behaves as the 6 element [x_c, x_l, x_s, w_c, w_l, w_s] state list
+    (indexing, len, iteration and unpacking) so it can be passed to every
+    function taking a state.  Setting a field or index invalidates the cached
+    values, and swap_from_coin, swap_to_coin, update and rebalance modify the
+    state in place for loops that apply many actions to one pool.
+    """
+    __slots__ = ('_values', '_spot_prices', '_balance', '_invariant')
+
+    coin = _state_field(0, 'Coin balance')
+    long = _state_field(1, 'Long token balance')
+    short = _state_field(2, 'Short token balance')
+    w_c = _state_field(3, 'Coin weight')
+    w_l = _state_field(4, 'Long token weight')
+    w_s = _state_field(5, 'Short token weight')
+
+    def __init__(self, coin, long, short, w_c, w_l, w_s):
+        self._values = [coin, long, short, w_c, w_l, w_s]
+        self._spot_prices = self._balance = self._invariant = None
+
+    @classmethod
+    def from_state(cls, state):
+        """AMMState from state list (or copy of another AMMState)"""
+        return cls(*state)
+
+    def to_list(self):
+        return list(self._values)
+
+    def copy(self):
+        return AMMState(*self._values)
+
+    def __len__(self):
+        return 6
+
+    def __getitem__(self, ind):
+        return self._values[ind]
+
+    def __setitem__(self, ind, value):
+        self._values[ind] = value
+        self._spot_prices = self._balance = self._invariant = None
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return 'AMMState(coin={}, long={}, short={}, w_c={}, w_l={}, w_s={})'.format(*self._values)
+
+    @property
+    def spot_prices(self):
+        """[L price, S price] in units of coin without swap fee"""
+        if self._spot_prices is None:
+            x_c, x_l, x_s, w_c, w_l, w_s = self._values
+            coin_ratio = x_c / w_c
+            self._spot_prices = (coin_ratio/(x_l/w_l), coin_ratio/(x_s/w_s))
+        return list(self._spot_prices)
+
+    @property
+    def balance(self):
+        """Pool value in coin at the pool spot prices"""
+        if self._balance is None:
+            ltk_price, stk_price = self.spot_prices
+            self._balance = self._values[0] + self._values[1]*ltk_price + self._values[2]*stk_price
+        return self._balance
+
+    @property
+    def invariant(self):
+        """Balancer invariant of the pool"""
+        if self._invariant is None:
+            self._invariant = calc_balancer_invariant(*self._values)
+        return self._invariant
+
+    def update(self, coin=None, long=None, short=None, w_c=None, w_l=None, w_s=None):
+        """Set the given fields in place"""
+        for ind, value in enumerate((coin, long, short, w_c, w_l, w_s)):
+            if value is not None:
+                self._values[ind] = value
+        self._spot_prices = self._balance = self._invariant = None
+
+    def rebalance(self, v, coin_per_pair, sF=0, rebalance_fun=set_amm_state):
+        """Set weights in place to give L price v*coin_per_pair at current balances"""
+        x_c, x_l, x_s = self._values[:3]
+        self._values[3:] = rebalance_fun(x_c, x_l, x_s, v, coin_per_pair, sF)[3:]
+        self._spot_prices = self._balance = self._invariant = None
+
+    def _swap(self, in_ind, out_ind, aI, sF, coin_per_pair, rebalance, rebalance_fun):
+        values = self._values
+        aO = calc_out_given_in(values[out_ind], values[out_ind + 3], values[in_ind], values[in_ind + 3], aI, sF)
+        values[in_ind] += aI
+        values[out_ind] -= aO
+        self._spot_prices = self._balance = self._invariant = None
+        if rebalance:
+            ltk_price, stk_price = self.spot_prices
+            self.rebalance(ltk_price / (ltk_price + stk_price), coin_per_pair, rebalance_fun=rebalance_fun)
+        return aO
+
+    def swap_from_coin(self, aI, to_long=True, sF=0, coin_per_pair=1,
+                       rebalance=False, rebalance_fun=set_amm_state):
+        """In place simple_swap_from_coin
+
+        :return: (tokens out, average price)
+        """
+        tok_ind = 1 if to_long else 2
+        aO = self._swap(0, tok_ind, aI, sF, coin_per_pair, rebalance, rebalance_fun)
+        return aO, aI / aO
+
+    def swap_to_coin(self, aI, from_long=True, sF=0, coin_per_pair=1,
+                     rebalance=False, rebalance_fun=set_amm_state):
+        """In place simple_swap_to_coin
+
+        :return: (coin out, average price)
+        """
+        tok_ind = 1 if from_long else 2
+        aO = self._swap(tok_ind, 0, aI, sF, coin_per_pair, rebalance, rebalance_fun)
+        return aO, aO / aI
+
+
+def as_amm_state(state):
+    """Return state as AMMState, state lists are copied"""
+    return state if isinstance(state, AMMState) else AMMState(*state)
+
+
 # Actions that we can perform on state
 def simple_swap_from_coin(state, aI, to_long=True, sF=0, coin_per_pair=1,
                           rebalance=False, rebalance_fun=set_amm_state):
@@ -241,7 +429,8 @@ def mint_redeem(state, a_c, coin_per_pair=100, rebalance=False, **kwargs):
 
 def deposit_withdraw(
         state, a_c, coin_per_pair=100, oracle_price=50, deposit=True,
-        rebalance=True, rebalance_type='oracle', token_fraction=0.5, **kwargs
+        rebalance=True, rebalance_type='oracle', token_fraction=0.5, rebalance_fun=set_amm_state,
+        **kwargs
 ):
     """
 
@@ -252,6 +441,7 @@ def deposit_withdraw(
     :param rebalance:
     :param rebalance_type:
     :param token_fraction:
+    :param rebalance_fun: function(x_c, x_l, x_s, v, C) setting the weights when rebalancing
     :param kwargs:
     :return:
     """
@@ -281,12 +471,12 @@ def deposit_withdraw(
 
     if rebalance:
         if rebalance_type == 'oracle':
-            new_state = set_amm_state(
+            new_state = rebalance_fun(
                 n_c_1, n_l_1, n_s_1, v=oracle_price/coin_per_pair, C=coin_per_pair
             )
             avg_price = oracle_price
         elif rebalance_type == 'amm':
-            new_state = set_amm_state(
+            new_state = rebalance_fun(
                 n_c_1, n_l_1, n_s_1,
                 v=amm_price/coin_per_pair, C=coin_per_pair
             )
@@ -311,7 +501,7 @@ def deposit_withdraw(
                 # amm_wt = balance_1 / balance_0  # Existing liquidity weight
                 # oracle_wt = balance_1 / balance_0  # New liquidity weight
                 # v = max(min(((amm_price - oracle_price)*amm_wt + oracle_price)/coin_per_pair, 1.), 0.)
-            new_state = set_amm_state(
+            new_state = rebalance_fun(
                 n_c_1, n_l_1, n_s_1,
                 v=v,
                 C=coin_per_pair
@@ -352,244 +542,8 @@ def perform_action(action, s_0, a_c, coin_per_pair=100, **swap_params):
 
     else:
         raise ValueError('Unknown action', action)
-    return s_1, tok_out, avg_price
-
-
-def simulate_swaps_from_coin(x_c_0, x_l_0, x_s_0, v, C, from_coin=True, c_max=1000, n_row=1, offset=0, f=None):
-    initial_state = set_amm_state(x_c_0, x_l_0, x_s_0, v, C)
-
-    coin_in_short = np.linspace(-c_max, 1., 20)
-    coin_in_long = np.linspace(1., c_max, 20)
-    # Swap coin for short
-    states_short, coin_out_short, avg_price_short = zip(
-        *[simple_swap_from_coin(initial_state, -t, coin_per_pair=100, rebalance=True, to_long=False)
-          for t in coin_in_short])
-
-    # Swap coin for long
-    states_long, coin_out_long, avg_price_long = zip(
-        *[simple_swap_from_coin(initial_state, t, coin_per_pair=100, rebalance=True)
-          for t in coin_in_long])
-
-    coin_in = np.concatenate([coin_in_short, coin_in_long])
-    states = np.concatenate([np.array(states_short), np.array(states_long)])
-    # coin_out = [] + coin_out_short + coin_out_long
-    avg_price = np.concatenate([np.array(avg_price_short), np.array(avg_price_long)])
-
-    # # No rebalancing, raw C-> L (or C->S) swap
-    # states_raw, tok_out_raw, avg_price_raw = zip(
-    #     *[simple_swap_from_coin(initial_state, c, coin_per_pair=100, rebalance=False) for c in coin_in])
-
-    if n_row == 1 and not f:
-        _ = plt.figure(figsize=(10, 4))
-    # Pool balance
-
-    balances = np.array([get_amm_balance(s) for s in states])
-    # balances_raw = np.array([get_amm_balance(s) for s in states_raw])
-
-    _ = plt.subplot(n_row, 2, 1 + 2 * offset)
-    _ = plt.plot(coin_in, balances)
-    #     _ = plt.plot(coin_in, balances_raw, linestyle='--')
-    _ = plt.legend(['With Rebalance',
-                    #                     'No Rebalance'
-                    ])
-    _ = plt.title(f'Spot Price = {v}')
-    _ = plt.xlabel('Coin In')
-    _ = plt.ylabel('Pool balance')
-
-    _ = plt.subplot(n_row, 2, 2 + 2 * offset)
-    spot_prices = np.array([get_amm_spot_prices(s) for s in states])
-    _ = plt.plot(coin_in, spot_prices)
-    _ = plt.plot(coin_in, np.sum(spot_prices, axis=1), alpha=0.5)
-    _ = plt.plot(coin_in, avg_price, alpha=0.2, c='k', linestyle=':')
-    _ = plt.legend(['Long', 'Short', 'Long + Short', 'CoinIn/TokOut'])
-    _ = plt.xlabel('Coin In')
-    _ = plt.ylabel('Spot Price')
-
-
-def plot_action(
-        s_0, a_c, n_c_min=5000., n_c_max=20000.,
-        action='swap_from_coin', coin_per_pair=100, normalize_y=False, **swap_params
-):
-    """Plot action performed on AMM as plot of token balances vs coin balance
-    This is similar to an indifference curve plot in micro-economics
-
-    :param s_0:
-    :param a_c:
-    :param n_c_min:
-    :param n_c_max:
-    :param action:
-    :param coin_per_pair:
-    :param swap_params:
-    :return:
-    """
-    n_c_0, n_l_0, n_s_0, w_c_0, w_l_0, w_s_0 = s_0
-    spot_l_0, spot_s_0 = get_amm_spot_prices(s_0)
-
-    s_1, tok_out, avg_price = perform_action(action, s_0, a_c, coin_per_pair=coin_per_pair, **swap_params)
-
-    n_c_1, n_l_1, n_s_1, w_c_1, w_l_1, w_s_1 = s_1
-    spot_l_1, spot_s_1 = get_amm_spot_prices(s_1)
-
-    x = np.linspace(n_c_min, n_c_max, 100).reshape(-1, 1)
-
-    initial_balance = 0  # n_c_0 + min(n_l_0, n_s_0) * coin_per_pair
-    if normalize_y:
-        y_norm = (initial_balance - x)/coin_per_pair
-        n_s_0_n = n_s_0 - (initial_balance - n_c_0)/coin_per_pair
-        n_l_0_n = n_l_0 - (initial_balance - n_c_0)/coin_per_pair
-        n_s_1_n = n_s_1 - (initial_balance - n_c_1)/coin_per_pair
-        n_l_1_n = n_l_1 - (initial_balance - n_c_1)/coin_per_pair
-    else:
-        y_norm = np.zeros_like(x)
-        n_s_0_n = n_s_0
-        n_l_0_n = n_l_0
-        n_s_1_n = n_s_1
-        n_l_1_n = n_l_1
-
-    # Plot initial state
-    k_0 = calc_balancer_invariant(*s_0)
-    _ = plt.plot(x, calc_token_balance(x, n_s_0, w_c_0, w_s_0, k_0) - y_norm,
-                 c='k', linestyle=':', alpha=0.2, label='Initial Invariant')
-    _ = plt.plot(x, calc_token_balance(x, n_l_0, w_c_0, w_l_0, k_0) - y_norm,
-                 c='k', linestyle=':', alpha=0.2)
-    _ = plt.plot(n_c_0, n_l_0_n, markerfacecolor='k', marker='o', markeredgecolor='k', markersize=8, alpha=0.2)
-    _ = plt.plot(n_c_0, n_s_0_n, markerfacecolor='w', marker='o', markeredgecolor='k', markersize=8, alpha=0.2)
-
-    # Plot state movement
-    if action != 'mint_redeem':
-        x_move = np.linspace(float(min(n_c_0, n_c_1)), float(max(n_c_0, n_c_1)), 100).reshape(-1, 1)
-        if normalize_y:
-            y_norm_move = (initial_balance - x_move) / coin_per_pair
-        else:
-            y_norm_move = np.zeros_like(x_move)
-        if n_l_1 != n_l_0:
-            # Long swap
-            _ = plt.plot(x_move, calc_token_balance(x_move, n_s_0, w_c_0, w_s_0, k_0) - y_norm_move,
-                         c='k', linestyle='-', alpha=0.5, label='Swap')
-            _ = plt.plot([n_c_0, n_c_1], [n_s_0_n, n_s_1_n], c='k', alpha=0.5)
-        else:
-            # Short swap
-            _ = plt.plot(x_move, calc_token_balance(x_move, n_l_0, w_c_0, w_l_0, k_0) - y_norm_move,
-                         c='k', linestyle='-', alpha=0.5, label='Swap')
-            _ = plt.plot([n_c_0, n_c_1], [n_l_0_n, n_l_1_n], c='k', alpha=0.5)
-    else:
-        _ = plt.plot([n_c_0, n_c_1], [[n_l_0_n, n_s_0_n], [n_l_1_n, n_s_1_n]],
-                     c='k', alpha=0.5, label='Mint/Redeem')
-
-    # Plot invariant curves without rebalance of weights for final state
-    _ = plt.plot(x, calc_token_balance(x, n_s_1, w_c_0, w_s_0, k_0) - y_norm,
-                 c='k', linestyle='--', alpha=0.2, label='Intermediate Invariant')
-    _ = plt.plot(x, calc_token_balance(x, n_l_1, w_c_0, w_l_0, k_0) - y_norm,
-                 c='k', linestyle='--', alpha=0.2)
-
-    # Plot final invariant after rebalance
-    k_1 = calc_balancer_invariant(*s_1)
-    _ = plt.plot(x, calc_token_balance(x, n_s_1, w_c_1, w_s_1, k_1) - y_norm,
-                 c='k', linestyle='-', alpha=0.2, label='Final Invariant')
-    _ = plt.plot(x, calc_token_balance(x, n_l_1, w_c_1, w_l_1, k_1) - y_norm,
-                 c='k', linestyle='-', alpha=0.2)
-
-    # Plot final state
-    ax_l = plt.plot(n_c_1, n_l_1_n, markerfacecolor='k', marker='o',
-                    markeredgecolor='k', markersize=12, alpha=0.5, label='Long', linestyle='none')
-    ax_s = plt.plot(n_c_1, n_s_1_n, markerfacecolor='w', marker='o',
-                    markeredgecolor='k', markersize=12, alpha=0.5, label='Short', linestyle='none')
-
-    if normalize_y:
-        _ = plt.plot(x, np.ones_like(x)*(n_c_0/coin_per_pair + min(n_l_0, n_s_0)),
-                     linestyle='-.', c='k', alpha=0.2, label='Initial Balance')
-    else:
-        _ = plt.plot(x, ((n_c_0 + min(n_l_0, n_s_0)*coin_per_pair) - x)/coin_per_pair,
-                     linestyle='-.', c='k', alpha=0.2, label='Initial Balance')
-
-    norm_str = ' (normalized)' if normalize_y else ''
-    _ = plt.title(
-        f'Action: {action}{norm_str}\n'
-        f'Tokens in: {a_c:0.2f}  Tokens out: {tok_out:0.2f}  Average Price: {avg_price:0.2f}\n'
-        + f'Old balance: {n_c_0:0.2f} Coin  {n_l_0:0.2f} Long  {n_s_0:0.2f}  Short\n'
-        + f'New balance: {n_c_1:0.2f} Coin  {n_l_1:0.2f} Long  {n_s_1:0.2f}  Short\n'
-        + f'Old spot prices: Long {spot_l_0:0.2f}  Short {spot_s_0:0.2f}\n'
-        + f'New spot prices: Long {spot_l_1:0.2f}  Short {spot_s_1:0.2f}\n'
-    )
-    _ = plt.xlabel('$n_c$')
-    if normalize_y:
-        _ = plt.ylabel('$n_l, n_s$ (normalized)')
-    else:
-        _ = plt.ylabel('$n_l, n_s$')
-    _ = plt.legend()
-
-
-    return s_1, tok_out, avg_price
-
-
-def plot_orderbook(state, is_long=True, **plot_args):
-    tok_ind = 1 if is_long else 2
-
-    sell_volume = np.flip(np.linspace(float(state[tok_ind] / 1000.), float(state[tok_ind] / 2.), 20))
-    sell_price = np.array(
-        [perform_action('swap_to_coin', state, v, rebalance=False, from_long=is_long)[2]
-         for v in sell_volume]
-    )
-
-    buy_volume = np.linspace(float(state[0] / 1000.), float(state[0] / 2.), 20)
-    buy_price = np.array(
-        [perform_action('swap_from_coin', state, v, rebalance=False, to_long=is_long)[2]
-         for v in buy_volume]
-    )
-
-    _ = plt.plot(
-        np.concatenate([sell_price, buy_price]),
-        np.concatenate([sell_volume, buy_volume / buy_price]),
-        **plot_args)
-
-
-def plot_action_orderbook(
-        s_0, a_c, n_c_min=5000, n_c_max=20000, action='swap_from_coin', coin_per_pair=100,
-        xlim=None, ylim=None, **swap_params):
-    n_c_0, n_l_0, n_s_0, w_c_0, w_l_0, w_s_0 = s_0
-    spot_l_0, spot_s_0 = get_amm_spot_prices(s_0)
-
-    s_1, tok_out, avg_price = perform_action(action, s_0, a_c, coin_per_pair=coin_per_pair, **swap_params)
-
-    n_c_1, n_l_1, n_s_1, w_c_1, w_l_1, w_s_1 = s_1
-    spot_l_1, spot_s_1 = get_amm_spot_prices(s_1)
-
-    # Plot initial state
-    _ = plt.subplot(1, 2, 1)
-    plot_orderbook(s_0, is_long=False, c='k', linestyle=':', alpha=0.2)
-    plot_orderbook(s_1, is_long=False, c='k', linestyle='-', alpha=0.5)
-    _ = plt.xlabel('Price')
-    _ = plt.ylabel('Volume')
-    _ = plt.title('Short')
-    _ = plt.legend(['Initial', 'Final'])
-    if xlim is not None:
-        _ = plt.xlim(xlim)
-    if ylim is not None:
-        _ = plt.ylim(ylim)
-
-    _ = plt.subplot(1, 2, 2)
-    plot_orderbook(s_0, is_long=True, c='k', linestyle=':', alpha=0.2)
-    plot_orderbook(s_1, is_long=True, c='k', linestyle='-', alpha=0.5)
-    _ = plt.xlabel('Price')
-    _ = plt.ylabel('Volume')
-    _ = plt.title('Long')
-    _ = plt.legend(['Initial', 'Final'])
-    if xlim is not None:
-        _ = plt.xlim(xlim)
-    if ylim is not None:
-        _ = plt.ylim(ylim)
-
-    #     _ = plt.title(
-    #         f'Tokens in: {a_c:0.2f}  Tokens out: {tok_out:0.2f}  Average Price: {avg_price:0.2f}\n'
-    #         + f'Old balance: {n_c_0:0.2f} Coin  {n_l_0:0.2f} Long  {n_s_0:0.2f}  Short\n'
-    #         + f'New balance: {n_c_1:0.2f} Coin  {n_l_1:0.2f} Long  {n_s_1:0.2f}  Short\n'
-    #         + f'Old spot prices: Long {spot_l_0:0.2f}  Short {spot_s_0:0.2f}\n'
-    #         + f'New spot prices: Long {spot_l_1:0.2f}  Short {spot_s_1:0.2f}\n'
-    #     )
-    #     _ = plt.xlabel('$n_c$')
-    #     _ = plt.ylabel('$n_l, n_s$')
-    #     _ = plt.legend()
-
+    if isinstance(s_0, AMMState):
+        s_1 = as_amm_state(s_1)
     return s_1, tok_out, avg_price
 
 
@@ -635,3 +589,21 @@ def perform_action_sequence(initial_state, actions, reporter=None):
         tok_outs.append(tok_out)
         avg_prices.append(avg_price)
     return states, tok_outs, avg_prices
+
+
+# Star imports keep giving the plotting functions, and so import matplotlib
+__all__ = sorted(
+    [name for name, value in globals().items()
+     if not name.startswith('_') and getattr(value, '__module__', None) == __name__]
+    + ['PLOT_FUNCTIONS'] + list(PLOT_FUNCTIONS))
+
+
+def __getattr__(name):
+    if name in PLOT_FUNCTIONS:
+        amm_plot = importlib.import_module('.amm_plot', __package__)
+        return getattr(amm_plot, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | PLOT_FUNCTIONS)
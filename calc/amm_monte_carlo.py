@@ -0,0 +1,165 @@
+"""Monte Carlo simulation of Mettalex pool PnL over many oracle price paths
+
+Each path starts from the same pool and at every step:
+1. traders swap with the pool (random side and size, a fraction of them
+   informed about the next oracle move),
+2. the oracle price moves by a logit random walk, so it stays between the
+   vault priceFloor and priceCap,
+3. the pool weights are reset to the new oracle price as done by
+   updateSpotAndNormalizeWeights in the strategy contract.
+
+All paths in a batch are stepped together with the amm_batch functions and
+batches are spread over a process pool.  Only the final values of each path
+are kept and the results are reported as distribution summaries.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .amm_math import set_amm_state_closed_form
+from .amm_batch import (
+    as_states, batch_swap_from_coin, batch_swap_to_coin, max_amount_in, N_TOK
+)
+
+PERCENTILES = [1, 5, 25, 50, 75, 95, 99]
+
+
+def oracle_state(x_c, x_l, x_s, v, C, sF=0):
+    """Vectorized updateSpotAndNormalizeWeights: weights giving long price v*C and short price (1-v)*C
+    """
+    return np.column_stack(np.broadcast_arrays(*set_amm_state_closed_form(x_c, x_l, x_s, v, C, sF)))
+
+
+def pool_value(states, v, C):
+    """Pool value in coin at oracle prices"""
+    return states[:, 0] + states[:, 1]*v*C + states[:, 2]*(1 - v)*C
+
+
+def simulate_paths(
+        n_paths, n_steps, x_c_0, x_l_0, x_s_0, price_0, price_floor, price_cap,
+        coin_per_pair=100, sigma=0.02, trade_prob=0.5, trade_size=100., informed_frac=0.,
+        sF=0.003, seed=None):
+    """Simulate n_paths price paths in one vectorized batch
+
+    :param x_c_0, x_l_0, x_s_0: initial coin, long and short pool balances
+    :param price_0: initial oracle price, between price_floor and price_cap
+    :param coin_per_pair: coin needed to mint one long and one short token
+    :param sigma: standard deviation of each logit price step
+    :param trade_prob: probability of a trade on each path at each step
+    :param trade_size: median trade size in coin, sizes are lognormal
+    :param informed_frac: fraction of trades taken in the direction of the next price move
+    :param sF: swap fee
+    :param seed: seed or numpy SeedSequence for the random generator
+    :return: dict of per-path final values: pnl, impermanent_loss, final_price, volume
+    """
+    rng = np.random.default_rng(seed)
+    C = coin_per_pair
+    v = np.full(n_paths, (price_0 - price_floor) / (price_cap - price_floor))
+    logit_v = np.log(v / (1 - v))
+    states = as_states(oracle_state(
+        np.full(n_paths, float(x_c_0)), np.full(n_paths, float(x_l_0)),
+        np.full(n_paths, float(x_s_0)), v, C))
+    initial_value = pool_value(states, v, C)
+    volume = np.zeros(n_paths)
+
+    for _ in range(n_steps):
+        logit_v += sigma * rng.standard_normal(n_paths)
+        v_next = 1 / (1 + np.exp(-logit_v))
+
+        trade = rng.random(n_paths) < trade_prob
+        buy = rng.random(n_paths) < 0.5
+        long_side = rng.random(n_paths) < 0.5
+        # Informed traders buy long or sell short when the price will rise
+        informed = rng.random(n_paths) < informed_frac
+        rising = v_next > v
+        long_side = np.where(informed, buy == rising, long_side)
+        size = trade_size * rng.lognormal(0., 1., n_paths)
+
+        rows = np.flatnonzero(trade & buy)
+        if rows.size:
+            to_long = long_side[rows]
+            s = states[rows]
+            a_c = np.minimum(size[rows], max_amount_in(
+                np.where(to_long, s[:, 1], s[:, 2]), np.where(to_long, s[:, 4], s[:, 5]),
+                s[:, 0], s[:, 3], sF))
+            states[rows] = batch_swap_from_coin(
+                s, a_c, to_long=to_long, sF=sF, coin_per_pair=C)[0]
+            volume[rows] += a_c
+        rows = np.flatnonzero(trade & ~buy)
+        if rows.size:
+            # Sell tokens worth size coin at the oracle price
+            from_long = long_side[rows]
+            s = states[rows]
+            tok_price = np.where(from_long, v[rows], 1 - v[rows]) * C
+            a_t = np.minimum(size[rows] / tok_price, max_amount_in(
+                s[:, 0], s[:, 3], np.where(from_long, s[:, 1], s[:, 2]),
+                np.where(from_long, s[:, 4], s[:, 5]), sF))
+            states[rows] = batch_swap_to_coin(
+                s, a_t, from_long=from_long, sF=sF, coin_per_pair=C)[0]
+            volume[rows] += a_t * tok_price
+
+        v = v_next
+        states[:, N_TOK:] = oracle_state(states[:, 0], states[:, 1], states[:, 2], v, C)[:, N_TOK:]
+
+    final_value = pool_value(states, v, C)
+    hold_value = x_c_0 + x_l_0*v*C + x_s_0*(1 - v)*C
+    return {
+        'pnl': final_value - initial_value,
+        'impermanent_loss': final_value / hold_value - 1,
+        'final_price': price_floor + v*(price_cap - price_floor),
+        'volume': volume
+    }
+
+
+def _simulate_task(args):
+    kwargs, seed = args
+    return simulate_paths(seed=seed, **kwargs)
+
+
+def summarize(values):
+    """Distribution summary of a 1D array of path results"""
+    values = np.asarray(values)
+    summary = {
+        'mean': values.mean(),
+        'std': values.std(),
+        'min': values.min(),
+        'max': values.max()
+    }
+    summary.update({f'p{p}': x for p, x in zip(PERCENTILES, np.percentile(values, PERCENTILES))})
+    return summary
+
+
+def run_monte_carlo(n_paths, n_steps, n_workers=None, paths_per_task=2000, seed=0,
+                    return_paths=False, **params):
+    """Simulate n_paths paths split into batches over a process pool
+
+    :param n_paths: total number of price paths
+    :param n_steps: number of oracle updates per path
+    :param n_workers: number of processes, default os.cpu_count(), 1 runs in process
+    :param paths_per_task: number of paths vectorized together in each task
+    :param seed: seed for the independent random streams of each task
+    :param return_paths: if True also return the per-path final values
+    :param params: arguments of simulate_paths, e.g. x_c_0, x_l_0, x_s_0, price_0,
+        price_floor, price_cap, sigma, trade_size, informed_frac, sF
+    :return: dict of metric -> summary (and dict of metric -> array if return_paths)
+    """
+    n_workers = n_workers or os.cpu_count()
+    task_sizes = [min(paths_per_task, n_paths - start) for start in range(0, n_paths, paths_per_task)]
+    seeds = np.random.SeedSequence(seed).spawn(len(task_sizes))
+    tasks = [
+        (dict(params, n_paths=size, n_steps=n_steps), task_seed)
+        for size, task_seed in zip(task_sizes, seeds)
+    ]
+
+    if n_workers == 1:
+        results = [_simulate_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(_simulate_task, tasks))
+
+    paths = {name: np.concatenate([r[name] for r in results]) for name in results[0]}
+    summary = {name: summarize(values) for name, values in paths.items()}
+    if return_paths:
+        return summary, paths
+    return summary
@@ -0,0 +1,218 @@
+"""Batch engine for pools holding several commodities' long and short tokens
+
+A pool with n commodities holds n_tok = 1 + 2*n tokens against one coin.
+States are (M, 2*n_tok) float arrays with the amm_batch layout generalized:
+balances of coin, long_0, short_0, long_1, short_1, ... followed by the
+weights in the same order, so a single commodity pool is exactly an
+amm_batch state.
+
+Weights are denormalized as in the Balancer pool, prices depend only on
+weight ratios.  Rebalancing a commodity sets its long and short weights
+for the target prices and leaves the coin weight and every other commodity
+unchanged, which gives the same prices (and swap results) as
+set_amm_state_closed_form for one commodity.
+
+Every operation only reads and writes the columns of the tokens involved,
+O(1) per state for swaps, mint/redeem and rebalances (O(n_tok) when copying
+into a new array, pass out=states to update in place).  Token and commodity
+arguments may be scalars or one value per state.
+"""
+import numpy as np
+
+from .amm_batch import _mint_redeem_balances
+from .amm_math import calc_out_given_in
+
+COIN_IND = 0
+
+
+def n_tokens(states):
+    return states.shape[1] // 2
+
+
+def long_index(commodity):
+    """Token index of the long token of commodity"""
+    return 1 + 2 * np.asarray(commodity)
+
+
+def short_index(commodity):
+    """Token index of the short token of commodity"""
+    return 2 + 2 * np.asarray(commodity)
+
+
+def as_multi_states(states, n_commodities=None):
+    """Return states as an (M, 2*n_tok) float array, promoting a single state to M=1"""
+    states = np.asarray(states, dtype=float)
+    if states.ndim == 1:
+        states = states.reshape(1, -1)
+    if states.shape[1] % 2 or (states.shape[1] // 2) % 2 != 1:
+        raise ValueError('States must have 2*(1 + 2*n_commodities) columns', states.shape)
+    if n_commodities is not None and n_tokens(states) != 1 + 2 * n_commodities:
+        raise ValueError('Wrong number of commodities', states.shape, n_commodities)
+    return states
+
+
+def _output(states, out):
+    if out is None:
+        return states.copy()
+    if out is not states:
+        out[:] = states
+    return out
+
+
+def _get(states, ind):
+    if np.ndim(ind) == 0:
+        return states[:, ind]
+    return states[np.arange(states.shape[0]), ind]
+
+
+def _set(states, ind, value):
+    if np.ndim(ind) == 0:
+        states[:, ind] = value
+    else:
+        states[np.arange(states.shape[0]), ind] = value
+
+
+def make_states(x_c, x_long, x_short, v, coin_per_pair, w_c=1.):
+    """States with each commodity's weights set for long price v*C and short price (1-v)*C
+
+    :param x_c: coin balance, scalar or length M
+    :param x_long, x_short: (M, n) or length n balances of each commodity's tokens
+    :param v: oracle price fractions broadcastable to (M, n)
+    :param coin_per_pair: coin to mint a pair, broadcastable to (M, n)
+    :param w_c: coin weight
+    :return: (M, 2*(1 + 2*n)) states
+    """
+    x_long = np.atleast_2d(np.asarray(x_long, dtype=float))
+    x_short = np.atleast_2d(np.asarray(x_short, dtype=float))
+    m = max(np.size(x_c), x_long.shape[0])
+    n = x_long.shape[1]
+    n_tok = 1 + 2 * n
+    states = np.empty((m, 2 * n_tok))
+    states[:, COIN_IND] = x_c
+    states[:, 1:n_tok:2] = x_long
+    states[:, 2:n_tok:2] = x_short
+    states[:, n_tok + COIN_IND] = w_c
+    v = np.broadcast_to(v, (m, n))
+    coin_per_pair = np.broadcast_to(coin_per_pair, (m, n))
+    for k in range(n):
+        batch_rebalance(states, k, v[:, k], coin_per_pair[:, k], out=states)
+    return states
+
+
+def batch_spot_price(states, token_out, token_in=COIN_IND, sF=0):
+    """Spot price of token_out in units of token_in for each state"""
+    states = as_multi_states(states)
+    n_tok = n_tokens(states)
+    return (_get(states, token_in) / _get(states, token_in + n_tok)
+            / (_get(states, token_out) / _get(states, token_out + n_tok)) / (1 - sF))
+
+
+def batch_commodity_prices(states, commodity, sF=0):
+    """(long price, short price) in coin of commodity for each state"""
+    return (batch_spot_price(states, long_index(commodity), sF=sF),
+            batch_spot_price(states, short_index(commodity), sF=sF))
+
+
+def batch_pool_value(states):
+    """Pool value in coin at the pool spot prices"""
+    states = as_multi_states(states)
+    n_tok = n_tokens(states)
+    coin_ratio = states[:, COIN_IND] / states[:, n_tok + COIN_IND]
+    # x_t*price_t = x_c*w_t/w_c, so value is x_c*(sum of weights)/w_c
+    return coin_ratio * states[:, n_tok:].sum(axis=1)
+
+
+def batch_swap(states, token_in, token_out, aI, sF=0, out=None):
+    """Swap aI of token_in for token_out in every state
+
+    :param token_in, token_out: token indices, scalars or length M
+    :param out: array for the new states, pass states to update in place
+    :return: (new_states, aO, avg_price) with avg_price in token_in per token_out
+    """
+    states = as_multi_states(states)
+    n_tok = n_tokens(states)
+    bI, wI = _get(states, token_in), _get(states, token_in + n_tok)
+    bO, wO = _get(states, token_out), _get(states, token_out + n_tok)
+    aO = calc_out_given_in(bO, wO, bI, wI, aI, sF)
+    avg_price = aI / aO
+    out = _output(states, out)
+    _set(out, token_in, bI + aI)
+    _set(out, token_out, bO - aO)
+    return out, aO, avg_price
+
+
+def batch_rebalance(states, commodity, v, coin_per_pair, out=None):
+    """Set weights of commodity for long price v*C and short price (1-v)*C
+
+    The coin weight is kept, so no other token price changes.
+    """
+    states = as_multi_states(states)
+    n_tok = n_tokens(states)
+    l_ind, s_ind = long_index(commodity), short_index(commodity)
+    # price_t = (x_c/w_c)/(x_t/w_t)  =>  w_t = price_t*x_t*w_c/x_c
+    weight_per_value = states[:, n_tok + COIN_IND] / states[:, COIN_IND]
+    w_l = v * coin_per_pair * _get(states, l_ind) * weight_per_value
+    w_s = (1 - v) * coin_per_pair * _get(states, s_ind) * weight_per_value
+    out = _output(states, out)
+    _set(out, l_ind + n_tok, w_l)
+    _set(out, s_ind + n_tok, w_s)
+    return out
+
+
+def batch_rebalance_to_spot_ratio(states, commodity, coin_per_pair, out=None):
+    """Rebalance commodity to v = long price/(long price + short price), as swaps with rebalance=True"""
+    n_tok = n_tokens(states)
+    l_ind, s_ind = long_index(commodity), short_index(commodity)
+    ltk_ratio = _get(states, l_ind + n_tok) / _get(states, l_ind)
+    stk_ratio = _get(states, s_ind + n_tok) / _get(states, s_ind)
+    return batch_rebalance(states, commodity, ltk_ratio / (ltk_ratio + stk_ratio), coin_per_pair, out=out)
+
+
+def batch_swap_from_coin(states, commodity, aI, to_long=True, sF=0, coin_per_pair=1,
+                         rebalance=False, out=None):
+    """Swap aI coin in for the long or short token of commodity
+
+    :param to_long: bool or length M bool array
+    :return: (new_states, aO, avg_price)
+    """
+    token = np.where(to_long, long_index(commodity), short_index(commodity))
+    out, aO, avg_price = batch_swap(states, COIN_IND, token, aI, sF, out=out)
+    if rebalance:
+        batch_rebalance_to_spot_ratio(out, commodity, coin_per_pair, out=out)
+    return out, aO, avg_price
+
+
+def batch_swap_to_coin(states, commodity, aI, from_long=True, sF=0, coin_per_pair=1,
+                       rebalance=False, out=None):
+    """Swap aI long or short tokens of commodity in for coin
+
+    :return: (new_states, aO, avg_price) with avg_price in coin per token
+    """
+    token = np.where(from_long, long_index(commodity), short_index(commodity))
+    out, aO, _ = batch_swap(states, token, COIN_IND, aI, sF, out=out)
+    if rebalance:
+        batch_rebalance_to_spot_ratio(out, commodity, coin_per_pair, out=out)
+    return out, aO, aO / aI
+
+
+def batch_mint_redeem(states, commodity, a_c, coin_per_pair=100, rebalance=False, out=None):
+    """Mint (a_c >= 0 coin) or redeem (a_c < 0 pairs) pairs of commodity
+
+    Raises ValueError if any state has insufficient coin or tokens, as mint_redeem.
+    With rebalance the commodity keeps the long price it had before.
+
+    :return: (new_states, tok_out, avg_price)
+    """
+    states = as_multi_states(states)
+    a_c = np.broadcast_to(np.asarray(a_c, dtype=float), states.shape[:1])
+    l_ind, s_ind = long_index(commodity), short_index(commodity)
+    x_c, x_l, x_s = states[:, COIN_IND], _get(states, l_ind), _get(states, s_ind)
+    x_c_1, x_l_1, x_s_1, tok_out = _mint_redeem_balances(x_c, x_l, x_s, a_c, coin_per_pair)
+    v = batch_commodity_prices(states, commodity)[0] / coin_per_pair if rebalance else None
+    out = _output(states, out)
+    out[:, COIN_IND] = x_c_1
+    _set(out, l_ind, x_l_1)
+    _set(out, s_ind, x_s_1)
+    if rebalance:
+        batch_rebalance(out, commodity, v, coin_per_pair, out=out)
+    return out, tok_out, coin_per_pair / 2
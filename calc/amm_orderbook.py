@@ -0,0 +1,154 @@
+"""Order book depth of the pool for long or short tokens against coin
+
+Swaps between coin and one position token move the pool along the Balancer
+curve x_c * x_t**r = A with r = w_t / w_c (the other token's balance and
+all weights unchanged).  A ladder evaluates that curve once at a grid of
+token balances y and quotes every level from differences of the coin
+balances F(y) = A * y**-r:
+
+    sell q tokens: y = x_t + q*(1 - sF),   coin out = x_c - F(y)
+    buy with c coin: x_c + c*(1 - sF) = F(y),   tokens out = x_t - y
+
+which is the same as calc_out_given_in for each level.  A swap that leaves
+the weights unchanged only changes A (fees stay in the pool), so after_swap
+rescales F instead of re-evaluating the powers.  A rebalance changes r and
+needs a new ladder.
+
+    ladder = get_ladder(state, is_long=True, sF=0.003)
+    ladder.sell_price, ladder.sell_volume   # bids: average price for selling tokens
+    ladder.buy_price, ladder.buy_volume     # asks: average price for buying tokens
+    ladder = ladder.after_swap(new_state)
+
+Ladders are immutable so get_ladder caches them by state.
+"""
+import functools
+
+import numpy as np
+
+N_LEVELS = 20
+CACHE_SIZE = 1024
+
+
+class DepthLadder(object):
+    """Buy and sell depth for one position token at a pool state
+
+    :param state: [x_c, x_l, x_s, w_c, w_l, w_s] pool state
+    :param is_long: True for the long token, False for short
+    :param sF: swap fee
+    :param y: sorted pool token balances at the ladder levels
+    :param f_y: pool coin balance on the curve at each y, computed if None
+    """
+    __slots__ = ('state', 'is_long', 'sF', 'y', 'f_y', '_x_c', '_x_t', '_r')
+
+    def __init__(self, state, is_long, sF, y, f_y=None):
+        tok_ind = 1 if is_long else 2
+        self.state = tuple(float(x) for x in state)
+        self.is_long = is_long
+        self.sF = sF
+        self._x_c = self.state[0]
+        self._x_t = self.state[tok_ind]
+        self._r = self.state[tok_ind + 3] / self.state[3]
+        self.y = y
+        self.f_y = self._curve(y) if f_y is None else f_y
+
+    def _curve(self, y):
+        """Coin balance F(y) at token balance y on the curve through the current state"""
+        return self._x_c * (self._x_t / y)**self._r
+
+    @property
+    def _sell(self):
+        return self.y > self._x_t
+
+    @property
+    def _buy(self):
+        # Nearest level first as for the sell side
+        return np.flatnonzero(self.y < self._x_t)[::-1]
+
+    @property
+    def sell_volume(self):
+        """Tokens sold into the pool to reach each level above the current balance"""
+        return (self.y[self._sell] - self._x_t) / (1 - self.sF)
+
+    @property
+    def sell_coin_out(self):
+        return self._x_c - self.f_y[self._sell]
+
+    @property
+    def sell_price(self):
+        """Average price in coin for selling sell_volume tokens"""
+        return self.sell_coin_out / self.sell_volume
+
+    @property
+    def buy_volume(self):
+        """Tokens bought from the pool to reach each level below the current balance"""
+        return self._x_t - self.y[self._buy]
+
+    @property
+    def buy_coin_in(self):
+        return (self.f_y[self._buy] - self._x_c) / (1 - self.sF)
+
+    @property
+    def buy_price(self):
+        """Average price in coin for buying buy_volume tokens"""
+        return self.buy_coin_in / self.buy_volume
+
+    def quote_sell(self, volume):
+        """Coin out for selling volume tokens, scalar or array"""
+        return self._x_c - self._curve(self._x_t + np.asarray(volume) * (1 - self.sF))
+
+    def quote_buy(self, coin_in):
+        """Tokens out for buying with coin_in coin, scalar or array"""
+        return self._x_t * (1 - (self._x_c / (self._x_c + np.asarray(coin_in) * (1 - self.sF)))**(1 / self._r))
+
+    def after_swap(self, new_state):
+        """Ladder for the state after swaps between coin and either token
+
+        The level grid is kept and the curve rescaled when the weights are
+        unchanged and the new balance is inside the grid, otherwise a new
+        ladder is built.
+        """
+        new_state = tuple(float(x) for x in new_state)
+        tok_ind = 1 if self.is_long else 2
+        if new_state[3:] != self.state[3:] or not self.y[0] < new_state[tok_ind] < self.y[-1]:
+            return get_ladder(new_state, self.is_long, self.sF, len(self.y) // 2)
+        scale = (new_state[0] / self._x_c) * (new_state[tok_ind] / self._x_t)**self._r
+        return DepthLadder(new_state, self.is_long, self.sF, self.y, self.f_y * scale)
+
+
+def level_grid(state, is_long=True, sF=0, n_levels=N_LEVELS):
+    """Token balances at the ladder levels
+
+    Sell levels are for 1/1000 to 1/2 of the token balance sold, buy levels for
+    1/1000 to 1/2 of the coin balance paid in, as in plot_orderbook.
+    """
+    tok_ind = 1 if is_long else 2
+    x_c, x_t, w_c, w_t = (float(state[i]) for i in (0, tok_ind, 3, tok_ind + 3))
+    sell = x_t + np.linspace(x_t / 1000., x_t / 2., n_levels) * (1 - sF)
+    coin_in = np.linspace(x_c / 1000., x_c / 2., n_levels)
+    buy = x_t * (x_c / (x_c + coin_in * (1 - sF)))**(w_c / w_t)
+    return np.concatenate([np.flip(buy), sell])
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _cached_ladder(state, is_long, sF, n_levels):
+    return DepthLadder(state, is_long, sF, level_grid(state, is_long, sF, n_levels))
+
+
+def get_ladder(state, is_long=True, sF=0, n_levels=N_LEVELS):
+    """Depth ladder for state, cached by state, side, fee and number of levels per side"""
+    return _cached_ladder(tuple(float(x) for x in state), bool(is_long), float(sF), n_levels)
+
+
+def depth(state, sF=0, n_levels=N_LEVELS):
+    """Ladders for both position tokens
+
+    :return: dict token name -> dict of bid and ask (price, volume) arrays
+    """
+    result = {}
+    for name, is_long in [('long', True), ('short', False)]:
+        ladder = get_ladder(state, is_long, sF, n_levels)
+        result[name] = {
+            'bid_price': ladder.sell_price, 'bid_volume': ladder.sell_volume,
+            'ask_price': ladder.buy_price, 'ask_volume': ladder.buy_volume
+        }
+    return result
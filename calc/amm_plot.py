@@ -0,0 +1,249 @@
+"""Plotting of AMM states and actions
+
+Split from amm_math so that the pricing and simulation functions can be
+imported without matplotlib and seaborn.  The functions are still available
+as amm_math attributes, which import this module on first use.
+"""
+import numpy as np
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+from .amm_math import (
+    calc_balancer_invariant, calc_token_balance, calc_out_given_in, set_amm_state,
+    get_amm_spot_prices, get_amm_balance, simple_swap_from_coin, perform_action
+)
+
+
+def simulate_swaps_from_coin(x_c_0, x_l_0, x_s_0, v, C, from_coin=True, c_max=1000, n_row=1, offset=0, f=None):
+    initial_state = set_amm_state(x_c_0, x_l_0, x_s_0, v, C)
+
+    coin_in_short = np.linspace(-c_max, 1., 20)
+    coin_in_long = np.linspace(1., c_max, 20)
+    # Swap coin for short
+    states_short, coin_out_short, avg_price_short = zip(
+        *[simple_swap_from_coin(initial_state, -t, coin_per_pair=100, rebalance=True, to_long=False)
+          for t in coin_in_short])
+
+    # Swap coin for long
+    states_long, coin_out_long, avg_price_long = zip(
+        *[simple_swap_from_coin(initial_state, t, coin_per_pair=100, rebalance=True)
+          for t in coin_in_long])
+
+    coin_in = np.concatenate([coin_in_short, coin_in_long])
+    states = np.concatenate([np.array(states_short), np.array(states_long)])
+    # coin_out = [] + coin_out_short + coin_out_long
+    avg_price = np.concatenate([np.array(avg_price_short), np.array(avg_price_long)])
+
+    # # No rebalancing, raw C-> L (or C->S) swap
+    # states_raw, tok_out_raw, avg_price_raw = zip(
+    #     *[simple_swap_from_coin(initial_state, c, coin_per_pair=100, rebalance=False) for c in coin_in])
+
+    if n_row == 1 and not f:
+        _ = plt.figure(figsize=(10, 4))
+    # Pool balance
+
+    balances = np.array([get_amm_balance(s) for s in states])
+    # balances_raw = np.array([get_amm_balance(s) for s in states_raw])
+
+    _ = plt.subplot(n_row, 2, 1 + 2 * offset)
+    _ = plt.plot(coin_in, balances)
+    #     _ = plt.plot(coin_in, balances_raw, linestyle='--')
+    _ = plt.legend(['With Rebalance',
+                    #                     'No Rebalance'
+                    ])
+    _ = plt.title(f'Spot Price = {v}')
+    _ = plt.xlabel('Coin In')
+    _ = plt.ylabel('Pool balance')
+
+    _ = plt.subplot(n_row, 2, 2 + 2 * offset)
+    spot_prices = np.array([get_amm_spot_prices(s) for s in states])
+    _ = plt.plot(coin_in, spot_prices)
+    _ = plt.plot(coin_in, np.sum(spot_prices, axis=1), alpha=0.5)
+    _ = plt.plot(coin_in, avg_price, alpha=0.2, c='k', linestyle=':')
+    _ = plt.legend(['Long', 'Short', 'Long + Short', 'CoinIn/TokOut'])
+    _ = plt.xlabel('Coin In')
+    _ = plt.ylabel('Spot Price')
+
+
+def plot_action(
+        s_0, a_c, n_c_min=5000., n_c_max=20000.,
+        action='swap_from_coin', coin_per_pair=100, normalize_y=False, **swap_params
+):
+    """Plot action performed on AMM as plot of token balances vs coin balance
+    This is similar to an indifference curve plot in micro-economics
+
+    :param s_0:
+    :param a_c:
+    :param n_c_min:
+    :param n_c_max:
+    :param action:
+    :param coin_per_pair:
+    :param swap_params:
+    :return:
+    """
+    n_c_0, n_l_0, n_s_0, w_c_0, w_l_0, w_s_0 = s_0
+    spot_l_0, spot_s_0 = get_amm_spot_prices(s_0)
+
+    s_1, tok_out, avg_price = perform_action(action, s_0, a_c, coin_per_pair=coin_per_pair, **swap_params)
+
+    n_c_1, n_l_1, n_s_1, w_c_1, w_l_1, w_s_1 = s_1
+    spot_l_1, spot_s_1 = get_amm_spot_prices(s_1)
+
+    x = np.linspace(n_c_min, n_c_max, 100).reshape(-1, 1)
+
+    initial_balance = 0  # n_c_0 + min(n_l_0, n_s_0) * coin_per_pair
+    if normalize_y:
+        y_norm = (initial_balance - x)/coin_per_pair
+        n_s_0_n = n_s_0 - (initial_balance - n_c_0)/coin_per_pair
+        n_l_0_n = n_l_0 - (initial_balance - n_c_0)/coin_per_pair
+        n_s_1_n = n_s_1 - (initial_balance - n_c_1)/coin_per_pair
+        n_l_1_n = n_l_1 - (initial_balance - n_c_1)/coin_per_pair
+    else:
+        y_norm = np.zeros_like(x)
+        n_s_0_n = n_s_0
+        n_l_0_n = n_l_0
+        n_s_1_n = n_s_1
+        n_l_1_n = n_l_1
+
+    # Plot initial state
+    k_0 = calc_balancer_invariant(*s_0)
+    _ = plt.plot(x, calc_token_balance(x, n_s_0, w_c_0, w_s_0, k_0) - y_norm,
+                 c='k', linestyle=':', alpha=0.2, label='Initial Invariant')
+    _ = plt.plot(x, calc_token_balance(x, n_l_0, w_c_0, w_l_0, k_0) - y_norm,
+                 c='k', linestyle=':', alpha=0.2)
+    _ = plt.plot(n_c_0, n_l_0_n, markerfacecolor='k', marker='o', markeredgecolor='k', markersize=8, alpha=0.2)
+    _ = plt.plot(n_c_0, n_s_0_n, markerfacecolor='w', marker='o', markeredgecolor='k', markersize=8, alpha=0.2)
+
+    # Plot state movement
+    if action != 'mint_redeem':
+        x_move = np.linspace(float(min(n_c_0, n_c_1)), float(max(n_c_0, n_c_1)), 100).reshape(-1, 1)
+        if normalize_y:
+            y_norm_move = (initial_balance - x_move) / coin_per_pair
+        else:
+            y_norm_move = np.zeros_like(x_move)
+        if n_l_1 != n_l_0:
+            # Long swap
+            _ = plt.plot(x_move, calc_token_balance(x_move, n_s_0, w_c_0, w_s_0, k_0) - y_norm_move,
+                         c='k', linestyle='-', alpha=0.5, label='Swap')
+            _ = plt.plot([n_c_0, n_c_1], [n_s_0_n, n_s_1_n], c='k', alpha=0.5)
+        else:
+            # Short swap
+            _ = plt.plot(x_move, calc_token_balance(x_move, n_l_0, w_c_0, w_l_0, k_0) - y_norm_move,
+                         c='k', linestyle='-', alpha=0.5, label='Swap')
+            _ = plt.plot([n_c_0, n_c_1], [n_l_0_n, n_l_1_n], c='k', alpha=0.5)
+    else:
+        _ = plt.plot([n_c_0, n_c_1], [[n_l_0_n, n_s_0_n], [n_l_1_n, n_s_1_n]],
+                     c='k', alpha=0.5, label='Mint/Redeem')
+
+    # Plot invariant curves without rebalance of weights for final state
+    _ = plt.plot(x, calc_token_balance(x, n_s_1, w_c_0, w_s_0, k_0) - y_norm,
+                 c='k', linestyle='--', alpha=0.2, label='Intermediate Invariant')
+    _ = plt.plot(x, calc_token_balance(x, n_l_1, w_c_0, w_l_0, k_0) - y_norm,
+                 c='k', linestyle='--', alpha=0.2)
+
+    # Plot final invariant after rebalance
+    k_1 = calc_balancer_invariant(*s_1)
+    _ = plt.plot(x, calc_token_balance(x, n_s_1, w_c_1, w_s_1, k_1) - y_norm,
+                 c='k', linestyle='-', alpha=0.2, label='Final Invariant')
+    _ = plt.plot(x, calc_token_balance(x, n_l_1, w_c_1, w_l_1, k_1) - y_norm,
+                 c='k', linestyle='-', alpha=0.2)
+
+    # Plot final state
+    ax_l = plt.plot(n_c_1, n_l_1_n, markerfacecolor='k', marker='o',
+                    markeredgecolor='k', markersize=12, alpha=0.5, label='Long', linestyle='none')
+    ax_s = plt.plot(n_c_1, n_s_1_n, markerfacecolor='w', marker='o',
+                    markeredgecolor='k', markersize=12, alpha=0.5, label='Short', linestyle='none')
+
+    if normalize_y:
+        _ = plt.plot(x, np.ones_like(x)*(n_c_0/coin_per_pair + min(n_l_0, n_s_0)),
+                     linestyle='-.', c='k', alpha=0.2, label='Initial Balance')
+    else:
+        _ = plt.plot(x, ((n_c_0 + min(n_l_0, n_s_0)*coin_per_pair) - x)/coin_per_pair,
+                     linestyle='-.', c='k', alpha=0.2, label='Initial Balance')
+
+    norm_str = ' (normalized)' if normalize_y else ''
+    _ = plt.title(
+        f'Action: {action}{norm_str}\n'
+        f'Tokens in: {a_c:0.2f}  Tokens out: {tok_out:0.2f}  Average Price: {avg_price:0.2f}\n'
+        + f'Old balance: {n_c_0:0.2f} Coin  {n_l_0:0.2f} Long  {n_s_0:0.2f}  Short\n'
+        + f'New balance: {n_c_1:0.2f} Coin  {n_l_1:0.2f} Long  {n_s_1:0.2f}  Short\n'
+        + f'Old spot prices: Long {spot_l_0:0.2f}  Short {spot_s_0:0.2f}\n'
+        + f'New spot prices: Long {spot_l_1:0.2f}  Short {spot_s_1:0.2f}\n'
+    )
+    _ = plt.xlabel('$n_c$')
+    if normalize_y:
+        _ = plt.ylabel('$n_l, n_s$ (normalized)')
+    else:
+        _ = plt.ylabel('$n_l, n_s$')
+    _ = plt.legend()
+
+
+    return s_1, tok_out, avg_price
+
+
+def plot_orderbook(state, is_long=True, **plot_args):
+    tok_ind = 1 if is_long else 2
+
+    x_c, x_t, w_c, w_t = (float(state[i]) for i in (0, tok_ind, 3, tok_ind + 3))
+
+    # Average prices for all volumes in one vectorized pass, see also amm_orderbook
+    sell_volume = np.flip(np.linspace(x_t / 1000., x_t / 2., 20))
+    sell_price = calc_out_given_in(x_c, w_c, x_t, w_t, sell_volume) / sell_volume
+
+    buy_volume = np.linspace(x_c / 1000., x_c / 2., 20)
+    buy_price = buy_volume / calc_out_given_in(x_t, w_t, x_c, w_c, buy_volume)
+
+    _ = plt.plot(
+        np.concatenate([sell_price, buy_price]),
+        np.concatenate([sell_volume, buy_volume / buy_price]),
+        **plot_args)
+
+
+def plot_action_orderbook(
+        s_0, a_c, n_c_min=5000, n_c_max=20000, action='swap_from_coin', coin_per_pair=100,
+        xlim=None, ylim=None, **swap_params):
+    n_c_0, n_l_0, n_s_0, w_c_0, w_l_0, w_s_0 = s_0
+    spot_l_0, spot_s_0 = get_amm_spot_prices(s_0)
+
+    s_1, tok_out, avg_price = perform_action(action, s_0, a_c, coin_per_pair=coin_per_pair, **swap_params)
+
+    n_c_1, n_l_1, n_s_1, w_c_1, w_l_1, w_s_1 = s_1
+    spot_l_1, spot_s_1 = get_amm_spot_prices(s_1)
+
+    # Plot initial state
+    _ = plt.subplot(1, 2, 1)
+    plot_orderbook(s_0, is_long=False, c='k', linestyle=':', alpha=0.2)
+    plot_orderbook(s_1, is_long=False, c='k', linestyle='-', alpha=0.5)
+    _ = plt.xlabel('Price')
+    _ = plt.ylabel('Volume')
+    _ = plt.title('Short')
+    _ = plt.legend(['Initial', 'Final'])
+    if xlim is not None:
+        _ = plt.xlim(xlim)
+    if ylim is not None:
+        _ = plt.ylim(ylim)
+
+    _ = plt.subplot(1, 2, 2)
+    plot_orderbook(s_0, is_long=True, c='k', linestyle=':', alpha=0.2)
+    plot_orderbook(s_1, is_long=True, c='k', linestyle='-', alpha=0.5)
+    _ = plt.xlabel('Price')
+    _ = plt.ylabel('Volume')
+    _ = plt.title('Long')
+    _ = plt.legend(['Initial', 'Final'])
+    if xlim is not None:
+        _ = plt.xlim(xlim)
+    if ylim is not None:
+        _ = plt.ylim(ylim)
+
+    #     _ = plt.title(
+    #         f'Tokens in: {a_c:0.2f}  Tokens out: {tok_out:0.2f}  Average Price: {avg_price:0.2f}\n'
+    #         + f'Old balance: {n_c_0:0.2f} Coin  {n_l_0:0.2f} Long  {n_s_0:0.2f}  Short\n'
+    #         + f'New balance: {n_c_1:0.2f} Coin  {n_l_1:0.2f} Long  {n_s_1:0.2f}  Short\n'
+    #         + f'Old spot prices: Long {spot_l_0:0.2f}  Short {spot_s_0:0.2f}\n'
+    #         + f'New spot prices: Long {spot_l_1:0.2f}  Short {spot_s_1:0.2f}\n'
+    #     )
+    #     _ = plt.xlabel('$n_c$')
+    #     _ = plt.ylabel('$n_l, n_s$')
+    #     _ = plt.legend()
+
+    return s_1, tok_out, avg_price
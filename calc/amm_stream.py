@@ -0,0 +1,257 @@
+"""Streaming version of perform_action_sequence for long action sequences
+
+Actions are (action, a_c, params) tuples as for perform_action_sequence and
+may come from any iterable, e.g. read_actions_csv for order flow replay.
+Only the current state is kept: results are written into fixed size chunk
+buffers which are handed to reducers (PnL, imbalance, price path) and then
+reused, so memory does not grow with the number of actions.  Nothing is
+printed unless a reporter is attached, use SamplingReporter to report every
+n-th step.
+"""
+import csv
+import json
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from .amm_math import perform_action, calc_spot_price, print_state_change
+
+CHUNK_SIZE = 10_000
+
+# Columns of a chunk, state columns use the same layout as the state lists
+STATE_COLUMNS = ['x_c', 'x_l', 'x_s', 'w_c', 'w_l', 'w_s']
+CHUNK_COLUMNS = ['step', 'a_c', 'tok_out', 'avg_price', 'lp_flow'] + STATE_COLUMNS
+
+
+class Reducer(ABC):
+    """Aggregate simulation results chunk by chunk
+
+    update is called with a dict of column name -> array for each chunk,
+    arrays are only valid during the call as the buffers are reused.
+    Subclasses must implement update and result, start is optional.
+    """
+    def start(self, initial_state):
+        pass
+
+    @abstractmethod
+    def update(self, chunk):
+        pass
+
+    @abstractmethod
+    def result(self):
+        pass
+
+
+class PnLReducer(Reducer):
+    """Pool value at spot prices and LP PnL net of deposits and withdrawals
+    """
+    def start(self, initial_state):
+        self.initial_value = _pool_value(*[np.array([x]) for x in initial_state])[0]
+        self.final_value = self.initial_value
+        self.min_value = self.initial_value
+        self.max_value = self.initial_value
+        self.net_flow = 0.
+
+    def update(self, chunk):
+        value = _pool_value(*[chunk[c] for c in STATE_COLUMNS])
+        self.final_value = value[-1]
+        self.min_value = min(self.min_value, value.min())
+        self.max_value = max(self.max_value, value.max())
+        self.net_flow += chunk['lp_flow'].sum()
+
+    def result(self):
+        return {
+            'initial_value': self.initial_value,
+            'final_value': self.final_value,
+            'min_value': self.min_value,
+            'max_value': self.max_value,
+            'net_flow': self.net_flow,
+            'pnl': self.final_value - self.initial_value - self.net_flow
+        }
+
+
+class ImbalanceReducer(Reducer):
+    """Long minus short token balance held by the pool
+    """
+    def start(self, initial_state):
+        self.final = initial_state[1] - initial_state[2]
+        self.max_abs = abs(self.final)
+        self.total = 0.
+        self.n = 0
+
+    def update(self, chunk):
+        imbalance = chunk['x_l'] - chunk['x_s']
+        self.final = imbalance[-1]
+        self.max_abs = max(self.max_abs, np.abs(imbalance).max())
+        self.total += imbalance.sum()
+        self.n += len(imbalance)
+
+    def result(self):
+        return {
+            'final': self.final,
+            'max_abs': self.max_abs,
+            'mean': self.total / self.n if self.n else self.final
+        }
+
+
+class PricePathReducer(Reducer):
+    """Long and short spot price path downsampled to at most max_points
+
+    Whenever the path is full every other point is dropped and the sampling
+    interval doubled, so memory stays bounded for any sequence length.
+    """
+    def __init__(self, max_points=10_000):
+        self.max_points = max_points
+
+    def start(self, initial_state):
+        self.every = 1
+        spot_l, spot_s = _spot_prices(*[np.array([x]) for x in initial_state])
+        self.steps = [0]
+        self.prices = [(spot_l[0], spot_s[0])]
+
+    def update(self, chunk):
+        steps = chunk['step']
+        keep = steps % self.every == 0
+        spot_l, spot_s = _spot_prices(*[chunk[c][keep] for c in STATE_COLUMNS])
+        self.steps.extend(steps[keep].tolist())
+        self.prices.extend(zip(spot_l.tolist(), spot_s.tolist()))
+        while len(self.steps) > self.max_points:
+            self.every *= 2
+            keep = [i for i, step in enumerate(self.steps) if step % self.every == 0]
+            self.steps = [self.steps[i] for i in keep]
+            self.prices = [self.prices[i] for i in keep]
+
+    def result(self):
+        return np.array(self.steps), np.array(self.prices)
+
+
+class SamplingReporter(object):
+    """Reporter calling report_fun for every n-th step only
+
+    :param every: report interval in steps
+    :param report_fun: function with the perform_action_sequence reporter
+        signature, default print_state_change
+    """
+    def __init__(self, every=1000, report_fun=None):
+        self.every = every
+        self.report_fun = report_fun or (
+            lambda action, s_0, a_c, s_1, tok_out, avg_price: print_state_change(
+                action, s_0, a_c, s_1=s_1, tok_out=tok_out, avg_price=avg_price))
+        self.n = 0
+
+    def __call__(self, action, s_0, a_c, s_1, tok_out, avg_price):
+        self.n += 1
+        if self.n % self.every == 0:
+            self.report_fun(action, s_0, a_c, s_1, tok_out, avg_price)
+
+
+def _spot_prices(x_c, x_l, x_s, w_c, w_l, w_s):
+    return calc_spot_price(x_c, w_c, x_l, w_l), calc_spot_price(x_c, w_c, x_s, w_s)
+
+
+def _pool_value(x_c, x_l, x_s, w_c, w_l, w_s):
+    spot_l, spot_s = _spot_prices(x_c, x_l, x_s, w_c, w_l, w_s)
+    return x_c + x_l*spot_l + x_s*spot_s
+
+
+def iter_action_results(initial_state, actions, reporter=None):
+    """Generator version of perform_action_sequence
+
+    :param initial_state: AMM state list
+    :param actions: iterable of (action, a_c, params) tuples
+    :param reporter: optional function(action, s_0, a_c, s_1, tok_out, avg_price)
+    :return: generator of (action, a_c, new_state, tok_out, avg_price)
+    """
+    state = initial_state
+    for action, a_c, params in actions:
+        new_state, tok_out, avg_price = perform_action(action, state, a_c, **params)
+        if reporter is not None:
+            reporter(action, state, a_c, new_state, tok_out, avg_price)
+        yield action, a_c, new_state, tok_out, avg_price
+        state = new_state
+
+
+def iter_chunks(initial_state, actions, chunk_size=CHUNK_SIZE, reporter=None):
+    """Group results of iter_action_results into chunks of column arrays
+
+    The same buffers are reused for every chunk so consumers must copy any
+    arrays they want to keep.  The last chunk may be shorter.
+
+    :return: generator of dicts of column name -> array
+    """
+    buffers = {c: np.empty(chunk_size) for c in CHUNK_COLUMNS}
+    i = 0
+    for step, (action, a_c, state, tok_out, avg_price) in enumerate(
+            iter_action_results(initial_state, actions, reporter), 1):
+        buffers['step'][i] = step
+        buffers['a_c'][i] = a_c
+        buffers['tok_out'][i] = tok_out
+        buffers['avg_price'][i] = avg_price
+        # Coin added by liquidity providers, used to separate PnL from deposits
+        buffers['lp_flow'][i] = a_c if action == 'deposit' else -a_c if action == 'withdraw' else 0.
+        for c, x in zip(STATE_COLUMNS, state):
+            buffers[c][i] = x
+        i += 1
+        if i == chunk_size:
+            yield buffers
+            i = 0
+    if i:
+        yield {c: buffer[:i] for c, buffer in buffers.items()}
+
+
+def simulate_stream(initial_state, actions, reducers=None, chunk_size=CHUNK_SIZE, reporter=None):
+    """Run action sequence with constant memory, aggregating results with reducers
+
+    :param initial_state: AMM state list
+    :param actions: iterable of (action, a_c, params) tuples
+    :param reducers: dict of name -> Reducer, default PnL, imbalance and price path
+    :param chunk_size: number of steps per chunk passed to reducers
+    :param reporter: optional reporter e.g. SamplingReporter(every=10_000)
+    :return: (final_state, dict of name -> reducer result)
+    """
+    if reducers is None:
+        reducers = {
+            'pnl': PnLReducer(),
+            'imbalance': ImbalanceReducer(),
+            'price_path': PricePathReducer()
+        }
+    for reducer in reducers.values():
+        reducer.start(initial_state)
+
+    final_state = initial_state
+    for chunk in iter_chunks(initial_state, actions, chunk_size, reporter):
+        for reducer in reducers.values():
+            reducer.update(chunk)
+        final_state = [chunk[c][-1] for c in STATE_COLUMNS]
+
+    return final_state, {name: reducer.result() for name, reducer in reducers.items()}
+
+
+def read_actions_csv(file_name):
+    """Stream actions from CSV file with columns action, amount and optional params
+
+    params is a JSON object of keyword arguments for perform_action,
+    e.g. {"to_long": true, "coin_per_pair": 100, "rebalance": true}
+
+    :return: generator of (action, a_c, params) tuples
+    """
+    with open(file_name, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            params = json.loads(row['params']) if row.get('params') else {}
+            yield row['action'], float(row['amount']), params
+
+
+def read_actions_parquet(file_name, batch_size=CHUNK_SIZE):
+    """Stream actions from Parquet file with the same columns as read_actions_csv
+
+    Requires pyarrow, which is only imported when this function is used.
+
+    :return: generator of (action, a_c, params) tuples
+    """
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(file_name).iter_batches(batch_size=batch_size):
+        columns = batch.to_pydict()
+        params = columns.get('params', [None] * batch.num_rows)
+        for action, amount, action_params in zip(columns['action'], columns['amount'], params):
+            yield action, float(amount), json.loads(action_params) if action_params else {}
@@ -0,0 +1,233 @@
+"""Parameter sweeps comparing rebalance strategies
+
+A sweep evaluates a scenario function for every cell of a parameter grid,
+e.g.
+
+    rows = run_sweep({
+        'rebalance_type': ['oracle', 'amm', 'weighted'],
+        'sF': [0, 0.003],
+        'coin_per_pair': [100],
+        'token_fraction': [0.25, 0.5],
+        'x_c': [10_000, 100_000],
+    })
+
+Cells are evaluated in a process pool.  Each finished cell is written to
+cache_dir under the hash of its parameters so a rerun, or a larger grid
+sharing cells with an earlier one, only evaluates the new cells.  Results
+are returned as a tidy table: one row per cell holding the cell parameters,
+the scenario metrics and an error column for cells whose scenario raised.
+
+Cache keys include a hash of the source of the scenario module and of
+amm_math, so editing either invalidates the cached cells.  Changes elsewhere
+(e.g. amm_batch used by a custom scenario) need the cache directory cleared.
+"""
+import csv
+import functools
+import hashlib
+import inspect
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from pathlib import Path
+
+from . import amm_math
+from .amm_math import (
+    set_amm_state, set_amm_state_orig, set_amm_state_closed_form,
+    get_amm_spot_prices, get_amm_balance, perform_action
+)
+
+DEFAULT_CACHE_DIR = Path(__file__).parent / 'sweep-cache'
+
+# Rebalance functions are given by name in grids so cells can be hashed
+REBALANCE_FUNS = {
+    'set_amm_state': set_amm_state,
+    'set_amm_state_orig': set_amm_state_orig,
+    'set_amm_state_closed_form': set_amm_state_closed_form
+}
+
+DEFAULT_PARAMS = {
+    'x_c': 10_000.,
+    'x_l': 100.,
+    'x_s': 100.,
+    'v': 0.5,
+    'coin_per_pair': 100,
+    'sF': 0.,
+    'rebalance': True,
+    'rebalance_fun': 'set_amm_state_closed_form',
+    'rebalance_type': 'oracle',
+    'token_fraction': 0.5,
+    'deposit': 1_000.,
+    'trade_size': 500.
+}
+
+
+def _check_state(state, step):
+    """Spot prices of state, raising ValueError if a weight or spot price is not positive"""
+    spot = get_amm_spot_prices(state)
+    if min(state[3:]) <= 0 or min(spot) <= 0:
+        raise ValueError(f'Non-positive weight or spot price after {step}', list(state), spot)
+    return spot
+
+
+def round_trip_scenario(params):
+    """Deposit liquidity then buy and sell back long and short tokens
+
+    The initial state is set with rebalance_fun at oracle price v*coin_per_pair,
+    the deposit uses rebalance_type, token_fraction and rebalance_fun and every
+    swap uses sF, rebalance and rebalance_fun.  Raises ValueError if any state
+    has a weight or spot price that is not positive, so the cell is reported
+    as an error rather than with meaningless metrics.
+
+    :param params: cell parameters, see DEFAULT_PARAMS
+    :return: dict of metric -> value
+    """
+    C = params['coin_per_pair']
+    rebalance_fun = REBALANCE_FUNS[params['rebalance_fun']]
+    swap_params = {
+        'coin_per_pair': C, 'sF': params['sF'],
+        'rebalance': params['rebalance'], 'rebalance_fun': rebalance_fun
+    }
+    initial_state = rebalance_fun(params['x_c'], params['x_l'], params['x_s'], params['v'], C)
+    initial_spot = _check_state(initial_state, 'initial')
+
+    state, _, _ = perform_action(
+        'deposit', initial_state, params['deposit'], coin_per_pair=C,
+        oracle_price=params['v'] * C, rebalance_type=params['rebalance_type'],
+        token_fraction=params['token_fraction'], rebalance_fun=rebalance_fun)
+    deposit_spot = _check_state(state, 'deposit')
+
+    metrics = {
+        'initial_balance': get_amm_balance(initial_state),
+        'deposit_balance': get_amm_balance(state),
+        'deposit_spot_long': deposit_spot[0],
+        'deposit_spot_short': deposit_spot[1]
+    }
+    for side, to_long in [('long', True), ('short', False)]:
+        state, tok_out, buy_price = perform_action(
+            'swap_from_coin', state, params['trade_size'], to_long=to_long, **swap_params)
+        _check_state(state, f'{side}_buy')
+        state, coin_out, sell_price = perform_action(
+            'swap_to_coin', state, tok_out, from_long=to_long, **swap_params)
+        metrics[f'{side}_buy_price'] = buy_price
+        metrics[f'{side}_sell_price'] = sell_price
+        metrics[f'{side}_slippage'] = buy_price / deposit_spot[0 if to_long else 1] - 1
+        metrics[f'{side}_round_trip_loss'] = params['trade_size'] - coin_out
+
+    final_spot = _check_state(state, 'final')
+    metrics.update({
+        'final_balance': get_amm_balance(state),
+        'final_spot_long': final_spot[0],
+        'final_spot_short': final_spot[1],
+        'initial_spot_long': initial_spot[0],
+        'initial_spot_short': initial_spot[1],
+        'pnl': get_amm_balance(state) - metrics['initial_balance'] - params['deposit']
+    })
+    return metrics
+
+
+def grid_cells(grid, defaults=None):
+    """Expand grid of parameter -> list of values into list of cell parameter dicts
+
+    Parameters not in grid take their value from defaults (DEFAULT_PARAMS by default).
+    """
+    defaults = DEFAULT_PARAMS if defaults is None else defaults
+    names = list(grid)
+    return [dict(defaults, **dict(zip(names, values))) for values in product(*grid.values())]
+
+
+@functools.lru_cache(maxsize=None)
+def code_version(module_name):
+    """Hash of the source of the scenario module and amm_math"""
+    sources = [inspect.getsource(sys.modules[module_name]), inspect.getsource(amm_math)]
+    return hashlib.sha1('\n'.join(sources).encode()).hexdigest()
+
+
+def cell_key(params, scenario):
+    """Hash identifying the result of scenario for params with the current code"""
+    description = json.dumps(
+        {
+            'scenario': f'{scenario.__module__}.{scenario.__qualname__}', 'params': params,
+            'code': code_version(scenario.__module__)
+        },
+        sort_keys=True)
+    return hashlib.sha1(description.encode()).hexdigest()
+
+
+def _evaluate_cell(args):
+    scenario, params = args
+    try:
+        return {'metrics': scenario(params), 'error': None}
+    except Exception as e:
+        return {'metrics': {}, 'error': repr(e)}
+
+
+def _write_json_atomic(file_name, data):
+    tmp_file_name = f'{file_name}.tmp'
+    with open(tmp_file_name, 'w') as f:
+        json.dump(data, f, default=float)
+    os.replace(tmp_file_name, file_name)
+
+
+def run_sweep(grid, scenario=round_trip_scenario, defaults=None, cache_dir=DEFAULT_CACHE_DIR,
+              n_workers=None, rerun_errors=False):
+    """Evaluate scenario over all cells of grid, skipping cells cached by earlier runs
+
+    :param grid: dict of parameter name -> list of values
+    :param scenario: module level function(params) -> dict of metrics
+    :param defaults: values of parameters not in grid, default DEFAULT_PARAMS
+    :param cache_dir: directory of cached cell results, None disables the cache
+    :param n_workers: number of processes, default os.cpu_count(), 1 runs in process
+    :param rerun_errors: if True evaluate cached cells that raised again
+    :return: list of row dicts: cell parameters, metrics and error
+    """
+    cells = grid_cells(grid, defaults)
+    keys = [cell_key(params, scenario) for params in cells]
+    results = {}
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        for key in keys:
+            file_name = os.path.join(cache_dir, f'{key}.json')
+            if os.path.isfile(file_name):
+                with open(file_name, 'r') as f:
+                    result = json.load(f)
+                if result['error'] is None or not rerun_errors:
+                    results[key] = result
+
+    todo = {key: params for key, params in zip(keys, cells) if key not in results}
+    tasks = [(scenario, params) for params in todo.values()]
+
+    def store(new_results):
+        for key, result in zip(todo, new_results):
+            results[key] = result
+            if cache_dir is not None:
+                _write_json_atomic(os.path.join(cache_dir, f'{key}.json'), result)
+
+    n_workers = n_workers or os.cpu_count()
+    if n_workers == 1 or len(tasks) <= 1:
+        store(map(_evaluate_cell, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            store(executor.map(_evaluate_cell, tasks))
+
+    return [
+        dict(params, **results[key]['metrics'], error=results[key]['error'])
+        for key, params in zip(keys, cells)
+    ]
+
+
+def write_csv(rows, file_name):
+    """Write sweep rows to CSV file, columns are the union of row keys"""
+    columns = list(dict.fromkeys(c for row in rows for c in row))
+    with open(file_name, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def to_dataframe(rows):
+    """Sweep rows as pandas DataFrame, pandas is only imported when this is used"""
+    import pandas as pd
+
+    return pd.DataFrame(rows)
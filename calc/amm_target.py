@@ -0,0 +1,76 @@
+"""Size the swap that moves the pool price of a token to a target
+
+For a swap of aI into a Balancer pool the spot price of the output token in
+terms of the input token changes by
+
+    R = sP'/sP = (t - sF)/(1 - sF) * t**(wI/wO),   t = 1 + aI*(1 - sF)/bI
+
+Without fee this gives t = R**(1/(1 + wI/wO)) directly.  With fee there is no
+closed form, so that value is used as starting point for a fixed number of
+vectorized Newton steps on log(t - sF) + (wI/wO)*log(t) = log((1 - sF)*R).
+The function is concave, and the starting point is never below the root,
+so the steps converge from below to machine precision in N_NEWTON steps for
+any practical fee.
+
+All functions work on scalars or arrays of states and targets, e.g. to size
+the trades for thousands of pools on each oracle update.  The sizes are for
+swaps without rebalance, as simple_swap_from_coin / simple_swap_to_coin
+with rebalance=False.
+"""
+import numpy as np
+
+from .amm_batch import as_states, COIN_IND, LTK_IND, STK_IND, N_TOK
+
+N_NEWTON = 4
+
+
+def calc_in_given_price(bI, wI, bO, wO, sP, sF=0, n_newton=N_NEWTON):
+    """Amount in that raises calc_spot_price(bI, wI, bO, wO, sF) to sP
+
+    :param sP: target spot price of the output token in units of the input token
+    :return: amount of input token, 0 where sP is not above the current spot price
+    """
+    bI, wI, bO, wO, sP = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (bI, wI, bO, wO, sP)))
+    ratio = np.maximum(sP / ((bI / wI) / (bO / wO) / (1 - sF)), 1.)
+    e = wI / wO
+    t = ratio**(1 / (1 + e))
+    if sF:
+        log_target = np.log((1 - sF) * ratio)
+        for _ in range(n_newton):
+            h = np.log(t - sF) + e*np.log(t) - log_target
+            t = np.maximum(t - h / (1 / (t - sF) + e / t), 1.)
+    a_in = bI * (t - 1) / (1 - sF)
+    return a_in if a_in.ndim else float(a_in)
+
+
+def trade_to_price(states, target_price, is_long=True, sF=0, n_newton=N_NEWTON):
+    """Swap that moves the long (or short) spot price of each state to target_price
+
+    Prices are get_amm_spot_prices prices.  Raising the price needs coin
+    swapped in for the token (simple_swap_from_coin), lowering it needs the
+    token swapped in for coin (simple_swap_to_coin).
+
+    :param states: (N, 6) states or a single state
+    :param target_price: scalar or length N target prices in coin
+    :return: (from_coin, amount_in) length N arrays: True where coin is swapped
+        in, and the coin or token amount to swap in
+    """
+    states = as_states(states)
+    tok_ind = LTK_IND if is_long else STK_IND
+    x_c, w_c = states[:, COIN_IND], states[:, COIN_IND + N_TOK]
+    x_t, w_t = states[:, tok_ind], states[:, tok_ind + N_TOK]
+    target_price = np.broadcast_to(np.asarray(target_price, dtype=float), x_c.shape)
+    from_coin = target_price >= (x_c / w_c) / (x_t / w_t)
+    # Spot prices include the fee factor, so scale the target price to match
+    coin_in = calc_in_given_price(
+        x_c, w_c, x_t, w_t, np.atleast_1d(target_price / (1 - sF)), sF, n_newton)
+    token_in = calc_in_given_price(
+        x_t, w_t, x_c, w_c, np.atleast_1d(1 / target_price / (1 - sF)), sF, n_newton)
+    return from_coin, np.where(from_coin, coin_in, token_in)
+
+
+def trade_to_oracle(states, v, coin_per_pair, is_long=True, sF=0, n_newton=N_NEWTON):
+    """Swap that moves the long (or short) price to the oracle price v*C (or (1-v)*C)"""
+    v = np.asarray(v, dtype=float)
+    return trade_to_price(
+        states, (v if is_long else 1 - v) * coin_per_pair, is_long=is_long, sF=sF, n_newton=n_newton)
@@ -0,0 +1,516 @@
+"""Exact Python emulation of the Balancer BNum and BMath contracts
+
+All quantities are unsigned integers in the same fixed point representation
+used on-chain (BONE = 10**18 is 1.0), and every function reproduces the
+integer arithmetic of mettalex-balancer/contracts/BNum.sol and BMath.sol
+including rounding, so results are bit-identical to the deployed BPool.
+Failed require statements raise ValueError with the contract error string.
+
+Functions keep the argument order of the Solidity versions, note that this
+differs from the floating point helpers in amm_math e.g.
+    calc_out_given_in(tokenBalanceIn, tokenWeightIn,
+                      tokenBalanceOut, tokenWeightOut, tokenAmountIn, swapFee)
+
+Two modes are provided:
+* Scalar functions on Python ints (bmul, calc_out_given_in, ...) are the fast
+  path for individual quotes.
+* The *_array functions take integer numpy arrays (int64 or object) and
+  evaluate whole quote grids at once.  Values are held in object arrays of
+  Python ints as uint256 products overflow int64.
+"""
+import numpy as np
+
+# BConst
+BONE = 10**18
+
+MIN_BOUND_TOKENS = 2
+MAX_BOUND_TOKENS = 8
+
+MIN_FEE = BONE // 10**6
+MAX_FEE = BONE // 10
+EXIT_FEE = 0
+
+MIN_WEIGHT = BONE
+MAX_WEIGHT = BONE * 50
+MAX_TOTAL_WEIGHT = BONE * 50
+MIN_BALANCE = BONE // 10**12
+
+INIT_POOL_SUPPLY = BONE * 100
+
+MIN_BPOW_BASE = 1
+MAX_BPOW_BASE = (2 * BONE) - 1
+BPOW_PRECISION = BONE // 10**10
+
+MAX_IN_RATIO = BONE // 2
+MAX_OUT_RATIO = (BONE // 3) + 1
+
+MAX_UINT = 2**256 - 1
+
+
+# BNum: scalar fast path
+def btoi(a):
+    return a // BONE
+
+
+def bfloor(a):
+    return btoi(a) * BONE
+
+
+def badd(a, b):
+    c = a + b
+    if c > MAX_UINT:
+        raise ValueError('ERR_ADD_OVERFLOW')
+    return c
+
+
+def bsub(a, b):
+    c, flag = bsub_sign(a, b)
+    if flag:
+        raise ValueError('ERR_SUB_UNDERFLOW')
+    return c
+
+
+def bsub_sign(a, b):
+    if a >= b:
+        return a - b, False
+    else:
+        return b - a, True
+
+
+def bmul(a, b):
+    c0 = a * b
+    if c0 > MAX_UINT:
+        raise ValueError('ERR_MUL_OVERFLOW')
+    c1 = c0 + (BONE // 2)
+    if c1 > MAX_UINT:
+        raise ValueError('ERR_MUL_OVERFLOW')
+    return c1 // BONE
+
+
+def bdiv(a, b):
+    if b == 0:
+        raise ValueError('ERR_DIV_ZERO')
+    c0 = a * BONE
+    if c0 > MAX_UINT:
+        raise ValueError('ERR_DIV_INTERNAL')  # bmul overflow
+    c1 = c0 + (b // 2)
+    if c1 > MAX_UINT:
+        raise ValueError('ERR_DIV_INTERNAL')  # badd require
+    return c1 // b
+
+
+def bpowi(a, n):
+    """DSMath.wpow
+    """
+    z = a if n % 2 != 0 else BONE
+    n //= 2
+    while n != 0:
+        a = bmul(a, a)
+        if n % 2 != 0:
+            z = bmul(z, a)
+        n //= 2
+    return z
+
+
+def bpow(base, exp):
+    """Compute b^(e.w) by splitting it into (b^e)*(b^0.w).
+    Use bpowi for b^e and bpow_approx for k iterations of approximation of b^0.w
+    """
+    if base < MIN_BPOW_BASE:
+        raise ValueError('ERR_BPOW_BASE_TOO_LOW')
+    if base > MAX_BPOW_BASE:
+        raise ValueError('ERR_BPOW_BASE_TOO_HIGH')
+
+    whole = bfloor(exp)
+    remain = bsub(exp, whole)
+
+    whole_pow = bpowi(base, btoi(whole))
+
+    if remain == 0:
+        return whole_pow
+
+    partial_result = bpow_approx(base, remain, BPOW_PRECISION)
+    return bmul(whole_pow, partial_result)
+
+
+def bpow_approx(base, exp, precision):
+    # term 0:
+    a = exp
+    x, xneg = bsub_sign(base, BONE)
+    term = BONE
+    total = term
+    negative = False
+
+    # term(k) = numer / denom
+    #         = (product(a - i - 1, i=1-->k) * x^k) / (k!)
+    # each iteration, multiply previous term by (a-(k-1)) * x / k
+    # continue until term is less than precision
+    i = 1
+    while term >= precision:
+        big_k = i * BONE
+        c, cneg = bsub_sign(a, bsub(big_k, BONE))
+        term = bmul(term, bmul(c, x))
+        term = bdiv(term, big_k)
+        if term == 0:
+            break
+
+        if xneg:
+            negative = not negative
+        if cneg:
+            negative = not negative
+        if negative:
+            total = bsub(total, term)
+        else:
+            total = badd(total, term)
+        i += 1
+
+    return total
+
+
+# BMath: scalar fast path
+def calc_spot_price(token_balance_in, token_weight_in, token_balance_out, token_weight_out, swap_fee):
+    numer = bdiv(token_balance_in, token_weight_in)
+    denom = bdiv(token_balance_out, token_weight_out)
+    ratio = bdiv(numer, denom)
+    scale = bdiv(BONE, bsub(BONE, swap_fee))
+    return bmul(ratio, scale)
+
+
+def calc_out_given_in(
+        token_balance_in, token_weight_in, token_balance_out, token_weight_out,
+        token_amount_in, swap_fee):
+    weight_ratio = bdiv(token_weight_in, token_weight_out)
+    adjusted_in = bsub(BONE, swap_fee)
+    adjusted_in = bmul(token_amount_in, adjusted_in)
+    y = bdiv(token_balance_in, badd(token_balance_in, adjusted_in))
+    foo = bpow(y, weight_ratio)
+    bar = bsub(BONE, foo)
+    return bmul(token_balance_out, bar)
+
+
+def calc_in_given_out(
+        token_balance_in, token_weight_in, token_balance_out, token_weight_out,
+        token_amount_out, swap_fee):
+    weight_ratio = bdiv(token_weight_out, token_weight_in)
+    diff = bsub(token_balance_out, token_amount_out)
+    y = bdiv(token_balance_out, diff)
+    foo = bpow(y, weight_ratio)
+    foo = bsub(foo, BONE)
+    token_amount_in = bsub(BONE, swap_fee)
+    return bdiv(bmul(token_balance_in, foo), token_amount_in)
+
+
+def calc_pool_out_given_single_in(
+        token_balance_in, token_weight_in, pool_supply, total_weight,
+        token_amount_in, swap_fee):
+    # Charge the trading fee for the proportion of tokenAi
+    # which is implicitly traded to the other pool tokens.
+    normalized_weight = bdiv(token_weight_in, total_weight)
+    zaz = bmul(bsub(BONE, normalized_weight), swap_fee)
+    token_amount_in_after_fee = bmul(token_amount_in, bsub(BONE, zaz))
+
+    new_token_balance_in = badd(token_balance_in, token_amount_in_after_fee)
+    token_in_ratio = bdiv(new_token_balance_in, token_balance_in)
+
+    pool_ratio = bpow(token_in_ratio, normalized_weight)
+    new_pool_supply = bmul(pool_ratio, pool_supply)
+    return bsub(new_pool_supply, pool_supply)
+
+
+def calc_single_in_given_pool_out(
+        token_balance_in, token_weight_in, pool_supply, total_weight,
+        pool_amount_out, swap_fee):
+    normalized_weight = bdiv(token_weight_in, total_weight)
+    new_pool_supply = badd(pool_supply, pool_amount_out)
+    pool_ratio = bdiv(new_pool_supply, pool_supply)
+
+    boo = bdiv(BONE, normalized_weight)
+    token_in_ratio = bpow(pool_ratio, boo)
+    new_token_balance_in = bmul(token_in_ratio, token_balance_in)
+    token_amount_in_after_fee = bsub(new_token_balance_in, token_balance_in)
+    # Do reverse order of fees charged in joinswap_ExternAmountIn
+    zar = bmul(bsub(BONE, normalized_weight), swap_fee)
+    return bdiv(token_amount_in_after_fee, bsub(BONE, zar))
+
+
+def calc_single_out_given_pool_in(
+        token_balance_out, token_weight_out, pool_supply, total_weight,
+        pool_amount_in, swap_fee):
+    normalized_weight = bdiv(token_weight_out, total_weight)
+    # charge exit fee on the pool token side
+    pool_amount_in_after_exit_fee = bmul(pool_amount_in, bsub(BONE, EXIT_FEE))
+    new_pool_supply = bsub(pool_supply, pool_amount_in_after_exit_fee)
+    pool_ratio = bdiv(new_pool_supply, pool_supply)
+
+    token_out_ratio = bpow(pool_ratio, bdiv(BONE, normalized_weight))
+    new_token_balance_out = bmul(token_out_ratio, token_balance_out)
+
+    token_amount_out_before_swap_fee = bsub(token_balance_out, new_token_balance_out)
+
+    # charge swap fee on the output token side
+    zaz = bmul(bsub(BONE, normalized_weight), swap_fee)
+    return bmul(token_amount_out_before_swap_fee, bsub(BONE, zaz))
+
+
+def calc_pool_in_given_single_out(
+        token_balance_out, token_weight_out, pool_supply, total_weight,
+        token_amount_out, swap_fee):
+    # charge swap fee on the output token side
+    normalized_weight = bdiv(token_weight_out, total_weight)
+    zoo = bsub(BONE, normalized_weight)
+    zar = bmul(zoo, swap_fee)
+    token_amount_out_before_swap_fee = bdiv(token_amount_out, bsub(BONE, zar))
+
+    new_token_balance_out = bsub(token_balance_out, token_amount_out_before_swap_fee)
+    token_out_ratio = bdiv(new_token_balance_out, token_balance_out)
+
+    pool_ratio = bpow(token_out_ratio, normalized_weight)
+    new_pool_supply = bmul(pool_ratio, pool_supply)
+    pool_amount_in_after_exit_fee = bsub(pool_supply, new_pool_supply)
+
+    # charge exit fee on the pool token side
+    return bdiv(pool_amount_in_after_exit_fee, bsub(BONE, EXIT_FEE))
+
+
+# BNum: vectorized mode on object arrays of Python ints
+def as_uint_array(a):
+    """Convert integer scalar or array to an object array of Python ints
+    """
+    a = np.asarray(a)
+    if a.dtype != object and not np.issubdtype(a.dtype, np.integer):
+        raise ValueError('Fixed point values must be integers', a.dtype)
+    return a.astype(object)
+
+
+def _require(failed, message):
+    if np.any(failed):
+        raise ValueError(message)
+
+
+def badd_array(a, b):
+    c = a + b
+    _require(c > MAX_UINT, 'ERR_ADD_OVERFLOW')
+    return c
+
+
+def bsub_array(a, b):
+    c, flag = bsub_sign_array(a, b)
+    _require(flag, 'ERR_SUB_UNDERFLOW')
+    return c
+
+
+def bsub_sign_array(a, b):
+    flag = np.asarray(a < b, dtype=bool)
+    # np.where converts scalar operands that fit in int64 to int64
+    return np.where(flag, b - a, a - b).astype(object), flag
+
+
+def bmul_array(a, b):
+    c0 = a * b
+    _require(c0 > MAX_UINT, 'ERR_MUL_OVERFLOW')
+    c1 = c0 + (BONE // 2)
+    _require(c1 > MAX_UINT, 'ERR_MUL_OVERFLOW')
+    return c1 // BONE
+
+
+def bdiv_array(a, b):
+    _require(b == 0, 'ERR_DIV_ZERO')
+    c0 = a * BONE
+    _require(c0 > MAX_UINT, 'ERR_DIV_INTERNAL')  # bmul overflow
+    c1 = c0 + (b // 2)
+    _require(c1 > MAX_UINT, 'ERR_DIV_INTERNAL')  # badd require
+    return c1 // b
+
+
+def bpowi_array(a, n):
+    a, n = np.broadcast_arrays(as_uint_array(a), as_uint_array(n))
+    z = np.where(n % 2 != 0, a, BONE)
+    n = n // 2
+    active = np.asarray(n != 0, dtype=bool)
+    while active.any():
+        a = np.where(active, bmul_array(a, a), a)
+        z = np.where(active & np.asarray(n % 2 != 0, dtype=bool), bmul_array(z, a), z)
+        n = n // 2
+        active = np.asarray(n != 0, dtype=bool)
+    return z
+
+
+def bpow_array(base, exp):
+    base, exp = np.broadcast_arrays(as_uint_array(base), as_uint_array(exp))
+    _require(base < MIN_BPOW_BASE, 'ERR_BPOW_BASE_TOO_LOW')
+    _require(base > MAX_BPOW_BASE, 'ERR_BPOW_BASE_TOO_HIGH')
+
+    whole = (exp // BONE) * BONE
+    remain = bsub_array(exp, whole)
+
+    whole_pow = bpowi_array(base, whole // BONE)
+
+    partial = np.asarray(remain != 0, dtype=bool)
+    if not partial.any():
+        return whole_pow
+    result = whole_pow.copy()
+    partial_result = bpow_approx_array(base[partial], remain[partial], BPOW_PRECISION)
+    result[partial] = bmul_array(whole_pow[partial], partial_result)
+    return result
+
+
+def bpow_approx_array(base, exp, precision):
+    """Vectorized bpow_approx, iterating each element until its own term falls below precision
+
+    Only elements whose series has not yet terminated are updated on each
+    iteration so the result for every element is identical to bpow_approx.
+    """
+    base, exp = np.broadcast_arrays(as_uint_array(base), as_uint_array(exp))
+    a = exp.ravel()
+    x, xneg = bsub_sign_array(base.ravel(), BONE)
+    term = np.full(a.shape, BONE, dtype=object)
+    total = term.copy()
+    negative = np.zeros(a.shape, dtype=bool)
+
+    active = np.nonzero(term >= precision)[0]
+    i = 1
+    while active.size:
+        big_k = i * BONE
+        c, cneg = bsub_sign_array(a[active], big_k - BONE)
+        new_term = bdiv_array(bmul_array(term[active], bmul_array(c, x[active])), big_k)
+        term[active] = new_term
+
+        # Elements whose term reached zero stop without updating the sum
+        nonzero = np.asarray(new_term != 0, dtype=bool)
+        active, new_term, cneg = active[nonzero], new_term[nonzero], cneg[nonzero]
+        negative[active] ^= xneg[active]
+        negative[active] ^= cneg
+        neg = negative[active]
+        total[active[neg]] = bsub_array(total[active[neg]], new_term[neg])
+        total[active[~neg]] = badd_array(total[active[~neg]], new_term[~neg])
+
+        active = active[np.asarray(new_term >= precision, dtype=bool)]
+        i += 1
+
+    return total.reshape(base.shape)
+
+
+# BMath: vectorized mode
+def calc_spot_price_array(
+        token_balance_in, token_weight_in, token_balance_out, token_weight_out, swap_fee):
+    token_balance_in, token_weight_in, token_balance_out, token_weight_out, swap_fee = (
+        as_uint_array(a) for a in (
+            token_balance_in, token_weight_in, token_balance_out, token_weight_out, swap_fee))
+    numer = bdiv_array(token_balance_in, token_weight_in)
+    denom = bdiv_array(token_balance_out, token_weight_out)
+    ratio = bdiv_array(numer, denom)
+    scale = bdiv_array(BONE, bsub_array(BONE, swap_fee))
+    return bmul_array(ratio, scale)
+
+
+def calc_out_given_in_array(
+        token_balance_in, token_weight_in, token_balance_out, token_weight_out,
+        token_amount_in, swap_fee):
+    token_balance_in, token_weight_in, token_balance_out, token_weight_out, token_amount_in, \
+        swap_fee = (as_uint_array(a) for a in (
+            token_balance_in, token_weight_in, token_balance_out, token_weight_out,
+            token_amount_in, swap_fee))
+    weight_ratio = bdiv_array(token_weight_in, token_weight_out)
+    adjusted_in = bsub_array(BONE, swap_fee)
+    adjusted_in = bmul_array(token_amount_in, adjusted_in)
+    y = bdiv_array(token_balance_in, badd_array(token_balance_in, adjusted_in))
+    foo = bpow_array(y, weight_ratio)
+    bar = bsub_array(BONE, foo)
+    return bmul_array(token_balance_out, bar)
+
+
+def calc_in_given_out_array(
+        token_balance_in, token_weight_in, token_balance_out, token_weight_out,
+        token_amount_out, swap_fee):
+    token_balance_in, token_weight_in, token_balance_out, token_weight_out, token_amount_out, \
+        swap_fee = (as_uint_array(a) for a in (
+            token_balance_in, token_weight_in, token_balance_out, token_weight_out,
+            token_amount_out, swap_fee))
+    weight_ratio = bdiv_array(token_weight_out, token_weight_in)
+    diff = bsub_array(token_balance_out, token_amount_out)
+    y = bdiv_array(token_balance_out, diff)
+    foo = bpow_array(y, weight_ratio)
+    foo = bsub_array(foo, BONE)
+    token_amount_in = bsub_array(BONE, swap_fee)
+    return bdiv_array(bmul_array(token_balance_in, foo), token_amount_in)
+
+
+def calc_pool_out_given_single_in_array(
+        token_balance_in, token_weight_in, pool_supply, total_weight,
+        token_amount_in, swap_fee):
+    token_balance_in, token_weight_in, pool_supply, total_weight, token_amount_in, \
+        swap_fee = (as_uint_array(a) for a in (
+            token_balance_in, token_weight_in, pool_supply, total_weight,
+            token_amount_in, swap_fee))
+    normalized_weight = bdiv_array(token_weight_in, total_weight)
+    zaz = bmul_array(bsub_array(BONE, normalized_weight), swap_fee)
+    token_amount_in_after_fee = bmul_array(token_amount_in, bsub_array(BONE, zaz))
+
+    new_token_balance_in = badd_array(token_balance_in, token_amount_in_after_fee)
+    token_in_ratio = bdiv_array(new_token_balance_in, token_balance_in)
+
+    pool_ratio = bpow_array(token_in_ratio, normalized_weight)
+    new_pool_supply = bmul_array(pool_ratio, pool_supply)
+    return bsub_array(new_pool_supply, pool_supply)
+
+
+def calc_single_in_given_pool_out_array(
+        token_balance_in, token_weight_in, pool_supply, total_weight,
+        pool_amount_out, swap_fee):
+    token_balance_in, token_weight_in, pool_supply, total_weight, pool_amount_out, \
+        swap_fee = (as_uint_array(a) for a in (
+            token_balance_in, token_weight_in, pool_supply, total_weight,
+            pool_amount_out, swap_fee))
+    normalized_weight = bdiv_array(token_weight_in, total_weight)
+    new_pool_supply = badd_array(pool_supply, pool_amount_out)
+    pool_ratio = bdiv_array(new_pool_supply, pool_supply)
+
+    boo = bdiv_array(BONE, normalized_weight)
+    token_in_ratio = bpow_array(pool_ratio, boo)
+    new_token_balance_in = bmul_array(token_in_ratio, token_balance_in)
+    token_amount_in_after_fee = bsub_array(new_token_balance_in, token_balance_in)
+    zar = bmul_array(bsub_array(BONE, normalized_weight), swap_fee)
+    return bdiv_array(token_amount_in_after_fee, bsub_array(BONE, zar))
+
+
+def calc_single_out_given_pool_in_array(
+        token_balance_out, token_weight_out, pool_supply, total_weight,
+        pool_amount_in, swap_fee):
+    token_balance_out, token_weight_out, pool_supply, total_weight, pool_amount_in, \
+        swap_fee = (as_uint_array(a) for a in (
+            token_balance_out, token_weight_out, pool_supply, total_weight,
+            pool_amount_in, swap_fee))
+    normalized_weight = bdiv_array(token_weight_out, total_weight)
+    pool_amount_in_after_exit_fee = bmul_array(pool_amount_in, bsub_array(BONE, EXIT_FEE))
+    new_pool_supply = bsub_array(pool_supply, pool_amount_in_after_exit_fee)
+    pool_ratio = bdiv_array(new_pool_supply, pool_supply)
+
+    token_out_ratio = bpow_array(pool_ratio, bdiv_array(BONE, normalized_weight))
+    new_token_balance_out = bmul_array(token_out_ratio, token_balance_out)
+
+    token_amount_out_before_swap_fee = bsub_array(token_balance_out, new_token_balance_out)
+
+    zaz = bmul_array(bsub_array(BONE, normalized_weight), swap_fee)
+    return bmul_array(token_amount_out_before_swap_fee, bsub_array(BONE, zaz))
+
+
+def calc_pool_in_given_single_out_array(
+        token_balance_out, token_weight_out, pool_supply, total_weight,
+        token_amount_out, swap_fee):
+    token_balance_out, token_weight_out, pool_supply, total_weight, token_amount_out, \
+        swap_fee = (as_uint_array(a) for a in (
+            token_balance_out, token_weight_out, pool_supply, total_weight,
+            token_amount_out, swap_fee))
+    normalized_weight = bdiv_array(token_weight_out, total_weight)
+    zoo = bsub_array(BONE, normalized_weight)
+    zar = bmul_array(zoo, swap_fee)
+    token_amount_out_before_swap_fee = bdiv_array(token_amount_out, bsub_array(BONE, zar))
+
+    new_token_balance_out = bsub_array(token_balance_out, token_amount_out_before_swap_fee)
+    token_out_ratio = bdiv_array(new_token_balance_out, token_balance_out)
+
+    pool_ratio = bpow_array(token_out_ratio, normalized_weight)
+    new_pool_supply = bmul_array(pool_ratio, pool_supply)
+    pool_amount_in_after_exit_fee = bsub_array(pool_supply, new_pool_supply)
+
+    return bdiv_array(pool_amount_in_after_exit_fee, bsub_array(BONE, EXIT_FEE))
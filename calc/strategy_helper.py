@@ -0,0 +1,177 @@
+"""Exact Python emulation of StrategyHelper.CalcDenormWeights
+
+Reproduces the SafeMath integer arithmetic of
+pool-controller/contracts/helper/StrategyHelper.sol, including the order of
+multiplications and divisions, the +-1% floor/cap band and the
+APPROX_MULTIPLIER / INITIAL_MULTIPLIER scaling, so weights are bit-identical
+to the ones the strategy rebinds in updateSpotAndNormalizeWeights.
+Failed SafeMath checks raise ValueError with the SafeMath error string.
+
+Balances and weights use the contract order [short, long, coin], unlike the
+[coin, long, short] order of amm_math states.
+
+As in bmath, scalar functions work on Python ints and the *_array functions
+on integer numpy arrays, e.g. to evaluate thousands of candidate spot prices
+for the same balances at once.
+"""
+import numpy as np
+
+from .bmath import (
+    BONE, MAX_UINT, as_uint_array, _require, calc_spot_price, calc_spot_price_array
+)
+
+APPROX_MULTIPLIER = 47
+INITIAL_MULTIPLIER = 50
+
+# Index of each token in the contract balance and weight arrays
+STK_IND = 0
+LTK_IND = 1
+COIN_IND = 2
+
+
+# SafeMath: scalar
+def safe_add(a, b):
+    c = a + b
+    if c > MAX_UINT:
+        raise ValueError('SafeMath: addition overflow')
+    return c
+
+
+def safe_sub(a, b):
+    if b > a:
+        raise ValueError('SafeMath: subtraction overflow')
+    return a - b
+
+
+def safe_mul(a, b):
+    c = a * b
+    if c > MAX_UINT:
+        raise ValueError('SafeMath: multiplication overflow')
+    return c
+
+
+def safe_div(a, b):
+    if b == 0:
+        raise ValueError('SafeMath: division by zero')
+    return a // b
+
+
+# SafeMath: vectorized
+def safe_add_array(a, b):
+    c = a + b
+    _require(c > MAX_UINT, 'SafeMath: addition overflow')
+    return c
+
+
+def safe_sub_array(a, b):
+    _require(b > a, 'SafeMath: subtraction overflow')
+    return a - b
+
+
+def safe_mul_array(a, b):
+    c = a * b
+    _require(c > MAX_UINT, 'SafeMath: multiplication overflow')
+    return c
+
+
+def safe_div_array(a, b):
+    _require(b == 0, 'SafeMath: division by zero')
+    return a // b
+
+
+def calc_denorm_weights(bal, spot_price, price_floor, price_cap, collateral_per_unit):
+    """CalcDenormWeights for a single pool state
+
+    :param bal: [x_s, x_l, x_c] pool (or strategy plus pool) balances
+    :param spot_price: vault spot price
+    :param price_floor: vault priceFloor
+    :param price_cap: vault priceCap
+    :param collateral_per_unit: vault collateralPerUnit
+    :return: [w_s, w_l, w_c] denormalized weights
+    """
+    x_s, x_l, x_c = bal
+    price_range = safe_sub(price_cap, price_floor)
+    spot_from_floor = safe_sub(spot_price, price_floor)
+
+    # -x_c*(v*(x_l - x_s) - x_l)
+    dc = safe_div(safe_mul(safe_mul(x_c, spot_from_floor), x_s), price_range)
+    dc = safe_sub(
+        safe_add(dc, safe_mul(x_c, x_l)),
+        safe_div(safe_mul(safe_mul(x_c, spot_from_floor), x_l), price_range))
+    # C*v*x_l*x_s
+    dl = safe_div(
+        safe_mul(safe_mul(safe_mul(collateral_per_unit, x_l), x_s), spot_from_floor), price_range)
+    # C*x_l*x_s*(1-v)
+    ds = safe_div(
+        safe_mul(safe_mul(safe_mul(collateral_per_unit, x_l), x_s), safe_sub(price_cap, spot_price)),
+        price_range)
+    d = safe_add(safe_add(dc, dl), ds)
+
+    wt = [safe_div(safe_mul(x, BONE), d) for x in (ds, dl, dc)]
+
+    # Spot price within 1% of floor or cap
+    x = safe_div(price_range, 100)
+    if safe_add(price_floor, x) >= spot_price or safe_sub(price_cap, x) <= spot_price:
+        return [safe_add(safe_mul(w, APPROX_MULTIPLIER), BONE) for w in wt]
+    return [safe_mul(w, INITIAL_MULTIPLIER) for w in wt]
+
+
+def calc_denorm_weights_array(bal, spot_price, price_floor, price_cap, collateral_per_unit):
+    """Vectorized CalcDenormWeights
+
+    :param bal: sequence of x_s, x_l, x_c, each a scalar or integer array
+    :param spot_price: scalar or integer array of vault spot prices
+    :param price_floor, price_cap, collateral_per_unit: vault parameters, scalars or arrays
+    :return: (3, N) object array of [w_s, w_l, w_c] weights for the broadcast shape
+    """
+    x_s, x_l, x_c, spot_price, price_floor, price_cap, C = np.broadcast_arrays(*(
+        as_uint_array(a) for a in (*bal, spot_price, price_floor, price_cap, collateral_per_unit)))
+    price_range = safe_sub_array(price_cap, price_floor)
+    spot_from_floor = safe_sub_array(spot_price, price_floor)
+
+    dc = safe_div_array(safe_mul_array(safe_mul_array(x_c, spot_from_floor), x_s), price_range)
+    dc = safe_sub_array(
+        safe_add_array(dc, safe_mul_array(x_c, x_l)),
+        safe_div_array(safe_mul_array(safe_mul_array(x_c, spot_from_floor), x_l), price_range))
+    dl = safe_div_array(
+        safe_mul_array(safe_mul_array(safe_mul_array(C, x_l), x_s), spot_from_floor), price_range)
+    ds = safe_div_array(
+        safe_mul_array(
+            safe_mul_array(safe_mul_array(C, x_l), x_s), safe_sub_array(price_cap, spot_price)),
+        price_range)
+    d = safe_add_array(safe_add_array(dc, dl), ds)
+
+    wt = np.stack([safe_div_array(safe_mul_array(x, BONE), d) for x in (ds, dl, dc)]).astype(object)
+
+    x = safe_div_array(price_range, 100)
+    near_bound = np.asarray(
+        (safe_add_array(price_floor, x) >= spot_price) | (safe_sub_array(price_cap, x) <= spot_price),
+        dtype=bool)
+    # Only evaluate each branch where the contract takes it so overflow checks match
+    approx = safe_add_array(safe_mul_array(np.where(near_bound, wt, 0), APPROX_MULTIPLIER), BONE)
+    initial = safe_mul_array(np.where(near_bound, 0, wt), INITIAL_MULTIPLIER)
+    return np.where(near_bound, approx, initial)
+
+
+def rebalanced_spot_prices(bal, spot_price, price_floor, price_cap, collateral_per_unit, swap_fee=0):
+    """Pool spot prices of long and short tokens in coin after rebinding with CalcDenormWeights
+
+    :return: (long price, short price) as BONE scaled ints, as BPool.getSpotPrice(coin, token)
+    """
+    wt = calc_denorm_weights(bal, spot_price, price_floor, price_cap, collateral_per_unit)
+    return tuple(
+        calc_spot_price(bal[COIN_IND], wt[COIN_IND], bal[tok_ind], wt[tok_ind], swap_fee)
+        for tok_ind in (LTK_IND, STK_IND))
+
+
+def rebalanced_spot_prices_array(
+        bal, spot_price, price_floor, price_cap, collateral_per_unit, swap_fee=0):
+    """Vectorized rebalanced_spot_prices
+
+    :return: (long prices, short prices) object arrays
+    """
+    wt = calc_denorm_weights_array(bal, spot_price, price_floor, price_cap, collateral_per_unit)
+    bal = np.broadcast_arrays(*(as_uint_array(b) for b in bal), wt[0])[:3]
+    return tuple(
+        calc_spot_price_array(bal[COIN_IND], wt[COIN_IND], bal[tok_ind], wt[tok_ind], swap_fee)
+        for tok_ind in (LTK_IND, STK_IND))
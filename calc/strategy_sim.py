@@ -0,0 +1,554 @@
+"""Pure Python simulator of StrategyBalancerMettalexV3 with its vault and Balancer pool
+
+Mirrors the integer semantics of the deployed contracts for the calls that
+change pool state:
+
+    StrategySim: deposit, withdraw, swap_exact_amount_in (routed through
+                 _swapFromCoin, _swapToCoin or _swapPositions),
+                 update_spot_and_normalize_weights, handle_breach and the
+                 getExpectedOutAmount quote
+    VaultSim:    update_spot (settling when the price leaves the floor/cap
+                 range), minting, redeeming and settling with the strategy
+                 as ammPoolController so no collateral fee is charged
+    BPoolSim:    bind, rebind, unbind and swapExactAmountIn with all their
+                 require checks
+
+Pool maths uses the exact BMath emulation in bmath and weights come from
+strategy_helper.calc_denorm_weights, so amounts match the chain to the wei.
+Every public mutating call reverts as a transaction would: on a failed check
+ValueError is raised with the contract error string and all state is left
+as it was before the call.
+
+Tokens are identified by the names WANT, LONG and SHORT, and amounts are
+integers in token base units.  ERC20 balances of the trader are not tracked,
+tokens in are assumed to be approved and available.
+"""
+from functools import wraps
+
+from .bmath import (
+    BONE, MAX_UINT, MAX_BOUND_TOKENS, MIN_WEIGHT, MAX_WEIGHT, MAX_TOTAL_WEIGHT, MIN_BALANCE,
+    MAX_IN_RATIO, MIN_FEE, MAX_FEE, EXIT_FEE,
+    badd, bsub, bmul, bdiv, calc_spot_price, calc_out_given_in, calc_in_given_out
+)
+from .strategy_helper import calc_denorm_weights, safe_add, safe_sub, safe_mul, safe_div
+
+WANT = 'want'
+LONG = 'long'
+SHORT = 'short'
+
+MAX_DIST_FEE = 10**18
+MAX_EXIT_FEE = 10**18
+
+# _depositInternal skips minting if a position token balance would be below this
+MIN_POSITION_BALANCE = 10**6
+
+
+def _require(condition, message):
+    if not condition:
+        raise ValueError(message)
+
+
+def transaction(method):
+    """Restore the object state if method raises, as a reverted transaction would"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        saved = self.snapshot()
+        try:
+            return method(self, *args, **kwargs)
+        except Exception:
+            self.restore(saved)
+            raise
+    return wrapper
+
+
+class Balances(object):
+    """ERC20 balances of one holder"""
+    def __init__(self, **balances):
+        self.balances = dict(balances)
+
+    def __getitem__(self, token):
+        return self.balances.get(token, 0)
+
+    def add(self, token, amount):
+        self.balances[token] = safe_add(self[token], amount)
+
+    def sub(self, token, amount):
+        _require(self[token] >= amount, 'ERC20: transfer amount exceeds balance')
+        self.balances[token] = self[token] - amount
+
+
+class BPoolSim(object):
+    """Balancer pool controlled by the strategy, not finalized"""
+    def __init__(self, swap_fee=MIN_FEE):
+        self.swap_fee = MIN_FEE
+        self.tokens = []
+        self.records = {}
+        self.total_weight = 0
+        self.public_swap = False
+        self.set_swap_fee(swap_fee)
+
+    def snapshot(self):
+        return (
+            list(self.tokens), {token: list(record) for token, record in self.records.items()},
+            self.total_weight, self.public_swap)
+
+    def restore(self, saved):
+        self.tokens, self.records, self.total_weight, self.public_swap = saved
+
+    def set_swap_fee(self, swap_fee):
+        _require(swap_fee >= MIN_FEE, 'ERR_MIN_FEE')
+        _require(swap_fee <= MAX_FEE, 'ERR_MAX_FEE')
+        self.swap_fee = swap_fee
+
+    def is_bound(self, token):
+        return token in self.records
+
+    def get_balance(self, token):
+        _require(self.is_bound(token), 'ERR_NOT_BOUND')
+        return self.records[token][0]
+
+    def get_denormalized_weight(self, token):
+        _require(self.is_bound(token), 'ERR_NOT_BOUND')
+        return self.records[token][1]
+
+    def get_spot_price(self, token_in, token_out, swap_fee=None):
+        _require(self.is_bound(token_in) and self.is_bound(token_out), 'ERR_NOT_BOUND')
+        b_in, w_in = self.records[token_in]
+        b_out, w_out = self.records[token_out]
+        return calc_spot_price(b_in, w_in, b_out, w_out, self.swap_fee if swap_fee is None else swap_fee)
+
+    def get_spot_price_sans_fee(self, token_in, token_out):
+        return self.get_spot_price(token_in, token_out, swap_fee=0)
+
+    def bind(self, holder, token, balance, denorm):
+        _require(not self.is_bound(token), 'ERR_IS_BOUND')
+        _require(len(self.tokens) < MAX_BOUND_TOKENS, 'ERR_MAX_TOKENS')
+        self.tokens.append(token)
+        self.records[token] = [0, 0]
+        self.rebind(holder, token, balance, denorm)
+
+    def rebind(self, holder, token, balance, denorm):
+        """Set balance and weight, pulling tokens from or pushing them to holder"""
+        _require(self.is_bound(token), 'ERR_NOT_BOUND')
+        _require(denorm >= MIN_WEIGHT, 'ERR_MIN_WEIGHT')
+        _require(denorm <= MAX_WEIGHT, 'ERR_MAX_WEIGHT')
+        _require(balance >= MIN_BALANCE, 'ERR_MIN_BALANCE')
+
+        old_balance, old_weight = self.records[token]
+        if denorm > old_weight:
+            self.total_weight = badd(self.total_weight, bsub(denorm, old_weight))
+            _require(self.total_weight <= MAX_TOTAL_WEIGHT, 'ERR_MAX_TOTAL_WEIGHT')
+        elif denorm < old_weight:
+            self.total_weight = bsub(self.total_weight, bsub(old_weight, denorm))
+        self.records[token] = [balance, denorm]
+
+        if balance > old_balance:
+            holder.sub(token, bsub(balance, old_balance))
+        elif balance < old_balance:
+            withdrawn = bsub(old_balance, balance)
+            # EXIT_FEE is zero so nothing goes to the factory
+            holder.add(token, bsub(withdrawn, bmul(withdrawn, EXIT_FEE)))
+
+    def unbind(self, holder, token):
+        _require(self.is_bound(token), 'ERR_NOT_BOUND')
+        balance, denorm = self.records.pop(token)
+        self.total_weight = bsub(self.total_weight, denorm)
+        # Swap with last token then pop, as the contract does
+        index = self.tokens.index(token)
+        self.tokens[index] = self.tokens[-1]
+        self.tokens.pop()
+        holder.add(token, bsub(balance, bmul(balance, EXIT_FEE)))
+
+    def swap_exact_amount_in(self, holder, token_in, amount_in, token_out, min_amount_out, max_price):
+        _require(self.is_bound(token_in) and self.is_bound(token_out), 'ERR_NOT_BOUND')
+        _require(self.public_swap, 'ERR_SWAP_NOT_PUBLIC')
+        in_record = self.records[token_in]
+        out_record = self.records[token_out]
+
+        _require(amount_in <= bmul(in_record[0], MAX_IN_RATIO), 'ERR_MAX_IN_RATIO')
+        spot_price_before = calc_spot_price(
+            in_record[0], in_record[1], out_record[0], out_record[1], self.swap_fee)
+        _require(spot_price_before <= max_price, 'ERR_BAD_LIMIT_PRICE')
+
+        amount_out = calc_out_given_in(
+            in_record[0], in_record[1], out_record[0], out_record[1], amount_in, self.swap_fee)
+        _require(amount_out >= min_amount_out, 'ERR_LIMIT_OUT')
+
+        in_record[0] = badd(in_record[0], amount_in)
+        out_record[0] = bsub(out_record[0], amount_out)
+
+        spot_price_after = calc_spot_price(
+            in_record[0], in_record[1], out_record[0], out_record[1], self.swap_fee)
+        _require(spot_price_after >= spot_price_before, 'ERR_MATH_APPROX')
+        _require(spot_price_after <= max_price, 'ERR_LIMIT_PRICE')
+        _require(spot_price_before <= bdiv(amount_in, amount_out), 'ERR_MATH_APPROX')
+
+        holder.sub(token_in, amount_in)
+        holder.add(token_out, amount_out)
+        return amount_out, spot_price_after
+
+
+class VaultSim(object):
+    """Mettalex vault with the strategy as ammPoolController
+
+    collateral_per_unit is (priceCap - priceFloor) * qtyMultiplier as set by the
+    Vault constructor.  The vault collateral balance also holds the deposits
+    of every other minter, so it is not tracked and redeeming or settling the
+    strategy positions never fails for lack of collateral.
+    """
+    def __init__(self, price_floor, price_cap, collateral_per_unit, price_spot):
+        self.price_floor = price_floor
+        self.price_cap = price_cap
+        self.collateral_per_unit = collateral_per_unit
+        self.price_spot = price_spot
+        self.is_settled = False
+        self.settlement_price = 0
+
+    def snapshot(self):
+        return (self.price_spot, self.is_settled, self.settlement_price)
+
+    def restore(self, saved):
+        self.price_spot, self.is_settled, self.settlement_price = saved
+
+    def update_spot(self, price):
+        """Oracle price update, settles the contract if price is outside floor and cap"""
+        _require(not self.is_settled, 'Vault should not be settled')
+        if self.price_floor <= price <= self.price_cap:
+            self.price_spot = price
+        else:
+            self.is_settled = True
+            self.settlement_price = price
+
+    def mint_from_collateral_amount(self, holder, collateral_amount):
+        _require(not self.is_settled, 'Vault should not be settled')
+        quantity = safe_div(collateral_amount, self.collateral_per_unit)
+        holder.sub(WANT, collateral_amount)
+        holder.add(LONG, quantity)
+        holder.add(SHORT, quantity)
+
+    def redeem_positions(self, holder, quantity):
+        _require(holder[LONG] >= quantity and holder[SHORT] >= quantity,
+                 'ERC20: burn amount exceeds balance')
+        holder.sub(LONG, quantity)
+        holder.sub(SHORT, quantity)
+        collateral_returned = safe_mul(self.collateral_per_unit, quantity)
+        holder.add(WANT, collateral_returned)
+
+    def settle_positions(self, holder):
+        _require(self.is_settled, 'Vault should be settled')
+        collateral_returned = 0
+        if self.settlement_price < self.price_floor:
+            collateral_returned = safe_mul(self.collateral_per_unit, holder[SHORT])
+        elif self.settlement_price > self.price_cap:
+            collateral_returned = safe_mul(self.collateral_per_unit, holder[LONG])
+        holder.sub(LONG, holder[LONG])
+        holder.sub(SHORT, holder[SHORT])
+        holder.add(WANT, collateral_returned)
+
+
+class StrategySim(object):
+    """StrategyBalancerMettalexV3 together with its pool and vault
+
+    :param vault: VaultSim
+    :param pool: BPoolSim, default a new pool with the minimum swap fee
+    :param dist_fee: distribution fee (BONE = 100%) taken from swaps to and from coin
+    :param exit_fee: fee (BONE = 100%) kept by the strategy on withdrawals
+    :param distribution_contract: False if no distribution contract is set,
+        in which case distribution fees stay with the strategy
+    """
+    def __init__(self, vault, pool=None, dist_fee=0, exit_fee=0, distribution_contract=True):
+        self.vault = vault
+        self.pool = pool or BPoolSim()
+        self.balances = Balances()
+        self.dist_fee = dist_fee
+        self.exit_fee = exit_fee
+        self.distribution_contract = distribution_contract
+        self.distributed = 0
+        self.withdrawn = 0
+        self.is_breach_handled = False
+        self.breaker = False
+
+    def snapshot(self):
+        return (
+            self.pool.snapshot(), self.vault.snapshot(), dict(self.balances.balances),
+            self.distributed, self.withdrawn, self.is_breach_handled)
+
+    def restore(self, saved):
+        pool, vault, balances, self.distributed, self.withdrawn, self.is_breach_handled = saved
+        self.pool.restore(pool)
+        self.vault.restore(vault)
+        self.balances.balances = balances
+
+    def _require_not_settled(self):
+        _require(not self.vault.is_settled, 'mVault is already settled')
+
+    # Controller interface
+    @transaction
+    def deposit(self, amount):
+        """Controller earn(): transfer amount of want to the strategy then deposit()
+
+        :return: False if the pool balances were too small to mint positions
+        """
+        self._require_not_settled()
+        _require(not self.breaker, '!breaker')
+        self.balances.add(WANT, amount)
+        return self._deposit_internal()
+
+    @transaction
+    def withdraw(self, amount):
+        """Controller withdraw(uint256): return amount of want (less exit fee) to the yVault
+
+        :return: amount of want transferred to the yVault
+        """
+        _require(not self.breaker, '!breaker')
+        if self.vault.is_settled:
+            self._handle_breach()
+        else:
+            self._unbind()
+            self._redeem_positions()
+            fees = safe_div(safe_mul(amount, self.exit_fee), MAX_EXIT_FEE)
+            amount = safe_sub(amount, fees)
+        self.balances.sub(WANT, amount)
+        self.withdrawn = safe_add(self.withdrawn, amount)
+        if not self.vault.is_settled:
+            self._deposit_internal()
+        return amount
+
+    @transaction
+    def handle_breach(self):
+        self._handle_breach()
+
+    def _handle_breach(self):
+        _require(self.vault.is_settled, 'mVault should be settled')
+        _require(not self.breaker, '!breaker')
+        if not self.is_breach_handled:
+            self.is_breach_handled = True
+            self._unbind()
+            self.vault.settle_positions(self.balances)
+
+    # Trading
+    @transaction
+    def swap_exact_amount_in(self, token_in, amount_in, token_out, min_amount_out=0, max_price=MAX_UINT):
+        """Swap through the strategy as swapExactAmountIn
+
+        :return: (tokenAmountOut, pool spot price after the swap before rebalancing) as
+            returned by the contract, for swaps to coin the trader receives
+            tokenAmountOut less the distribution fee
+        """
+        _require(amount_in > 0, 'ERR_AMOUNT_IN')
+        self.balances.add(token_in, amount_in)
+        self.pool.public_swap = True
+        if token_in == WANT:
+            result = self._swap_from_coin(amount_in, token_out, min_amount_out, max_price)
+        elif token_out == WANT:
+            result = self._swap_to_coin(token_in, amount_in, min_amount_out, max_price)
+        else:
+            result = self._swap_positions(token_in, amount_in, token_out, min_amount_out, max_price)
+        self.pool.public_swap = False
+        return result
+
+    def _swap_from_coin(self, amount_in, token_out, min_amount_out, max_price):
+        _require(token_out in (LONG, SHORT), 'ERR_TOKEN_OUT')
+        dist_amount = safe_div(safe_mul(self.dist_fee, amount_in), MAX_DIST_FEE)
+        if dist_amount != 0 and self.distribution_contract:
+            self._distribute(dist_amount)
+        swap_amount = safe_sub(amount_in, dist_amount)
+        amount_out, spot_price_after = self.pool.swap_exact_amount_in(
+            self.balances, WANT, swap_amount, token_out, 1, max_price)
+        self._update_spot_and_normalize_weights()
+        _require(amount_out >= min_amount_out, 'ERR_MIN_OUT')
+        self.balances.sub(token_out, amount_out)
+        return amount_out, spot_price_after
+
+    def _swap_to_coin(self, token_in, amount_in, min_amount_out, max_price):
+        _require(token_in in (LONG, SHORT), 'ERR_TOKEN_IN')
+        amount_out, spot_price_after = self.pool.swap_exact_amount_in(
+            self.balances, token_in, amount_in, WANT, min_amount_out, max_price)
+        self._update_spot_and_normalize_weights()
+        dist_amount = safe_div(safe_mul(self.dist_fee, amount_out), MAX_DIST_FEE)
+        return_amount = safe_sub(amount_out, dist_amount)
+        _require(amount_out >= min_amount_out, 'ERR_MIN_OUT')
+        if self.distribution_contract and dist_amount != 0:
+            self._distribute(dist_amount)
+        self.balances.sub(WANT, return_amount)
+        # As _swapToCoin and LOG_SWAP the amount out is before the distribution fee
+        return amount_out, spot_price_after
+
+    def _swap_positions(self, token_in, amount_in, token_out, min_amount_out, max_price):
+        _require(token_in != token_out, 'ERR_SAME_TOKEN_SWAP')
+        _require(token_in in (LONG, SHORT), 'ERR_TOKEN_IN')
+        _require(token_out in (LONG, SHORT), 'ERR_TOKEN_OUT')
+        amount_out, spot_price_after = self.pool.swap_exact_amount_in(
+            self.balances, token_in, amount_in, token_out, min_amount_out, max_price)
+        _require(amount_out >= min_amount_out, 'ERR_MIN_OUT')
+        self.balances.sub(token_out, amount_out)
+        return amount_out, spot_price_after
+
+    def _distribute(self, amount):
+        self.balances.sub(WANT, amount)
+        self.distributed = safe_add(self.distributed, amount)
+
+    @transaction
+    def update_spot_and_normalize_weights(self):
+        self._update_spot_and_normalize_weights()
+
+    def _update_spot_and_normalize_weights(self):
+        self._require_not_settled()
+        # Balances read with balanceOf(balancer), equal to the pool records without gulp
+        bal = [self.pool.get_balance(token) for token in (SHORT, LONG, WANT)]
+        self._sort_and_rebind(self._denorm_weights(bal), bal)
+
+    @transaction
+    def update_spot(self, price):
+        """Oracle update of the vault spot price, the pool is not rebalanced until the next swap"""
+        self.vault.update_spot(price)
+
+    # Views
+    def get_expected_out_amount(self, from_token, to_token, from_token_amount):
+        """getExpectedOutAmount: (tokens returned, price impact) using swap fee plus dist fee"""
+        pool = self.pool
+        _require(pool.is_bound(from_token) and pool.is_bound(to_token), 'revert')
+        fee = safe_add(pool.swap_fee, self.dist_fee)
+        b_in, w_in = pool.records[from_token]
+        b_out, w_out = pool.records[to_token]
+        tokens_returned = calc_out_given_in(b_in, w_in, b_out, w_out, from_token_amount, fee)
+        if tokens_returned == 0:
+            return tokens_returned, 0
+        spot_price = pool.get_spot_price(from_token, to_token)
+        effective_price = safe_div(safe_mul(from_token_amount, BONE), tokens_returned)
+        price_impact = safe_div(safe_mul(safe_sub(effective_price, spot_price), BONE), spot_price)
+        return tokens_returned, price_impact
+
+    def get_expected_in_amount(self, from_token, to_token, to_token_amount):
+        """getExpectedInAmount: (tokens needed, price impact) using swap fee plus dist fee"""
+        pool = self.pool
+        _require(pool.is_bound(from_token) and pool.is_bound(to_token), 'revert')
+        fee = safe_add(pool.swap_fee, self.dist_fee)
+        b_in, w_in = pool.records[from_token]
+        b_out, w_out = pool.records[to_token]
+        tokens_returned = calc_in_given_out(b_in, w_in, b_out, w_out, to_token_amount, fee)
+        if tokens_returned == 0:
+            return tokens_returned, 0
+        spot_price = pool.get_spot_price(from_token, to_token)
+        effective_price = safe_div(safe_mul(tokens_returned, BONE), to_token_amount)
+        price_impact = safe_div(safe_mul(safe_sub(effective_price, spot_price), BONE), spot_price)
+        return tokens_returned, price_impact
+
+    def balance_of(self):
+        """balanceOf(): strategy holdings plus pool value in want"""
+        short_price, long_price = self._get_spot_price()
+        total = safe_add(safe_add(
+            self.balances[WANT],
+            safe_mul(self.balances[SHORT], short_price)),
+            safe_mul(self.balances[LONG], long_price))
+        return safe_add(self._get_balancer_pool_value(), total)
+
+    def _get_spot_price(self):
+        if self.pool.is_bound(WANT):
+            return self.pool.get_spot_price(WANT, SHORT), self.pool.get_spot_price(WANT, LONG)
+        vault = self.vault
+        price_range = safe_sub(vault.price_cap, vault.price_floor)
+        # Same integer division and long/short naming as the contract
+        short_price = safe_mul(
+            vault.collateral_per_unit, safe_div(safe_sub(vault.price_spot, vault.price_floor), price_range))
+        long_price = safe_mul(
+            vault.collateral_per_unit, safe_div(safe_sub(vault.price_cap, vault.price_spot), price_range))
+        return short_price, long_price
+
+    def _get_balancer_pool_value(self):
+        pool = self.pool
+        if not pool.is_bound(WANT):
+            return 0
+        total = pool.get_balance(WANT)
+        for token in (SHORT, LONG):
+            balance = pool.get_balance(token)
+            if balance != 0:
+                total = safe_add(total, safe_div(
+                    safe_mul(pool.get_spot_price_sans_fee(WANT, token), balance), BONE))
+        return total
+
+    # Internal
+    def _denorm_weights(self, bal):
+        vault = self.vault
+        return calc_denorm_weights(
+            bal, vault.price_spot, vault.price_floor, vault.price_cap, vault.collateral_per_unit)
+
+    def _sort_and_rebind(self, wt, bal):
+        """Rebind tokens in increasing order of weight change to keep total weight in bounds"""
+        tokens = [SHORT, LONG, WANT]
+        delta = [w - self.pool.get_denormalized_weight(token) for w, token in zip(wt, tokens)]
+        order = [0, 1, 2]
+        # Same three compare-and-swap steps as _sortAndRebind, ties keep their order
+        for i, j in [(0, 1), (1, 2), (0, 1)]:
+            if delta[order[i]] > delta[order[j]]:
+                order[i], order[j] = order[j], order[i]
+        for k in order:
+            self.pool.rebind(self.balances, tokens[k], bal[k], wt[k])
+
+    def _unbind(self):
+        for token in list(self.pool.tokens):
+            self.pool.unbind(self.balances, token)
+
+    def _redeem_positions(self):
+        ltk_qty = self.balances[LONG]
+        stk_qty = self.balances[SHORT]
+        if stk_qty < ltk_qty:
+            if stk_qty > 0:
+                self.vault.redeem_positions(self.balances, stk_qty)
+        elif ltk_qty > 0:
+            self.vault.redeem_positions(self.balances, ltk_qty)
+
+    def _deposit_internal(self):
+        want_to_vault = safe_div(self.balances[WANT], 2)
+        positions_expected = safe_div(want_to_vault, self.vault.collateral_per_unit)
+
+        pool = self.pool
+        balancer_bal = {
+            token: pool.get_balance(token) if pool.is_bound(token) else 0
+            for token in (WANT, LONG, SHORT)
+        }
+        if (safe_add(safe_add(balancer_bal[LONG], positions_expected), self.balances[LONG])
+                < MIN_POSITION_BALANCE
+                or safe_add(safe_add(balancer_bal[SHORT], positions_expected), self.balances[SHORT])
+                < MIN_POSITION_BALANCE):
+            return False
+
+        self.vault.mint_from_collateral_amount(self.balances, want_to_vault)
+
+        tokens = [SHORT, LONG, WANT]
+        bal = [safe_add(self.balances[token], balancer_bal[token]) for token in tokens]
+        wt = self._denorm_weights(bal)
+        if not any(pool.is_bound(token) for token in tokens):
+            for token, b, w in zip(tokens, bal, wt):
+                pool.bind(self.balances, token, b, w)
+        else:
+            self._sort_and_rebind(wt, bal)
+        return True
+
+    # Convenience
+    def pool_state(self):
+        """Pool balances and denormalized weights as [x_c, x_l, x_s, w_c, w_l, w_s] ints"""
+        return (
+            [self.pool.get_balance(token) for token in (WANT, LONG, SHORT)]
+            + [self.pool.get_denormalized_weight(token) for token in (WANT, LONG, SHORT)])
+
+
+def simulate_swaps(strategy, swaps, oracle_prices=None):
+    """Run a sequence of swaps through the strategy, recording reverts instead of stopping
+
+    :param strategy: StrategySim
+    :param swaps: iterable of (token_in, amount_in, token_out) or
+        (token_in, amount_in, token_out, min_amount_out, max_price)
+    :param oracle_prices: optional iterable of vault spot prices applied before each swap
+    :return: list of (amount_out, spot_price_after) tuples, or the error string for reverted swaps
+    """
+    results = []
+    prices = iter(oracle_prices) if oracle_prices is not None else None
+    for swap in swaps:
+        try:
+            if prices is not None:
+                strategy.update_spot(next(prices))
+            results.append(strategy.swap_exact_amount_in(*swap))
+        except ValueError as e:
+            results.append(str(e))
+    return results
@@ -0,0 +1,292 @@
+"""Differential fuzzing and benchmarking of the Python AMM models against a local chain
+
+Random action sequences (swaps in every direction, oracle price updates and
+explicit rebalances) are run through
+
+    chain: contracts deployed on ganache with mettalex_contract_setup.deploy
+    exact: calc.strategy_sim.StrategySim, expected to match the chain to the wei
+    float: calc.amm_math swap functions, evaluated from the exact pre-action
+           state so float error is measured per step and does not accumulate
+
+After every action pool balances, weights, spot prices and the amount
+returned to the trader are compared and latency is recorded per action
+type and engine.
+
+Usage (with ganache-cli running on 127.0.0.1:8545):
+    python amm_fuzz.py --actions 200 --seed 1
+"""
+import sys
+import time
+import argparse
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+from mettalex_contract_setup import (
+    connect, get_contracts, deploy, full_setup, deposit, earn, distribute_coin, mintPositionTokens,
+    BatchCaller
+)
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from calc.amm_math import simple_swap_from_coin, simple_swap_to_coin
+from calc.strategy_sim import StrategySim, BPoolSim, VaultSim, WANT, LONG, SHORT
+
+MAX_UINT = 2**256 - 1
+BONE = 10**18
+
+SWAP_ACTIONS = {
+    'swap_coin_long': (WANT, LONG),
+    'swap_coin_short': (WANT, SHORT),
+    'swap_long_coin': (LONG, WANT),
+    'swap_short_coin': (SHORT, WANT),
+    'swap_long_short': (LONG, SHORT),
+    'swap_short_long': (SHORT, LONG),
+}
+ACTION_TYPES = list(SWAP_ACTIONS) + ['update_spot', 'rebalance']
+
+
+def generate_actions(n_actions, price_floor, price_cap, price_spot, max_coin_in, max_token_in,
+                     price_step=5, update_prob=0.1, rebalance_prob=0.05, seed=None):
+    """Random action sequence
+
+    :param max_coin_in: largest coin amount swapped in, base units
+    :param max_token_in: largest position token amount swapped in, base units
+    :param price_step: largest oracle price change per update
+    :return: list of (action type, amount or price)
+    """
+    rng = np.random.default_rng(seed)
+    actions = []
+    price = price_spot
+    for _ in range(n_actions):
+        u = rng.random()
+        if u < update_prob:
+            price = int(np.clip(price + rng.integers(-price_step, price_step + 1),
+                                price_floor + 1, price_cap - 1))
+            actions.append(('update_spot', price))
+        elif u < update_prob + rebalance_prob:
+            actions.append(('rebalance', 0))
+        else:
+            action = rng.choice(list(SWAP_ACTIONS))
+            max_in = max_coin_in if SWAP_ACTIONS[action][0] == WANT else max_token_in
+            actions.append((str(action), int(rng.integers(1, max_in))))
+    return actions
+
+
+class ChainEngine(object):
+    """Run actions against deployed contracts from a trader account"""
+    def __init__(self, w3, deployed_contracts, trader, admin):
+        self.w3 = w3
+        self.trader = trader
+        self.admin = admin
+        self.vault = deployed_contracts['Vault']
+        self.pool = deployed_contracts['BPool']
+        self.strategy = deployed_contracts['PoolController']
+        self.tokens = {
+            WANT: deployed_contracts['Coin'],
+            LONG: deployed_contracts['Long'],
+            SHORT: deployed_contracts['Short']
+        }
+        for tok in self.tokens.values():
+            self.wait(tok.functions.approve(self.strategy.address, MAX_UINT).transact(
+                {'from': trader, 'gas': 1_000_000}))
+
+    def wait(self, tx_hash):
+        receipt = self.w3.eth.waitForTransactionReceipt(tx_hash)
+        if receipt.status == 0:
+            raise ValueError('reverted')
+        return receipt
+
+    def perform(self, action, amount):
+        """:return: amount returned to trader for swaps, otherwise None"""
+        if action == 'update_spot':
+            self.wait(self.vault.functions.updateSpot(amount).transact(
+                {'from': self.admin, 'gas': 1_000_000}))
+        elif action == 'rebalance':
+            self.wait(self.strategy.functions.updateSpotAndNormalizeWeights().transact(
+                {'from': self.admin, 'gas': 1_000_000}))
+        else:
+            token_in, token_out = SWAP_ACTIONS[action]
+            receipt = self.wait(self.strategy.functions.swapExactAmountIn(
+                self.tokens[token_in].address, amount, self.tokens[token_out].address, 0, MAX_UINT
+            ).transact({'from': self.trader, 'gas': 5_000_000}))
+            return self.strategy.events.LOG_SWAP().processReceipt(receipt)[0]['args']['tokenAmountOut']
+
+    def state(self):
+        """Pool [x_c, x_l, x_s, w_c, w_l, w_s] and (long, short) spot prices in coin"""
+        batch = BatchCaller(self.w3)
+        tokens = [self.tokens[t].address for t in (WANT, LONG, SHORT)]
+        for address in tokens:
+            batch.add(self.pool.functions.getBalance(address))
+        for address in tokens:
+            batch.add(self.pool.functions.getDenormalizedWeight(address))
+        for address in tokens[1:]:
+            batch.add(self.pool.functions.getSpotPrice(tokens[0], address))
+        results = batch.execute()
+        return results[:6], tuple(results[6:])
+
+
+def sim_from_chain(engine):
+    """StrategySim with vault parameters, fees and pool records read from chain"""
+    batch = BatchCaller(engine.w3)
+    for fn in [
+        engine.vault.functions.priceFloor(), engine.vault.functions.priceCap(),
+        engine.vault.functions.collateralPerUnit(), engine.vault.functions.priceSpot(),
+        engine.pool.functions.getSwapFee(), engine.strategy.functions.distFee(),
+        engine.strategy.functions.distributionContract()
+    ] + [tok.functions.balanceOf(engine.strategy.address) for tok in engine.tokens.values()]:
+        batch.add(fn)
+    floor, cap, cpu, spot, swap_fee, dist_fee, dist_contract, *strategy_balances = batch.execute()
+
+    pool = BPoolSim(swap_fee)
+    state, _ = engine.state()
+    for token, balance, weight in zip((WANT, LONG, SHORT), state[:3], state[3:]):
+        pool.tokens.append(token)
+        pool.records[token] = [balance, weight]
+    pool.total_weight = sum(state[3:])
+    sim = StrategySim(
+        VaultSim(floor, cap, cpu, spot), pool, dist_fee=dist_fee,
+        distribution_contract=int(dist_contract, 16) != 0)
+    for token, balance in zip(engine.tokens, strategy_balances):
+        sim.balances.add(token, balance)
+    return sim
+
+
+def sim_perform(sim, action, amount):
+    if action == 'update_spot':
+        sim.update_spot(amount)
+    elif action == 'rebalance':
+        sim.update_spot_and_normalize_weights()
+    else:
+        token_in, token_out = SWAP_ACTIONS[action]
+        return sim.swap_exact_amount_in(token_in, amount, token_out)[0]
+
+
+def sim_state(sim):
+    return sim.pool_state(), (
+        sim.pool.get_spot_price(WANT, LONG), sim.pool.get_spot_price(WANT, SHORT))
+
+
+def float_swap(sim, action, amount):
+    """tokenAmountOut of the float model for the pre-swap exact state
+
+    As LOG_SWAP, swaps to coin are compared before the distribution fee.
+
+    :return: float amount, None for actions the float model does not cover
+    """
+    if action not in SWAP_ACTIONS or WANT not in SWAP_ACTIONS[action]:
+        return None
+    token_in, token_out = SWAP_ACTIONS[action]
+    state = [float(x) for x in sim.pool_state()]
+    state[3:] = [w / BONE for w in state[3:]]
+    sF = sim.pool.swap_fee / BONE
+    if token_in == WANT:
+        amount_in = amount - sim.dist_fee * amount // BONE
+        return simple_swap_from_coin(state, amount_in, to_long=token_out == LONG, sF=sF)[1]
+    return simple_swap_to_coin(state, amount, from_long=token_in == LONG, sF=sF)[1]
+
+
+def _timed(fun, *args):
+    start = time.perf_counter()
+    try:
+        result = fun(*args)
+        error = None
+    except Exception as e:
+        result = None
+        error = str(e)
+    return result, error, time.perf_counter() - start
+
+
+def run_fuzz(engine, sim, actions, verbose=False):
+    """Run actions on chain and in the Python models, comparing state after every action
+
+    :return: dict with 'divergences' list and 'timings' dict of (action, engine) -> list of seconds,
+        and 'float_error' dict of action -> list of relative errors in amount out
+    """
+    divergences = []
+    timings = defaultdict(list)
+    float_error = defaultdict(list)
+    for step, (action, amount) in enumerate(actions):
+        float_out, _, float_time = _timed(float_swap, sim, action, amount)
+        sim_out, sim_error, sim_time = _timed(sim_perform, sim, action, amount)
+        chain_out, chain_error, chain_time = _timed(engine.perform, action, amount)
+        timings[(action, 'exact')].append(sim_time)
+        timings[(action, 'chain')].append(chain_time)
+        if float_out is not None:
+            timings[(action, 'float')].append(float_time)
+
+        chain_state, chain_spot = engine.state()
+        exact_state, exact_spot = sim_state(sim)
+        diffs = {}
+        if (sim_error is None) != (chain_error is None):
+            diffs['revert'] = (sim_error, chain_error)
+        if sim_out != chain_out:
+            diffs['amount_out'] = (sim_out, chain_out)
+        for name, x_sim, x_chain in zip(
+                ['x_c', 'x_l', 'x_s', 'w_c', 'w_l', 'w_s', 'spot_long', 'spot_short'],
+                exact_state + list(exact_spot), chain_state + list(chain_spot)):
+            if x_sim != x_chain:
+                diffs[name] = (x_sim, x_chain)
+        if diffs:
+            divergences.append((step, action, amount, diffs))
+            if verbose:
+                print(f'Step {step} {action} {amount}: {diffs}')
+            # Resynchronize so later steps are compared from the same state
+            sim = sim_from_chain(engine)
+        if float_out is not None and chain_out:
+            float_error[action].append(float_out / chain_out - 1)
+    return {'divergences': divergences, 'timings': timings, 'float_error': float_error}
+
+
+def print_report(results):
+    timings = results['timings']
+    print(f'{"action":<18}{"engine":<8}{"count":>7}{"mean ms":>12}{"p95 ms":>12}{"per s":>12}')
+    for action in ACTION_TYPES:
+        for engine in ['exact', 'float', 'chain']:
+            t = np.array(timings.get((action, engine), []))
+            if t.size == 0:
+                continue
+            print(f'{action:<18}{engine:<8}{t.size:>7}{t.mean()*1e3:>12.3f}'
+                  f'{np.percentile(t, 95)*1e3:>12.3f}{1/t.mean():>12.1f}')
+
+    print('\nFloat model relative error in amount out')
+    for action, errors in results['float_error'].items():
+        errors = np.abs(errors)
+        print(f'{action:<18} max {errors.max():.3e}  mean {errors.mean():.3e}')
+
+    divergences = results['divergences']
+    print(f'\n{len(divergences)} actions where exact model and chain diverged')
+    for step, action, amount, diffs in divergences[:20]:
+        print(f'  step {step} {action} {amount}: {diffs}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Differential fuzz of Python AMM models against local chain')
+    parser.add_argument('--actions', '-n', dest='n_actions', type=int, default=200)
+    parser.add_argument('--seed', '-s', dest='seed', type=int, default=0)
+    parser.add_argument('--price', '-p', dest='price', type=int, default=2500)
+    parser.add_argument('--liquidity', '-l', dest='liquidity', type=int, default=200000,
+                        help='Coin deposited into the yVault and supplied to the pool')
+    parser.add_argument('--verbose', '-v', dest='verbose', action='store_true')
+    args = parser.parse_args()
+
+    w3, admin = connect('local', 'admin')
+    contracts = get_contracts(w3, 3)
+    deployed_contracts = deploy(w3, contracts)
+    w3, admin, deployed_contracts = full_setup(
+        w3, admin, deployed_contracts=deployed_contracts, price=args.price)
+    coin = deployed_contracts['Coin']
+    deposit(w3, deployed_contracts['YVault'], coin, args.liquidity)
+    earn(w3, deployed_contracts['YVault'])
+
+    trader = w3.eth.accounts[1]
+    distribute_coin(w3, coin, args.liquidity, trader)
+    mintPositionTokens(w3, deployed_contracts['Vault'], coin, args.liquidity // 2, trader)
+
+    engine = ChainEngine(w3, deployed_contracts, trader, admin)
+    sim = sim_from_chain(engine)
+    state, _ = engine.state()
+    actions = generate_actions(
+        args.n_actions, sim.vault.price_floor, sim.vault.price_cap, sim.vault.price_spot,
+        max_coin_in=state[0] // 20, max_token_in=min(state[1:3]) // 20, seed=args.seed)
+    print_report(run_fuzz(engine, sim, actions, verbose=args.verbose))
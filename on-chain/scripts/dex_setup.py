@@ -3,8 +3,11 @@ import subprocess
 from pathlib import Path
 import json
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from mettalex_contract_setup import connect, connect_contract, create_balancer_pool, full_setup, deploy_contract, get_contracts
+from mettalex_contract_setup import connect, full_setup, get_contracts, DEPLOYMENT_SPEC
+from tx_pipeline import TransactionPipeline, deploy_spec
 
 
 def get_addresses(contract_file_name='contract_address.json'):
@@ -23,60 +26,113 @@ def get_addresses(contract_file_name='contract_address.json'):
     return contract_cache
 
 
-def connect_deployed(w3, contracts, contract_cache):
-    deployed_contracts = {}
-    for k in contracts.keys():
-        if contract_cache[k]:
-            deployed_contracts[k] = connect_contract(
-                w3, contracts[k], contract_cache[k])
-
-        else:
-            if k == 'BPool':
-                deployed_contracts[k] = create_balancer_pool(
-                    w3, contracts[k], connect_contract(w3, contracts['BFactory'], contract_cache['BFactory']))
-
-            elif k == 'YController':
-                deployed_contracts[k] = deploy_contract(
-                    w3, contracts[k], w3.eth.defaultAccount)
+def connect_deployed(w3, contracts, contract_cache, args=None, pipeline=None):
+    # Commodity caches hold the per-commodity contracts, the strategy helper
+    # is also needed by full_setup so is deployed if missing
+    names = [k for k in contracts.keys() if k in contract_cache] + ['StrategyHelper']
+    deployed_contracts = deploy_spec(
+        w3, contracts, DEPLOYMENT_SPEC, args or {}, names=names, cache=contract_cache,
+        pipeline=pipeline)
+    return deployed_contracts, contract_cache
 
-            elif k == 'YVault':
-                deployed_contracts[k] = deploy_contract(
-                    w3, contracts[k], contract_cache['Coin'], contract_cache['YController'])
 
-            elif k == 'PoolController':
-                deployed_contracts[k] = deploy_contract(
-                    w3, contracts[k], contract_cache['YController'], contract_cache['Coin'], contract_cache['BPool'], contract_cache['Vault'], contract_cache['Long'], contract_cache['Short'])
+def write_json_atomic(file_name, data):
+    # Write to temporary file then rename so readers never see a partial file
+    tmp_file = f'{file_name}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_file, file_name)
 
-        contract_cache[k] = deployed_contracts[k].address
 
-    return deployed_contracts, contract_cache
+def store_cache(commodity_caches, cache_file_name='contract_cache.json'):
+    """Append commodity contract caches to the contract cache file in a single write
+    """
+    cache_file = Path(__file__).parent / 'contract-cache' / cache_file_name
+    addresses = {}
+    if os.path.isfile(cache_file):
+        with open(cache_file, 'r') as f:
+            addresses = json.load(f)
 
+    addresses.setdefault('Commodities', []).extend(commodity_caches)
+    write_json_atomic(cache_file, addresses)
 
-def store_cache(contract_cache, index, cache_file_name='contract_cache.json'):
-    cache_file = Path(__file__).parent / 'contract-cache' / cache_file_name
-    with open(cache_file, 'r') as f:
-        addresses = json.load(f)
 
-    if 'Commodities' not in addresses:
-        addresses = {'Commodities': []}
+def load_checkpoint(checkpoint_file):
+    if not os.path.isfile(checkpoint_file):
+        return {'done': {}, 'partial': {}}
+    with open(checkpoint_file, 'r') as f:
+        return json.load(f)
 
-    commodities = addresses['Commodities']
-    commodities.append(contract_cache)
 
-    with open(cache_file, 'w') as f:
-        json.dump(addresses, f)
+def setup_dex(w3, admin, contracts, deployed_contracts=None, contract_file='contract_address_dex.json',
+              max_workers=8, checkpoint_file_name='dex_setup_checkpoint.json'):
+    """Connect to or deploy and set up contracts for every commodity in the address file
 
+    Commodities are set up concurrently, sharing one transaction pipeline (nonce
+    lane) for the sending account.  Progress is written to a checkpoint file as each
+    commodity finishes, or fails part way, so a rerun after a failure resumes
+    without repeating completed commodities or redeploying mined contracts.
+    The contract cache is written once when all commodities are done.
 
-def setup_dex(w3, admin, contracts, deployed_contracts=None, contract_file='contract_address_dex.json'):
+    :param max_workers: number of commodities set up concurrently
+    :param checkpoint_file_name: checkpoint file in contract-cache directory
+    """
     contract_cache = get_addresses(contract_file)
-    index = 0
-    for commodity_address in contract_cache["Commodities"]:
-        deployed_contracts, contract_cache = connect_deployed(
-            w3, contracts, commodity_address)
-
-        full_setup(w3, admin, deployed_contracts)
-        store_cache(contract_cache, index)
-        index += 1
+    checkpoint_file = Path(__file__).parent / 'contract-cache' / checkpoint_file_name
+    checkpoint = load_checkpoint(checkpoint_file)
+    checkpoint_lock = threading.Lock()
+    # JSON object keys are strings
+    done = {int(k): v for k, v in checkpoint['done'].items()}
+    partial = {int(k): v for k, v in checkpoint['partial'].items()}
+
+    # All setup transactions are sent by the admin account that owns the
+    # contracts so every commodity shares its single nonce lane
+    pipeline = TransactionPipeline(w3, w3.eth.defaultAccount)
+
+    def save_checkpoint(index, commodity_cache, finished):
+        # Update and serialize under the lock so no thread changes the dicts mid write
+        with checkpoint_lock:
+            if finished:
+                done[index] = commodity_cache
+                partial.pop(index, None)
+            else:
+                partial[index] = commodity_cache
+            write_json_atomic(checkpoint_file, {'done': done, 'partial': partial})
+
+    def setup_commodity(index, commodity_address):
+        with checkpoint_lock:
+            commodity_cache = dict(partial.get(index, commodity_address))
+        try:
+            deployed, commodity_cache = connect_deployed(
+                w3, contracts, commodity_cache, pipeline=pipeline)
+            full_setup(w3, admin, deployed, pipeline=pipeline)
+        except Exception:
+            # Keep addresses of contracts already mined for the next run
+            save_checkpoint(index, commodity_cache, finished=False)
+            raise
+        save_checkpoint(index, commodity_cache, finished=True)
+        return commodity_cache
+
+    pending = [
+        (index, commodity_address)
+        for index, commodity_address in enumerate(contract_cache['Commodities'])
+        if index not in done
+    ]
+    if len(pending) < len(contract_cache['Commodities']):
+        print(f'Resuming from checkpoint: {len(done)} commodities already set up')
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(setup_commodity, index, address) for index, address in pending]
+        errors = [future.exception() for future in futures]
+    errors = [e for e in errors if e is not None]
+    if errors:
+        print(f'{len(errors)} commodities failed, rerun to resume from {checkpoint_file}')
+        raise errors[0]
+
+    store_cache([done[index] for index in sorted(done)])
+    # No checkpoint is written if there was nothing to set up
+    if os.path.isfile(checkpoint_file):
+        os.remove(checkpoint_file)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,235 @@
+import sqlite3
+from pathlib import Path
+
+DEFAULT_DB_FILE = Path(__file__).parent / 'contract-cache' / 'events.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoint (
+    address TEXT PRIMARY KEY,
+    last_block INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS swaps (
+    address TEXT, block INTEGER, tx_hash TEXT, log_index INTEGER,
+    caller TEXT, token_in TEXT, token_out TEXT, amount_in TEXT, amount_out TEXT,
+    PRIMARY KEY (tx_hash, log_index)
+);
+CREATE TABLE IF NOT EXISTS joins (
+    address TEXT, block INTEGER, tx_hash TEXT, log_index INTEGER,
+    caller TEXT, token_in TEXT, amount_in TEXT,
+    PRIMARY KEY (tx_hash, log_index)
+);
+CREATE TABLE IF NOT EXISTS exits (
+    address TEXT, block INTEGER, tx_hash TEXT, log_index INTEGER,
+    caller TEXT, token_out TEXT, amount_out TEXT,
+    PRIMARY KEY (tx_hash, log_index)
+);
+CREATE TABLE IF NOT EXISTS calls (
+    address TEXT, block INTEGER, tx_hash TEXT, log_index INTEGER,
+    name TEXT, caller TEXT, data TEXT,
+    PRIMARY KEY (tx_hash, log_index)
+);
+CREATE INDEX IF NOT EXISTS swaps_block ON swaps (address, block);
+CREATE INDEX IF NOT EXISTS calls_block ON calls (address, block);
+"""
+
+# Pool functions whose LOG_CALL data changes balances, weights or fee
+STATE_CALLS = {'bind', 'rebind', 'unbind', 'setSwapFee'}
+
+
+class EventIndexer(object):
+    """Index Balancer pool and Mettalex strategy events into a local SQLite database
+
+    Logs are fetched with one eth_getLogs request per contract for each page
+    of chunk_size blocks and stored together with a per-contract
+    last-indexed-block checkpoint in the same database transaction, so an
+    interrupted sync resumes where it stopped.
+
+    Indexed events:
+        BPool: LOG_SWAP, LOG_JOIN, LOG_EXIT and the anonymous LOG_CALL emitted by
+               bind, rebind, unbind, setSwapFee, swaps etc. (stored with calldata)
+        Strategy: LOG_SWAP, which holds the amount returned to the trader
+
+    uint256 amounts are stored as decimal strings as they overflow SQLite integers.
+    """
+    def __init__(self, w3, pool, strategy=None, db_file=DEFAULT_DB_FILE, start_block=0,
+                 chunk_size=5000):
+        """
+        :param w3: Web3 connection
+        :param pool: Web3 contract for Balancer pool
+        :param strategy: optional Web3 contract for StrategyBalancerMettalexV3
+        :param db_file: SQLite database file, default contract-cache/events.sqlite
+        :param start_block: first block to index e.g. pool creation block
+        :param chunk_size: number of blocks per getLogs request
+        """
+        self.w3 = w3
+        self.pool = pool
+        self.strategy = strategy
+        self.start_block = start_block
+        self.chunk_size = chunk_size
+        self.db = sqlite3.connect(str(db_file))
+        self.db.executescript(SCHEMA)
+
+        tables = {'LOG_SWAP': 'swaps', 'LOG_JOIN': 'joins', 'LOG_EXIT': 'exits'}
+        self.topics = {
+            self._signature_hash(abi).hex(): tables[abi['name']]
+            for abi in pool.abi if abi['type'] == 'event' and abi['name'] in tables
+        }
+        # LOG_CALL is anonymous, its first topic is the function selector
+        self.pool_selectors = {
+            self._signature_hash(abi)[:4].hex(): abi['name']
+            for abi in pool.abi if abi['type'] == 'function'
+        }
+
+    def _signature_hash(self, abi):
+        signature = f"{abi['name']}({','.join(i['type'] for i in abi['inputs'])})"
+        return self.w3.keccak(text=signature)
+
+    def last_block(self, contract):
+        row = self.db.execute(
+            'SELECT last_block FROM checkpoint WHERE address = ?', (contract.address,)
+        ).fetchone()
+        return self.start_block - 1 if row is None else row[0]
+
+    def sync(self, to_block='latest'):
+        """Index all logs up to to_block
+
+        :param to_block: last block to index, default latest
+        :return: last indexed block
+        """
+        if to_block == 'latest':
+            to_block = self.w3.eth.blockNumber
+        for contract in [self.pool, self.strategy]:
+            if contract is None:
+                continue
+            from_block = self.last_block(contract) + 1
+            while from_block <= to_block:
+                chunk_end = min(from_block + self.chunk_size - 1, to_block)
+                logs = self.w3.eth.getLogs({
+                    'address': contract.address, 'fromBlock': from_block, 'toBlock': chunk_end
+                })
+                with self.db:
+                    for log in logs:
+                        self._store(contract, log)
+                    self.db.execute(
+                        'INSERT OR REPLACE INTO checkpoint (address, last_block) VALUES (?, ?)',
+                        (contract.address, chunk_end))
+                from_block = chunk_end + 1
+        return to_block
+
+    def _store(self, contract, log):
+        if not log['topics']:
+            return
+        topic = log['topics'][0].hex()
+        key = (contract.address, log['blockNumber'], log['transactionHash'].hex(), log['logIndex'])
+        table = self.topics.get(topic)
+        if table is not None:
+            # Strategy and pool LOG_SWAP have the same signature
+            args = getattr(contract.events, 'LOG_' + table[:-1].upper())().processLog(log)['args']
+            if table == 'swaps':
+                values = (args['caller'], args['tokenIn'], args['tokenOut'],
+                          str(args['tokenAmountIn']), str(args['tokenAmountOut']))
+            elif table == 'joins':
+                values = (args['caller'], args['tokenIn'], str(args['tokenAmountIn']))
+            else:
+                values = (args['caller'], args['tokenOut'], str(args['tokenAmountOut']))
+            self.db.execute(
+                f'INSERT OR IGNORE INTO {table} VALUES ({", ".join("?" * (len(key) + len(values)))})',
+                key + values)
+        elif contract is self.pool and topic[:10] in self.pool_selectors:
+            caller = self.w3.toChecksumAddress('0x' + log['topics'][2].hex()[-40:])
+            # LOG_CALL data is ABI encoded bytes: offset, length, then msg.data
+            data = bytes(log['data'] if isinstance(log['data'], bytes) else
+                         bytes.fromhex(log['data'][2:]))
+            length = int.from_bytes(data[32:64], 'big')
+            calldata = data[64:64 + length]
+            self.db.execute(
+                'INSERT OR IGNORE INTO calls VALUES (?, ?, ?, ?, ?, ?, ?)',
+                key + (self.pool_selectors[topic[:10]], caller, '0x' + calldata.hex()))
+
+    def swaps(self, from_block=0, to_block=None, source='strategy', caller=None):
+        """Swap history
+
+        :param from_block: first block, default 0
+        :param to_block: last block, default all
+        :param source: 'strategy' for trader swaps, 'pool' for Balancer pool swaps
+        :param caller: optional address of swap sender
+        :return: list of dicts ordered by block and log index
+        """
+        contract = self.strategy if source == 'strategy' else self.pool
+        query = 'SELECT * FROM swaps WHERE address = ? AND block >= ?'
+        params = [contract.address, from_block]
+        if to_block is not None:
+            query += ' AND block <= ?'
+            params.append(to_block)
+        if caller is not None:
+            query += ' AND caller = ?'
+            params.append(caller)
+        cursor = self.db.execute(query + ' ORDER BY block, log_index', params)
+        columns = [c[0] for c in cursor.description]
+        rows = []
+        for row in cursor.fetchall():
+            row = dict(zip(columns, row))
+            row['amount_in'] = int(row['amount_in'])
+            row['amount_out'] = int(row['amount_out'])
+            rows.append(row)
+        return rows
+
+    def swap_amount_out(self, tx_hash):
+        """Amount returned to the trader by a strategy swap transaction
+
+        :param tx_hash: transaction hash (bytes or hex string)
+        :return: tokenAmountOut of the strategy LOG_SWAP in the transaction, None if not indexed
+        """
+        tx_hash = tx_hash if isinstance(tx_hash, str) else tx_hash.hex()
+        row = self.db.execute(
+            'SELECT amount_out FROM swaps WHERE address = ? AND tx_hash = ?',
+            (self.strategy.address, tx_hash)).fetchone()
+        return None if row is None else int(row[0])
+
+    def pool_state(self, block):
+        """Pool balances, denormalized weights and swap fee after all transactions in block
+
+        Replays indexed bind/rebind/unbind/setSwapFee calls, swaps, joins and
+        exits from start_block.  Tokens sent directly to the pool and absorbed
+        by gulp() are not visible in events so are not included.
+
+        :param block: block number, must not be after the last indexed block
+        :return: dict with 'balances' and 'weights' (token address -> int) and 'fee'
+        """
+        if block > self.last_block(self.pool):
+            raise ValueError(f'Block {block} not indexed yet, last indexed {self.last_block(self.pool)}')
+        address = self.pool.address
+        events = []
+        for table in ['calls', 'swaps', 'joins', 'exits']:
+            cursor = self.db.execute(
+                f'SELECT * FROM {table} WHERE address = ? AND block <= ?', (address, block))
+            columns = [c[0] for c in cursor.description]
+            for row in cursor.fetchall():
+                row = dict(zip(columns, row))
+                events.append((row['block'], row['log_index'], table, row))
+        events.sort(key=lambda e: e[:2])
+
+        balances = {}
+        weights = {}
+        fee = None
+        for _, _, table, row in events:
+            if table == 'calls':
+                if row['name'] not in STATE_CALLS:
+                    continue
+                fn, params = self.pool.decode_function_input(row['data'])
+                if row['name'] == 'setSwapFee':
+                    fee = params['swapFee']
+                elif row['name'] == 'unbind':
+                    balances.pop(params['token'], None)
+                    weights.pop(params['token'], None)
+                else:
+                    balances[params['token']] = params['balance']
+                    weights[params['token']] = params['denorm']
+            elif table == 'swaps':
+                balances[row['token_in']] = balances.get(row['token_in'], 0) + int(row['amount_in'])
+                balances[row['token_out']] = balances.get(row['token_out'], 0) - int(row['amount_out'])
+            elif table == 'joins':
+                balances[row['token_in']] = balances.get(row['token_in'], 0) + int(row['amount_in'])
+            else:
+                balances[row['token_out']] = balances.get(row['token_out'], 0) - int(row['amount_out'])
+        return {'balances': balances, 'weights': weights, 'fee': fee}
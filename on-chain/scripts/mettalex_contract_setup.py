@@ -7,9 +7,41 @@ import shutil
 import re
 import time
 
+from token_metadata import token_decimals, token_symbol
+from tx_pipeline import TxStep, TransactionPipeline, Contract, Config, Account, deploy_spec
+
 PRICE_DECIMALS = 1
 PRICE_SCALE = 10 * PRICE_DECIMALS
 
+# Constructor wiring of the Mettalex system, arguments refer to other contracts
+# in the spec, fields in args.json or the deploying account
+DEPLOYMENT_SPEC = {
+    # Balancer
+    'BFactory': {'args': []},
+    'BPool': {'factory': 'BFactory'},
+    'USDT': {'args': Config('USDT')},
+    # Mettalex Coin and Vault
+    'Coin': {'args': Config('Coin')},
+    'Long': {'args': Config('Long')},
+    'Short': {'args': Config('Short')},
+    'Vault': {'args': [
+        Config('Vault', 4), Config('Long', 3), Contract('Coin'), Contract('Long'), Contract('Short'),
+        Config('Vault', 5, default=Account()), Contract('BPool'),
+        Config('Vault', 0, scale=PRICE_SCALE), Config('Vault', 1, scale=PRICE_SCALE),
+        Config('Vault', 2), Config('Vault', 3)
+    ]},
+    # Bridge
+    'Bridge': {'args': [Contract('USDT'), Contract('Coin'), 100, 10000 * (10 ** 6), 10]},
+    # Liquidity Provider
+    'YController': {'args': [Account()]},
+    'YVault': {'args': [Contract('Coin'), Contract('YController')]},
+    'StrategyHelper': {'args': []},
+    'PoolController': {'args': [
+        Contract('YController'), Contract('Coin'), Contract('BPool'), Contract('Vault'),
+        Contract('Long'), Contract('Short'), Config('PoolController', 0, default=Contract('Coin'))
+    ]},
+}
+
 
 def read_config():
     # Read configuration from local file system
@@ -182,6 +214,80 @@ def connect_contract(w3, contract, address):
     return deployed_contract
 
 
+class BatchCaller(object):
+    """Collect contract view function calls and send them as a single JSON-RPC batch
+
+    Usage:
+        batch = BatchCaller(w3)
+        batch.add(coin.functions.balanceOf(address))
+        batch.add(vault.functions.priceSpot())
+        coin_balance, spot = batch.execute()
+
+    Falls back to sequential calls for providers without an HTTP endpoint
+    (e.g. IPC or websocket providers).
+    """
+    def __init__(self, w3):
+        self.w3 = w3
+        self.calls = []
+
+    def add(self, fn):
+        """Queue bound contract function e.g. tok.functions.balanceOf(address)
+
+        :param fn: web3 ContractFunction with arguments
+        :return: index of result in list returned by execute
+        """
+        self.calls.append(fn)
+        return len(self.calls) - 1
+
+    def execute(self, block_identifier='latest'):
+        """Send all queued calls in one round trip
+
+        :param block_identifier: block to read state at, default 'latest'
+        :return: list of decoded results in the order calls were added
+        """
+        calls, self.calls = self.calls, []
+        if not calls:
+            return []
+        endpoint_uri = getattr(self.w3.provider, 'endpoint_uri', None)
+        if endpoint_uri is None or not str(endpoint_uri).startswith('http'):
+            return [fn.call(block_identifier=block_identifier) for fn in calls]
+
+        import requests
+        from web3._utils.abi import map_abi_data
+        from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+
+        if isinstance(block_identifier, int):
+            block_identifier = hex(block_identifier)
+        payload = [
+            {
+                'jsonrpc': '2.0',
+                'id': i,
+                'method': 'eth_call',
+                'params': [
+                    {'to': fn.address, 'data': fn._encode_transaction_data()},
+                    block_identifier
+                ]
+            } for i, fn in enumerate(calls)
+        ]
+        response = requests.post(
+            endpoint_uri, json=payload, **self.w3.provider.get_request_kwargs())
+        response.raise_for_status()
+        # Batch responses are not guaranteed to be in request order
+        responses = {r['id']: r for r in response.json()}
+
+        results = []
+        for i, fn in enumerate(calls):
+            if 'error' in responses[i]:
+                raise ValueError(responses[i]['error'])
+            output_types = [output['type'] for output in fn.abi['outputs']]
+            decoded = self.w3.codec.decode_abi(
+                output_types, bytes.fromhex(responses[i]['result'][2:]))
+            # Checksum addresses as ContractFunction.call does
+            normalized = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, decoded)
+            results.append(normalized[0] if len(normalized) == 1 else normalized)
+        return results
+
+
 def connect_deployed(w3, contracts, contract_file_name='contract_address.json', cache_file_name='contract_cache.json'):
     contract_file = Path(__file__).parent / \
                     'contract-cache' / contract_file_name
@@ -199,66 +305,15 @@ def connect_deployed(w3, contracts, contract_file_name='contract_address.json',
     with open(cache_file, 'r') as f:
         contract_cache = json.load(f)
 
-    account = w3.eth.defaultAccount
-    deployed_contracts = {}
-
-    for k in contracts.keys():
-        if contract_cache[k]:
-            deployed_contracts[k] = connect_contract(
-                w3, contracts[k], contract_cache[k])
-
-        else:
-            if k == 'BFactory':
-                deployed_contracts[k] = deploy_contract(w3, contracts[k])
-
-            elif k == 'BPool':
-                deployed_contracts[k] = create_balancer_pool(
-                    w3, contracts[k], connect_contract(w3, contracts['BFactory'], contract_cache['BFactory']))
-
-            elif k == 'YController':
-                deployed_contracts[k] = deploy_contract(
-                    w3, contracts[k], w3.eth.defaultAccount)
-
-            elif k == 'Bridge':
-                deployed_contracts[k] = deploy_contract(
-                    w3, contracts[k], contract_cache['USDT'], contract_cache['Coin'], 100, 10000 * (10 ** 6), 10)
-
-            elif k == 'YVault':
-                deployed_contracts[k] = deploy_contract(
-                    w3, contracts[k], contract_cache['Coin'], contract_cache['YController'])
-
-            elif k == 'PoolController':
-                deployed_contracts[k] = deploy_contract(
-                    w3, contracts[k], contract_cache['YController'], contract_cache['Coin'], contract_cache['BPool'],
-                    contract_cache['Vault'], contract_cache['Long'], contract_cache['Short'])
-            elif k == 'Vault':
-                tok_version = args['Long'][3]
-                cap = args['Vault'][0] * PRICE_SCALE
-                floor = args['Vault'][1] * PRICE_SCALE
-                multiplier = args['Vault'][2]
-                fee_rate = args['Vault'][3]
-                vault_name = args['Vault'][4]
-                oracle = args['Vault'][5]
-                if not oracle:
-                    oracle = account
-                deployed_contracts[k] = deploy_contract(w3, contracts[k], vault_name, tok_version,
-                                                        contract_cache['Coin'], contract_cache['Long'],
-                                                        contract_cache['Short'],
-                                                        oracle, contract_cache['BPool'], cap, floor, multiplier,
-                                                        fee_rate)
-            else:
-                deployed_contracts[k] = deploy_contract(
-                    w3, contracts[k], *args[k])
-        contract_cache[k] = deployed_contracts[k].address
-
-    with open(cache_file, 'w') as f:
-        json.dump(contract_cache, f)
-    return deployed_contracts
+    # Deploy contracts missing from the cache, writing each address as it is mined
+    deployed_contracts = deploy_spec(
+        w3, contracts, DEPLOYMENT_SPEC, args, names=list(contracts.keys()),
+        cache=contract_cache, cache_file=cache_file)
+    return {k: deployed_contracts[k] for k in contracts.keys()}
 
 
 def deploy(w3, contracts, cache_file_name='contract_cache.json'):
     cache_file = Path(__file__).parent / 'contract-cache' / cache_file_name
-    account = w3.eth.defaultAccount
 
     if not os.path.isfile('args.json'):
         print('No args file')
@@ -267,76 +322,10 @@ def deploy(w3, contracts, cache_file_name='contract_cache.json'):
     with open('args.json', 'r') as f:
         args = json.load(f)
 
-    # Balancer
-    balancer_factory = deploy_contract(w3, contracts['BFactory'])
-    balancer = create_balancer_pool(w3, contracts['BPool'], balancer_factory)
-
-    USDT = deploy_contract(w3, contracts['USDT'], *args['USDT'])
-
-    # Mettalex Coin and Vault
-    coin = deploy_contract(w3, contracts['Coin'], *args['Coin'])
-    ltk = deploy_contract(w3, contracts['Long'], *args['Long'])
-    stk = deploy_contract(w3, contracts['Short'], *args['Short'])
-
-    tok_version = args['Long'][3]
-    cap = args['Vault'][0] * PRICE_SCALE
-    floor = args['Vault'][1] * PRICE_SCALE
-    multiplier = args['Vault'][2]
-    feeRate = args['Vault'][3]
-    vault = deploy_contract(
-        w3, contracts['Vault'],
-        'Mettalex Vault', tok_version, coin.address, ltk.address, stk.address,
-        account, balancer.address, cap, floor, multiplier, feeRate)
-
-    # Bridge
-    bridge = deploy_contract(w3, contracts['Bridge'], USDT.address, coin.address, 100, 10000 * (10 ** 6), 10)
-    # Liquidity Provider
-    y_controller = deploy_contract(w3, contracts['YController'], account)
-    y_vault = deploy_contract(
-        w3, contracts['YVault'], coin.address, y_controller.address)
-
-    strategy_helper = deploy_contract(w3, contracts['StrategyHelper'])
-
-    if (len(args['PoolController'])):
-        strategy = deploy_contract(
-            w3, contracts['PoolController'], y_controller.address, coin.address, balancer.address, vault.address,
-            ltk.address, stk.address, args['PoolController'][0])
-    else:
-        strategy = deploy_contract(
-            w3, contracts['PoolController'], y_controller.address, coin.address, balancer.address, vault.address,
-            ltk.address, stk.address, coin.address)
-
-    contract_addresses = {
-        'BFactory': balancer_factory.address,
-        'BPool': balancer.address,
-        'Coin': coin.address,
-        'Long': ltk.address,
-        'Short': stk.address,
-        'Vault': vault.address,
-        'YVault': y_vault.address,
-        'YController': y_controller.address,
-        'PoolController': strategy.address,
-        'Bridge': bridge.address,
-        'USDT': USDT.address,
-        "StrategyHelper": strategy_helper.address
-    }
-    with open(cache_file, 'w') as f:
-        json.dump(contract_addresses, f)
-
-    deployed_contracts = {
-        'BFactory': balancer_factory,
-        'BPool': balancer,
-        'Coin': coin,
-        'Long': ltk,
-        'Short': stk,
-        'Vault': vault,
-        'YVault': y_vault,
-        'YController': y_controller,
-        'PoolController': strategy,
-        'USDT': USDT,
-        'Bridge': bridge,
-        "StrategyHelper": strategy_helper
-    }
+    # Independent contracts are sent back to back, dependent contracts once
+    # the receipts with the addresses they need have been mined
+    deployed_contracts = deploy_spec(
+        w3, contracts, DEPLOYMENT_SPEC, args, cache={}, cache_file=cache_file)
     return deployed_contracts
 
 
@@ -449,29 +438,59 @@ def set_strategy_helper(w3, strategy, strategy_helper, acct=None):
         {'from': acct, 'gas': 1_000_000})
 
 
-def full_setup(w3, admin, deployed_contracts=None, price=None, contracts=None):
+def full_setup(w3, admin, deployed_contracts=None, price=None, contracts=None, pipeline=None):
     if deployed_contracts is None:
         print('Deploying contracts')
         deployed_contracts = deploy(w3, contracts)
-    print('Whitelisting Mettalex vault to mint position tokens')
-    whitelist_vault(
-        w3, deployed_contracts['Vault'], deployed_contracts['Long'], deployed_contracts['Short'])
-    print('Setting strategy')
-    set_strategy(
-        w3, deployed_contracts['YController'], deployed_contracts['Coin'], deployed_contracts['PoolController'])
-    print('Setting y-vault controller')
-    set_yvault_controller(
-        w3, deployed_contracts['YController'], deployed_contracts['YVault'].address, deployed_contracts['Coin'].address)
-    print('Setting balancer controller')
-    set_balancer_controller(
-        w3, deployed_contracts['BPool'], deployed_contracts['PoolController'])
-    print('Setting Mettalex vault AMM')
-    set_autonomous_market_maker(
-        w3, deployed_contracts['Vault'], deployed_contracts['PoolController'])  # Zero fees for AMM
-    # Connect strategy helper to strategy
-    set_strategy_helper(
-        w3, deployed_contracts['PoolController'], deployed_contracts['StrategyHelper'], acct=admin
-    )
+    vault = deployed_contracts['Vault']
+    ltk = deployed_contracts['Long']
+    stk = deployed_contracts['Short']
+    coin = deployed_contracts['Coin']
+    y_controller = deployed_contracts['YController']
+    y_vault = deployed_contracts['YVault']
+    balancer = deployed_contracts['BPool']
+    strategy = deployed_contracts['PoolController']
+    strategy_helper = deployed_contracts['StrategyHelper']
+
+    # Wiring transactions are independent so are sent back to back and only
+    # waited for once all have been submitted
+    gas = {'gas': 1_000_000}
+    steps = {
+        # Whitelisting Mettalex vault to mint position tokens
+        'whitelist_long': TxStep([], lambda r: ltk.functions.setWhitelist(vault.address, True), tx=gas),
+        'whitelist_short': TxStep([], lambda r: stk.functions.setWhitelist(vault.address, True), tx=gas),
+        'strategy': TxStep(
+            [], lambda r: y_controller.functions.setStrategy(coin.address, strategy.address), tx=gas),
+        'yvault_controller': TxStep(
+            [], lambda r: y_controller.functions.setVault(coin.address, y_vault.address), tx=gas),
+        'balancer_controller': TxStep(
+            [], lambda r: balancer.functions.setController(strategy.address), tx=gas),
+        # Zero fees for AMM
+        'autonomous_market_maker': TxStep(
+            [], lambda r: vault.functions.updateAMMPoolController(strategy.address), tx=gas),
+        # Connect strategy helper to strategy
+        'strategy_helper': TxStep(
+            [], lambda r: strategy.functions.setStrategyHelper(str(strategy_helper.address)), tx=gas),
+    }
+    print('Whitelisting vault, setting strategy, y-vault controller, balancer controller and Mettalex vault AMM')
+    (pipeline or TransactionPipeline(w3)).run(steps)
+
+    batch = BatchCaller(w3)
+    for fn in [
+        ltk.functions.name(), ltk.functions.whitelist(vault.address),
+        stk.functions.name(), stk.functions.whitelist(vault.address),
+        coin.functions.name(), y_controller.functions.strategies(coin.address),
+        balancer.functions.getController(),
+        vault.functions.contractName(), vault.functions.ammPoolController()
+    ]:
+        batch.add(fn)
+    (ltk_name, ltk_whitelisted, stk_name, stk_whitelisted, coin_name, coin_strategy,
+     balancer_controller, vault_name, vault_amm) = batch.execute()
+    print(f'{ltk_name} whitelist state for {vault.address}: {ltk_whitelisted}')
+    print(f'{stk_name} whitelist state for {vault.address}: {stk_whitelisted}')
+    print(f'{coin_name} strategy: {coin_strategy}')
+    print(f'Balancer controller {balancer_controller}')
+    print(f'{vault_name} strategy: {vault_amm}')
     if price is not None:
         # May be connecting to existing vault, if not then can set tht price here
         set_price(w3, deployed_contracts['Vault'], price)
@@ -568,33 +587,39 @@ def get_vault_details(w3, contracts, address=None):
 
     vault = w3.eth.contract(address=address, abi=vault_contract.abi)
 
-    coin_address = vault.functions.collateralToken().call()
+    # Two round trips: vault state including token addresses, then token details
+    batch = BatchCaller(w3)
+    for fn in ['collateralToken', 'longPositionToken', 'shortPositionToken', 'contractName',
+               'priceFloor', 'priceCap', 'collateralPerUnit', 'priceSpot', 'oracle']:
+        batch.add(getattr(vault.functions, fn)())
+    (coin_address, ltok_address, stok_address, name,
+     vault_floor, vault_cap, collateral_per_unit, vault_spot, oracle) = batch.execute()
+
     coin = w3.eth.contract(address=coin_address, abi=contracts['Coin'].abi)
-    ltok_address = vault.functions.longPositionToken().call()
     ltok = w3.eth.contract(address=ltok_address, abi=contracts['Long'].abi)
-    stok_address = vault.functions.shortPositionToken().call()
     stok = w3.eth.contract(address=stok_address, abi=contracts['Short'].abi)
 
-    def token_details(tok):
+    for tok in [coin, ltok, stok]:
+        for fn in ['name', 'symbol', 'decimals']:
+            batch.add(getattr(tok.functions, fn)())
+    token_results = batch.execute()
+
+    def token_details(i, tok):
+        tok_name, tok_symbol, tok_decimals = token_results[3*i:3*i + 3]
         return {
             'adress': tok.address,
-            'name': tok.functions.name().call(),
-            'symbol': tok.functions.symbol().call(),
-            'decimals': tok.functions.decimals().call()
+            'name': tok_name,
+            'symbol': tok_symbol,
+            'decimals': tok_decimals
         }
 
-    name = vault.functions.contractName().call()
-    vault_floor = vault.functions.priceFloor().call()
-    vault_cap = vault.functions.priceCap().call()
-    collateral_per_unit = vault.functions.collateralPerUnit().call()
-    vault_spot = vault.functions.priceSpot().call()
     vault_details = {
         'vault': vault,
-        'coin': token_details(coin),
-        'ltok': token_details(ltok),
-        'stok': token_details(stok),
+        'coin': token_details(0, coin),
+        'ltok': token_details(1, ltok),
+        'stok': token_details(2, stok),
         'name': name,
-        'oracle': vault.functions.oracle().call(),
+        'oracle': oracle,
         'floor': vault_floor,
         'cap': vault_cap,
         'spot': vault_spot,
@@ -613,8 +638,8 @@ def print_mettalex_vault(w3, contracts, address=None):
     print(f'Vault: {res["vault"].address}')
     print(
         f'Floor: {res["floor"]}, Cap: {res["cap"]} -> Collateral Per Unit {res["cpu"]}')
-    coin_dp = res["coin"].functions.decimals().call()
-    ltok_dp = res["ltok"].functions.decimals().call()
+    coin_dp = res["coin"]["decimals"]
+    ltok_dp = res["ltok"]["decimals"]
     cpu_ticks = res["cpu"] * 10 ** (ltok_dp - coin_dp)
     print(f'Dollar value of 1 position token pair = {cpu_ticks}')
     print(f'Current spot price: {res["spot"]}')
@@ -635,26 +660,41 @@ class BalanceReporter(object):
         self.y_vault_scale = 10 ** 6
 
     def get_balances(self, address):
-        coin_balance = self.coin.functions.balanceOf(address).call()
-        ltk_balance = self.ltk.functions.balanceOf(address).call()
-        stk_balance = self.stk.functions.balanceOf(address).call()
-        y_vault_balance = self.y_vault.functions.balanceOf(address).call()
-        return coin_balance, ltk_balance, stk_balance, y_vault_balance
+        return self.get_all_balances([address])[0]
+
+    def get_all_balances(self, addresses):
+        """Token balances of several addresses read in one JSON-RPC batch
+
+        :param addresses: list of holder addresses
+        :return: list of (coin, ltk, stk, y_vault) balance tuples
+        """
+        batch = BatchCaller(self.w3)
+        for address in addresses:
+            for tok in [self.coin, self.ltk, self.stk, self.y_vault]:
+                batch.add(tok.functions.balanceOf(address))
+        results = batch.execute()
+        return [tuple(results[4*i:4*i + 4]) for i in range(len(addresses))]
 
     def print_balances(self, address, name):
-        coin_balance, ltk_balance, stk_balance, y_vault_balance = self.get_balances(
-            address)
-        print(
-            f'\n{name} ({address}) has {y_vault_balance / 10 ** 6:0.2f} vault shares')
-        print(
-            f'  {coin_balance / 10 ** 6:0.2f} coin, {ltk_balance / 10 ** 5:0.2f} LTK, {stk_balance / 10 ** 5:0.2f} STK\n')
+        self.print_all_balances([(address, name)])
+
+    def print_all_balances(self, holders):
+        """Print balances for list of (address, name) pairs using a single batch read
+        """
+        all_balances = self.get_all_balances([address for address, _ in holders])
+        for (address, name), balances in zip(holders, all_balances):
+            coin_balance, ltk_balance, stk_balance, y_vault_balance = balances
+            print(
+                f'\n{name} ({address}) has {y_vault_balance / 10 ** 6:0.2f} vault shares')
+            print(
+                f'  {coin_balance / 10 ** 6:0.2f} coin, {ltk_balance / 10 ** 5:0.2f} LTK, {stk_balance / 10 ** 5:0.2f} STK\n')
 
 
 def deposit(w3, y_vault, coin, amount, customAccount=None):
     acct = w3.eth.defaultAccount
     if customAccount:
         acct = customAccount
-    amount_unitless = int(amount * 10 ** (coin.functions.decimals().call()))
+    amount_unitless = int(amount * 10 ** (token_decimals(coin)))
     tx_hash = coin.functions.approve(y_vault.address, amount_unitless).transact(
         {'from': acct, 'gas': 1_000_000}
     )
@@ -684,8 +724,8 @@ def swap_amount_in(w3, balancer, tok_in, qty_in, tok_out, customAccount=None, mi
     if customAccount:
         acct = customAccount
     print(
-        f'User: {acct} making a swap in balancer. Token_in: ${tok_in.functions.symbol().call()} Token_out: ${tok_out.functions.symbol().call()}')
-    qty_in_unitless = int(qty_in * 10 ** (tok_in.functions.decimals().call()))
+        f'User: {acct} making a swap in balancer. Token_in: ${token_symbol(tok_in)} Token_out: ${token_symbol(tok_out)}')
+    qty_in_unitless = int(qty_in * 10 ** (token_decimals(tok_in)))
 
     if qty_in_unitless > tok_in.functions.allowance(acct, balancer.address).call():
         tx_hash = tok_in.functions.approve(balancer.address, qty_in_unitless).transact(
@@ -709,7 +749,7 @@ def swap_amount_in(w3, balancer, tok_in, qty_in, tok_out, customAccount=None, mi
         print(f'Max price not specified: using {max_price}')
 
     min_qty_out_unitless = int(
-        min_qty_out * 10 ** (tok_out.functions.decimals().call()))
+        min_qty_out * 10 ** (token_decimals(tok_out)))
 
     tx_hash = balancer.functions.swapExactAmountIn(
         tok_in.address, qty_in_unitless,
@@ -750,8 +790,8 @@ def get_spot_price(w3, balancer, tok_in, tok_out, unitless=False, include_fee=Fa
     if not unitless:
         # Take decimals into account
         spot_price = spot_price * 10 ** (
-                tok_out.functions.decimals().call()
-                - tok_in.functions.decimals().call()
+                token_decimals(tok_out)
+                - token_decimals(tok_in)
                 - 18)
     return spot_price
 
@@ -760,7 +800,7 @@ def withdraw(w3, y_vault, amount, customAccount=None):
     acct = w3.eth.defaultAccount
     if customAccount:
         acct = customAccount
-    amount_unitless = amount * 10 ** (y_vault.functions.decimals().call())
+    amount_unitless = amount * 10 ** (token_decimals(y_vault))
     tx_hash = y_vault.functions.withdraw(amount_unitless).transact(
         {'from': acct, 'gas': 5_000_000}
     )
@@ -772,7 +812,7 @@ def distribute_coin(w3, coin, amount=200000, customAccount=None):
     acct = w3.eth.defaultAccount
     if customAccount:
         acct = customAccount
-    transfer_amount = amount * 10 ** (coin.functions.decimals().call())
+    transfer_amount = amount * 10 ** (token_decimals(coin))
     tx_hash = coin.functions.transfer(acct, transfer_amount).transact(
         {'from': w3.eth.defaultAccount, 'gas': 5_000_000}
     )
@@ -786,7 +826,7 @@ def mintPositionTokens(w3, vault, coin, collateralAmount=20000, customAccount=No
     if customAccount:
         acct = customAccount
     collateralAmount_unitless = collateralAmount * \
-                                10 ** (coin.functions.decimals().call())
+                                10 ** (token_decimals(coin))
     tx_hash = coin.functions.approve(vault.address, collateralAmount_unitless).transact(
         {'from': acct, 'gas': 5_000_000}
     )
@@ -834,11 +874,13 @@ def simulate_scenario(w3, admin, deployed_contracts=None):
     mintPositionTokens(w3, vault, coin, 100000, user3)
     mintPositionTokens(w3, vault, coin, 100000, user4)
 
-    reporter.print_balances(w3.eth.defaultAccount, 'User 0')
-    reporter.print_balances(user1, 'User 1')
-    reporter.print_balances(user2, 'User 2')
-    reporter.print_balances(user3, 'User 3')
-    reporter.print_balances(user4, 'User 4')
+    reporter.print_all_balances([
+        (w3.eth.defaultAccount, 'User 0'),
+        (user1, 'User 1'),
+        (user2, 'User 2'),
+        (user3, 'User 3'),
+        (user4, 'User 4')
+    ])
 
     deposit(w3, y_vault, coin, 200000, user1)
     deposit(w3, y_vault, coin, 100000, user2)
@@ -847,13 +889,15 @@ def simulate_scenario(w3, admin, deployed_contracts=None):
     deposit(w3, y_vault, coin, 200000)
     earn(w3, y_vault)
 
-    reporter.print_balances(y_vault.address, 'Y Vault')
-    reporter.print_balances(balancer.address, 'Balancer AMM')
-    reporter.print_balances(w3.eth.defaultAccount, 'User 0')
-    reporter.print_balances(user1, 'User 1')
-    reporter.print_balances(user2, 'User 2')
-    reporter.print_balances(user3, 'User 3')
-    reporter.print_balances(user4, 'User 4')
+    reporter.print_all_balances([
+        (y_vault.address, 'Y Vault'),
+        (balancer.address, 'Balancer AMM'),
+        (w3.eth.defaultAccount, 'User 0'),
+        (user1, 'User 1'),
+        (user2, 'User 2'),
+        (user3, 'User 3'),
+        (user4, 'User 4')
+    ])
 
     # swap_amount_in(w3, balancer, ltk, 500, stk, user2, 100)
     # swap_amount_in(w3, balancer, stk, 500, ltk, user3, 100)
@@ -863,21 +907,25 @@ def simulate_scenario(w3, admin, deployed_contracts=None):
     swap(w3, strategy, stk, int(500000), ltk, user=user3)
     swap(w3, strategy, ltk, int(500000), stk, user=user4)
 
-    reporter.print_balances(y_vault.address, 'Y Vault')
-    reporter.print_balances(balancer.address, 'Balancer AMM')
-    reporter.print_balances(w3.eth.defaultAccount, 'User 0')
-    reporter.print_balances(user1, 'User 1')
-    reporter.print_balances(user2, 'User 2')
-    reporter.print_balances(user3, 'User 3')
-    reporter.print_balances(user4, 'User 4')
+    reporter.print_all_balances([
+        (y_vault.address, 'Y Vault'),
+        (balancer.address, 'Balancer AMM'),
+        (w3.eth.defaultAccount, 'User 0'),
+        (user1, 'User 1'),
+        (user2, 'User 2'),
+        (user3, 'User 3'),
+        (user4, 'User 4')
+    ])
 
     withdraw(w3, y_vault, 200000)
     withdraw(w3, y_vault, 200000, user1)
 
-    reporter.print_balances(y_vault.address, 'Y Vault')
-    reporter.print_balances(balancer.address, 'Balancer AMM')
-    reporter.print_balances(w3.eth.defaultAccount, 'User 0')
-    reporter.print_balances(user1, 'User 1')
+    reporter.print_all_balances([
+        (y_vault.address, 'Y Vault'),
+        (balancer.address, 'Balancer AMM'),
+        (w3.eth.defaultAccount, 'User 0'),
+        (user1, 'User 1')
+    ])
 
 
 def update_oracle(w3, admin, vault, oracle, vault_address=None):
@@ -912,8 +960,9 @@ def swap(w3, strategy, tokenIn, amountIn, tokenOut, amountOut=1, user=None):
 
     tx_receipt = w3.eth.waitForTransactionReceipt(tx_hash)
 
-    # amount of tokens received
-    logs = strategy.events.LOG_SWAP.getLogs()
+    # amount of tokens received, read from this transaction's receipt rather
+    # than scanning logs which may contain other swaps
+    logs = strategy.events.LOG_SWAP().processReceipt(tx_receipt)
     amount_out = logs[0]['args']['tokenAmountOut']
     print(
         f'Swap successful from {tokenIn.address} to {tokenOut.address} with received amount = {amount_out}')
@@ -948,23 +997,13 @@ def after_breach_setup(w3, contracts, coin, balancer, strategy, price=None):
     with open('args.json', 'r') as f:
         args = json.load(f)
 
-    # contract deployment:
-    ltk = deploy_contract(w3, contracts['Long'], *args['Long'])
-    stk = deploy_contract(w3, contracts['Short'], *args['Short'])
-
-    tok_version = args['Long'][3]
-    cap = args['Vault'][0] * PRICE_SCALE
-    floor = args['Vault'][1] * PRICE_SCALE
-    multiplier = args['Vault'][2]
-    feeRate = args['Vault'][3]
-    vault_name = args['Vault'][4]
-    oracle = args['Vault'][5]
-    if not oracle:
-        oracle = account
-    vault = deploy_contract(
-        w3, contracts['Vault'],
-        vault_name, tok_version, coin.address, ltk.address, stk.address,
-        oracle, balancer.address, cap, floor, multiplier, feeRate)
+    # contract deployment: only the position tokens and vault, reusing existing coin and pool
+    deployed = deploy_spec(
+        w3, contracts, DEPLOYMENT_SPEC, args, names=['Long', 'Short', 'Vault'],
+        cache={'Coin': coin.address, 'BPool': balancer.address}, account=account)
+    ltk = deployed['Long']
+    stk = deployed['Short']
+    vault = deployed['Vault']
 
     # Contract setup:
     print('Whitelisting Mettalex vault to mint position tokens')
@@ -0,0 +1,100 @@
+import os
+import json
+import weakref
+from pathlib import Path
+
+DEFAULT_CACHE_FILE = Path(__file__).parent / 'contract-cache' / 'token_metadata.json'
+
+
+class TokenMetadataCache(object):
+    """Process-wide cache of ERC20 name, symbol and decimals
+
+    Token metadata is fixed at deployment so each field is read from chain at
+    most once per (chain id, token address).  Optionally the cache is persisted
+    to a JSON file so later runs need no metadata calls at all.  Local ganache
+    chains reuse addresses after a restart so only enable the file store for
+    persistent networks, or clear() it after redeploying.
+    """
+    fields = ('name', 'symbol', 'decimals')
+
+    def __init__(self, cache_file=None):
+        self.cache_file = None
+        self.metadata = {}
+        self._chain_ids = weakref.WeakKeyDictionary()
+        if cache_file is not None:
+            self.load(cache_file)
+
+    def load(self, cache_file):
+        """Merge metadata stored in JSON file and persist all further lookups to it
+        """
+        if os.path.isfile(cache_file):
+            with open(cache_file, 'r') as f:
+                for key, tok_metadata in json.load(f).items():
+                    self.metadata.setdefault(key, {}).update(tok_metadata)
+        self.cache_file = cache_file
+        self.save()
+
+    def chain_id(self, w3):
+        if w3 not in self._chain_ids:
+            self._chain_ids[w3] = w3.eth.chainId
+        return self._chain_ids[w3]
+
+    def get(self, tok, field):
+        """Get metadata field for token, reading from chain on first use
+
+        :param tok: Web3 token contract
+        :param field: one of 'name', 'symbol', 'decimals'
+        :return: field value
+        """
+        if field not in self.fields:
+            raise ValueError(f'Unknown token metadata field {field}')
+        key = f'{self.chain_id(tok.web3)}:{tok.address}'
+        tok_metadata = self.metadata.setdefault(key, {})
+        if field not in tok_metadata:
+            tok_metadata[field] = getattr(tok.functions, field)().call()
+            self.save()
+        return tok_metadata[field]
+
+    def decimals(self, tok):
+        return self.get(tok, 'decimals')
+
+    def symbol(self, tok):
+        return self.get(tok, 'symbol')
+
+    def name(self, tok):
+        return self.get(tok, 'name')
+
+    def save(self):
+        if self.cache_file is None:
+            return
+        with open(self.cache_file, 'w') as f:
+            json.dump(self.metadata, f)
+
+    def clear(self):
+        self.metadata = {}
+        self.save()
+
+
+token_metadata = TokenMetadataCache()
+
+
+def use_cache_file(cache_file=DEFAULT_CACHE_FILE):
+    """Persist the shared token metadata cache to a JSON file next to the contract cache
+
+    :param cache_file: path of JSON file, default contract-cache/token_metadata.json
+    :return: shared TokenMetadataCache
+    """
+    token_metadata.load(cache_file)
+    return token_metadata
+
+
+def token_decimals(tok):
+    return token_metadata.decimals(tok)
+
+
+def token_symbol(tok):
+    return token_metadata.symbol(tok)
+
+
+def token_name(tok):
+    return token_metadata.name(tok)
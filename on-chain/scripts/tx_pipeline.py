@@ -0,0 +1,251 @@
+import json
+import threading
+from collections import namedtuple
+
+# Node of a transaction dependency graph
+#   deps: names of steps whose results are needed to build this transaction
+#   build: function(results) -> web3 ContractFunction or ContractConstructor with arguments
+#   result: function(receipt, results) -> value stored in results, default the receipt
+#   tx: extra transaction parameters e.g. {'gas': 1_000_000}
+TxStep = namedtuple('TxStep', ['deps', 'build', 'result', 'tx'], defaults=(None, None))
+
+
+def contract_from_receipt(contract):
+    """Result function for constructor steps returning the deployed contract
+    """
+    def result(receipt, results):
+        return contract.web3.eth.contract(address=receipt.contractAddress, abi=contract.abi)
+    return result
+
+
+class TransactionPipeline(object):
+    """Send transactions back to back from one account with locally assigned nonces
+
+    Transactions are submitted without waiting for earlier ones to be mined,
+    receipts are only waited for when a later transaction needs the result
+    (e.g. the address of a deployed contract) or at the end of run().
+    Nonces are read once from the pending transaction count so the pipeline
+    must be the only sender for the account while it is in use.  A pipeline
+    can be shared between threads to use one nonce lane for the account.
+    """
+    def __init__(self, w3, account=None, timeout=600):
+        self.w3 = w3
+        self.account = account or w3.eth.defaultAccount
+        self.timeout = timeout
+        self.nonce = w3.eth.getTransactionCount(self.account, 'pending')
+        self.receipts = {}
+        self._lock = threading.Lock()
+
+    def send(self, fn, tx=None):
+        """Submit transaction with next nonce
+
+        :param fn: web3 ContractFunction or ContractConstructor with arguments
+        :param tx: extra transaction parameters
+        :return: transaction hash
+        """
+        tx = dict(tx or {})
+        tx.setdefault('from', self.account)
+        with self._lock:
+            tx['nonce'] = self.nonce
+            tx_hash = fn.transact(tx)
+            self.nonce += 1
+        return tx_hash
+
+    def wait(self, tx_hash):
+        """Wait for transaction receipt, raising if the transaction reverted
+        """
+        if tx_hash not in self.receipts:
+            receipt = self.w3.eth.waitForTransactionReceipt(tx_hash, timeout=self.timeout)
+            if receipt.status == 0:
+                raise ValueError(f'Transaction {tx_hash.hex()} reverted')
+            self.receipts[tx_hash] = receipt
+        return self.receipts[tx_hash]
+
+    def run(self, steps, results=None, callback=None):
+        """Execute dependency graph of transactions
+
+        Every step whose dependencies are available is submitted immediately,
+        then the oldest outstanding transaction is waited for and the process
+        repeats until all steps are mined.
+
+        :param steps: dict of name -> TxStep
+        :param results: dict of already available results that steps may depend on
+        :param callback: optional function(name, result) called as each step is mined
+        :return: dict of name -> step result, including initial results
+        """
+        results = dict(results or {})
+        remaining = dict(steps)
+        submitted = {}
+        while remaining or submitted:
+            ready = [
+                name for name, step in remaining.items()
+                if all(dep in results for dep in step.deps)
+            ]
+            for name in ready:
+                step = remaining.pop(name)
+                submitted[name] = self.send(step.build(results), step.tx)
+            if not submitted:
+                raise ValueError('Unresolvable step dependencies', sorted(remaining))
+
+            # Transactions from one account are mined in nonce order
+            name = next(iter(submitted))
+            receipt = self.wait(submitted.pop(name))
+            step = steps[name]
+            results[name] = receipt if step.result is None else step.result(receipt, results)
+            if callback is not None:
+                callback(name, results[name])
+        return results
+
+
+class Contract(object):
+    """Deployment spec argument: address of another contract in the spec"""
+    def __init__(self, name):
+        self.name = name
+
+
+class Config(object):
+    """Deployment spec argument: field from args.json
+
+    :param name: top level key in args.json
+    :param index: optional index into the list stored under name
+    :param scale: multiplier applied to the value e.g. PRICE_SCALE
+    :param default: value used if the field is missing or empty, may itself be a spec argument
+    """
+    def __init__(self, name, index=None, scale=None, default=None):
+        self.name = name
+        self.index = index
+        self.scale = scale
+        self.default = default
+
+
+class Account(object):
+    """Deployment spec argument: address of the deploying account"""
+
+
+def spec_dependencies(node):
+    """Names of contracts referenced by a deployment spec node"""
+    deps = [node['factory']] if 'factory' in node else []
+    args = node.get('args', [])
+    for arg in (args if isinstance(args, list) else []):
+        while isinstance(arg, Config):
+            arg = arg.default
+        if isinstance(arg, Contract):
+            deps.append(arg.name)
+    return deps
+
+
+def topological_order(spec, names=None, available=()):
+    """Order spec nodes so every contract comes after the contracts it references
+
+    :param spec: deployment spec dict of name -> node
+    :param names: names to include, default all; their dependencies are always included
+    :param available: names that are already deployed so their own dependencies are not needed
+    :return: list of names
+    """
+    order = []
+    state = {}
+
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError('Circular deployment dependency', path + [name])
+        if name not in spec:
+            raise ValueError(f'Unknown contract {name} in deployment spec')
+        state[name] = 'visiting'
+        if name not in available:
+            for dep in spec_dependencies(spec[name]):
+                visit(dep, path + [name])
+        state[name] = 'done'
+        order.append(name)
+
+    for name in (spec if names is None else names):
+        visit(name, [])
+    return order
+
+
+def deploy_spec(w3, contracts, spec, config, names=None, cache=None, cache_file=None,
+                redeploy=(), account=None, pipeline=None):
+    """Deploy the missing part of a declarative deployment spec
+
+    Contracts with an address in cache are connected to, all others (and
+    those listed in redeploy) are deployed with a TransactionPipeline so
+    independent contracts are sent concurrently.  The cache is updated, and
+    written to cache_file if given, as each deployment is mined.
+
+    Spec nodes are dicts with either
+        'args': list of constructor arguments (literals, Contract, Config, Account)
+                or a Config for a list of arguments in args.json
+    or
+        'factory': name of a BFactory whose newBPool() creates the contract
+
+    :param w3: Web3 connection
+    :param contracts: dict of name -> web3 contract factory
+    :param spec: dict of name -> node
+    :param config: contents of args.json
+    :param names: contracts required, default all in spec
+    :param cache: dict of name -> address of deployed contracts, updated in place
+    :param cache_file: optional JSON file the cache is written to after each deployment
+    :param redeploy: names to deploy even if present in cache
+    :param account: deploying account, default w3.eth.defaultAccount
+    :param pipeline: TransactionPipeline to send with, default a new one for account
+    :return: dict of name -> web3 contract for names and their dependencies
+    """
+    account = account or (pipeline.account if pipeline is not None else w3.eth.defaultAccount)
+    pipeline = pipeline or TransactionPipeline(w3, account)
+    cache = {} if cache is None else cache
+    available = {name for name in cache if cache[name] and name not in redeploy}
+    order = topological_order(spec, names, available)
+
+    def write_cache():
+        if cache_file is not None:
+            with open(cache_file, 'w') as f:
+                json.dump(cache, f)
+
+    def resolve(arg, results):
+        if isinstance(arg, Contract):
+            return results[arg.name].address
+        if isinstance(arg, Account):
+            return account
+        if isinstance(arg, Config):
+            value = config.get(arg.name)
+            if value is not None and arg.index is not None:
+                value = value[arg.index] if arg.index < len(value) else None
+            if value is None or value == '':
+                return resolve(arg.default, results)
+            return value * arg.scale if arg.scale is not None else value
+        return arg
+
+    def build(name):
+        node = spec[name]
+        if 'factory' in node:
+            return lambda r: r[node['factory']].functions.newBPool()
+        args = node.get('args', [])
+        if isinstance(args, Config):
+            # Whole list of constructor arguments from args.json
+            return lambda r: contracts[name].constructor(*resolve(args, r))
+        return lambda r: contracts[name].constructor(*[resolve(arg, r) for arg in args])
+
+    def result(name):
+        node = spec[name]
+        if 'factory' in node:
+            def pool_result(receipt, r):
+                events = r[node['factory']].events.LOG_NEW_POOL().processReceipt(receipt)
+                return w3.eth.contract(address=events[0]['args']['pool'], abi=contracts[name].abi)
+            return pool_result
+        return contract_from_receipt(contracts[name])
+
+    deployed = {}
+    steps = {}
+    for name in order:
+        if name in available:
+            deployed[name] = w3.eth.contract(address=cache[name], abi=contracts[name].abi)
+        else:
+            tx = {'gas': 5_000_000} if 'factory' in spec[name] else None
+            steps[name] = TxStep(spec_dependencies(spec[name]), build(name), result(name), tx)
+
+    def on_result(name, contract):
+        cache[name] = contract.address
+        write_cache()
+
+    return pipeline.run(steps, deployed, on_result)
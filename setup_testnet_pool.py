@@ -1,10 +1,16 @@
 import os
+import sys
 import json
 from web3.middleware import construct_sign_and_send_raw_middleware
 from pathlib import Path
 from glob import glob
 import argparse
 
+from calc import bmath
+
+sys.path.append(str(Path(__file__).parent / 'on-chain' / 'scripts'))
+from token_metadata import token_decimals, token_symbol
+
 
 def read_config(contracts=None, get_related=True):
     # Read configuration from local file system
@@ -82,9 +88,9 @@ def print_token_balance(name, tok, holder_address):
     :return: None, prints balance
     """
     tok_address = tok.address
-    tok_decimals = tok.functions.decimals().call()
+    tok_decimals = token_decimals(tok)
     tok_balance = tok.functions.balanceOf(holder_address).call()/ 10 ** tok_decimals
-    tok_symbol = tok.functions.symbol().call()
+    tok_symbol = token_symbol(tok)
     print(f'{name:20} ({tok_address}): {tok_balance:8} {tok_symbol}')
 
 
@@ -141,8 +147,8 @@ def approve_pool(w3, pool, tok, balance):
     )
     tx_receipt = w3.eth.waitForTransactionReceipt(tx_hash)
     owner, spender, value = tok.events.Approval().processReceipt(tx_receipt)[0]['args'].values()
-    value_scaled = value / (10 ** int(tok.functions.decimals().call()))
-    tok_symbol = tok.functions.symbol().call()
+    value_scaled = value / (10 ** token_decimals(tok))
+    tok_symbol = token_symbol(tok)
     print(f'{owner} approved {spender} to spend {value_scaled} {tok_symbol}')
 
 
@@ -255,7 +261,7 @@ def bind_pool(
         # from Balancer Bankless article is use percentage divided by 2
         denorm_wt = int(tok_wt * 10**18 / 2)
         tok = contracts[tok_name]
-        tok_decimals = tok.functions.decimals().call()
+        tok_decimals = token_decimals(tok)
         tok_qty = int(tok_wt / 100 * amount_collateral / tok_price * (10 ** tok_decimals))
         tok_qty_unit = tok_qty / (10**tok_decimals)
         print(f'{tok_name}: weight {tok_wt} = {denorm_wt}, qty {tok_qty_unit} = {tok_qty}')
@@ -334,7 +340,7 @@ def get_pool_balance(w3, contracts, pool_name='SS_BPOOL', tokens=None):
     for token_name in tokens:
         tok = contracts[token_name]
         wt = pool.functions.getNormalizedWeight(contracts[token_name].address).call() / 10**18
-        balance = pool.functions.getBalance(tok.address).call() / 10 ** (tok.functions.decimals().call())
+        balance = pool.functions.getBalance(tok.address).call() / 10 ** (token_decimals(tok))
         print(f'Pool at {pool.address} has {token_name} weight {wt} and balance {balance} ')
 
 
@@ -364,20 +370,23 @@ def get_spot_price(w3, pool, tok_in, tok_out, unitless=True, include_fee=True):
     if not unitless:
         # Take decimals into account
         spot_price = spot_price * 10**(
-                tok_out.functions.decimals().call()
-                - tok_in.functions.decimals().call()
+                token_decimals(tok_out)
+                - token_decimals(tok_in)
                 - 18)
     return spot_price
 
 
-def calc_out_given_in(w3, pool, tok_in, tok_out, qty_in, unitless=True):
+def calc_out_given_in(w3, pool, tok_in, tok_out, qty_in, unitless=True, quoter=None):
+    if quoter is not None:
+        return quoter.calc_out_given_in(tok_in, tok_out, qty_in, unitless=unitless)
+
     balance_in = pool.functions.getBalance(tok_in.address).call()
     wt_in = pool.functions.getDenormalizedWeight(tok_in.address).call()
 
     balance_out = pool.functions.getBalance(tok_out.address).call()
     wt_out = pool.functions.getDenormalizedWeight(tok_out.address).call()
 
-    qty_in_unitless = int(qty_in * 10**(tok_in.functions.decimals().call()))
+    qty_in_unitless = int(qty_in * 10**(token_decimals(tok_in)))
 
     fee = pool.functions.getSwapFee().call()
 
@@ -385,10 +394,146 @@ def calc_out_given_in(w3, pool, tok_in, tok_out, qty_in, unitless=True):
         balance_in, wt_in, balance_out, wt_out, qty_in_unitless, fee
     ).call()
     if not unitless:
-        out_tokens /= 10**(tok_out.functions.decimals().call())
+        out_tokens /= 10**(token_decimals(tok_out))
     return out_tokens
 
 
+class PoolQuoter(object):
+    """Local quote engine for a Balancer pool
+
+    Pool balances, denormalized weights and swap fee are read once per
+    snapshot (all pinned to the same block) and quotes are then computed
+    locally with the exact BMath integer arithmetic in calc.bmath, so any
+    number of quotes costs no further RPC calls.
+
+    The snapshot is refreshed lazily before each quote when a new block
+    has been mined.  With watch_events=True a new block only triggers a
+    refresh if the pool emitted LOG_SWAP, LOG_JOIN or LOG_EXIT since the
+    snapshot.  Mettalex strategy rebinds happen in the same transaction as
+    the pool swap, but weights changed directly by the controller are not
+    seen in this mode so call snapshot() after manual rebinds.
+    """
+    def __init__(self, w3, pool, tokens, watch_events=False):
+        """
+        :param w3: Web3 connection
+        :param pool: Web3 contract for the AMM pool
+        :param tokens: list of Web3 token contracts bound to the pool
+        :param watch_events: default False, if True only refresh on pool events
+        """
+        self.w3 = w3
+        self.pool = pool
+        self.tokens = {tok.address: tok for tok in tokens}
+        # Token decimals are fixed at deployment so only read once
+        self.decimals = {
+            address: token_decimals(tok) for address, tok in self.tokens.items()
+        }
+        self.event_filters = None
+        if watch_events:
+            self.event_filters = [
+                event.createFilter(fromBlock='latest')
+                for event in (pool.events.LOG_SWAP, pool.events.LOG_JOIN, pool.events.LOG_EXIT)
+            ]
+        self.block = None
+        self.balances = {}
+        self.weights = {}
+        self.fee = None
+        self.snapshot()
+
+    def snapshot(self, block=None):
+        """Read pool state at specified block, default latest
+
+        :param block: block number to read pool state at
+        :return: block number of snapshot
+        """
+        block = self.w3.eth.blockNumber if block is None else block
+        pool_fns = self.pool.functions
+        for address in self.tokens:
+            self.balances[address] = pool_fns.getBalance(address).call(block_identifier=block)
+            self.weights[address] = pool_fns.getDenormalizedWeight(address).call(
+                block_identifier=block)
+        self.fee = pool_fns.getSwapFee().call(block_identifier=block)
+        self.block = block
+        return block
+
+    def update(self):
+        """Refresh snapshot if the pool may have changed since it was taken
+
+        :return: True if the snapshot was refreshed
+        """
+        block = self.w3.eth.blockNumber
+        if block == self.block:
+            return False
+        if self.event_filters is not None:
+            # Drain all filters so stale entries do not trigger a later refresh
+            new_entries = [f.get_new_entries() for f in self.event_filters]
+            if not any(new_entries):
+                self.block = block
+                return False
+        self.snapshot(block)
+        return True
+
+    def _pool_args(self, tok_in, tok_out):
+        self.update()
+        return (
+            self.balances[tok_in.address], self.weights[tok_in.address],
+            self.balances[tok_out.address], self.weights[tok_out.address]
+        )
+
+    def calc_out_given_in(self, tok_in, tok_out, qty_in, unitless=True):
+        """Number of tok_out received for qty_in of tok_in, identical to pool.calcOutGivenIn
+
+        :param tok_in: Web3 contract for input token
+        :param tok_out: Web3 contract for output token
+        :param qty_in: input quantity in token units e.g. 1.5 for 1.5 USDT
+        :param unitless: default True, if False output is scaled by token decimals
+        :return: output token quantity
+        """
+        qty_in_unitless = int(qty_in * 10**self.decimals[tok_in.address])
+        out_tokens = bmath.calc_out_given_in(
+            *self._pool_args(tok_in, tok_out), qty_in_unitless, self.fee)
+        if not unitless:
+            out_tokens /= 10**self.decimals[tok_out.address]
+        return out_tokens
+
+    def calc_in_given_out(self, tok_in, tok_out, qty_out, unitless=True):
+        """Number of tok_in required to receive qty_out of tok_out, identical to pool.calcInGivenOut
+
+        :param tok_in: Web3 contract for input token
+        :param tok_out: Web3 contract for output token
+        :param qty_out: output quantity in token units
+        :param unitless: default True, if False input is scaled by token decimals
+        :return: input token quantity
+        """
+        qty_out_unitless = int(qty_out * 10**self.decimals[tok_out.address])
+        in_tokens = bmath.calc_in_given_out(
+            *self._pool_args(tok_in, tok_out), qty_out_unitless, self.fee)
+        if not unitless:
+            in_tokens /= 10**self.decimals[tok_in.address]
+        return in_tokens
+
+    def calc_spot_price(self, tok_in, tok_out, include_fee=True):
+        """Unitless spot price, identical to pool.getSpotPrice or getSpotPriceSansFee
+        """
+        return bmath.calc_spot_price(
+            *self._pool_args(tok_in, tok_out), self.fee if include_fee else 0)
+
+    def quote_ladder(self, tok_in, tok_out, qtys_in, unitless=True):
+        """Output quantities for a ladder of input sizes evaluated in one pass
+
+        :param tok_in: Web3 contract for input token
+        :param tok_out: Web3 contract for output token
+        :param qtys_in: iterable of input quantities in token units
+        :param unitless: default True, if False output is scaled by token decimals
+        :return: list of output token quantities
+        """
+        qtys_unitless = [int(qty * 10**self.decimals[tok_in.address]) for qty in qtys_in]
+        out_tokens = bmath.calc_out_given_in_array(
+            *self._pool_args(tok_in, tok_out), qtys_unitless, self.fee).tolist()
+        if not unitless:
+            out_tokens = [qty / 10**self.decimals[tok_out.address] for qty in out_tokens]
+        return out_tokens
+
+
 def set_public_swap(w3, pool, public=False):
     """Allow or disallow swaps with pool
 
@@ -418,7 +563,7 @@ def get_public_swap(w3, pool):
 def swap_amount_in(w3, pool, tok_in, qty_in, tok_out, min_qty_out=None, max_price=None):
     acct = w3.eth.defaultAccount
 
-    qty_in_unitless = int(qty_in * 10**(tok_in.functions.decimals().call()))
+    qty_in_unitless = int(qty_in * 10**(token_decimals(tok_in)))
 
     if qty_in_unitless > tok_in.functions.allowance(acct, pool.address).call():
         approve_pool(w3, pool, tok_in, qty_in_unitless)
@@ -434,7 +579,7 @@ def swap_amount_in(w3, pool, tok_in, qty_in, tok_out, min_qty_out=None, max_pric
         max_price = int(spot_price_unitless * 1/0.9)
         print(f'Max price not specified: using {max_price}')
 
-    min_qty_out_unitless = int(min_qty_out * 10**(tok_out.functions.decimals().call()))
+    min_qty_out_unitless = int(min_qty_out * 10**(token_decimals(tok_out)))
 
     tx_hash = pool.functions.swapExactAmountIn(
         tok_in.address, qty_in_unitless,
@@ -455,13 +600,15 @@ if __name__ == '__main__':
     import sys
     os.chdir('price-leveraged-token/market-maker')
     sys.path.append(os.getcwd())
-    from setup_testnet_pool import connect, print_balance, deploy_pool, bind_pool, bind_token, approve_pool, get_pool_balance, unbind_pool, set_fee, get_spot_price, swap_amount_in, set_public_swap, calc_out_given_in, rebalance_pool, get_public_swap
+    from setup_testnet_pool import connect, print_balance, deploy_pool, bind_pool, bind_token, approve_pool, get_pool_balance, unbind_pool, set_fee, get_spot_price, swap_amount_in, set_public_swap, calc_out_given_in, rebalance_pool, get_public_swap, PoolQuoter
     w3, contracts = connect()
     get_pool_balance(w3, contracts)
     get_spot_price(w3, pool, ctok, stok, unitless=True, include_fee=False) 
     get_spot_price(w3, pool, ctok, stok, unitless=False, include_fee=False) 
     get_spot_price(w3, pool, ctok, ltok, unitless=False, include_fee=False) 
     rebalance_weights(w3, contracts, 0.4)  # Price is in fraction of cap - floor 
+    quoter = PoolQuoter(w3, pool, [ctok, ltok, stok])
+    quoter.quote_ladder(ctok, ltok, range(1, 51), unitless=False)
     """
 
     # Setup connections and variables in environment